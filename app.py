@@ -1,71 +1,305 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
+import gzip
+import hashlib
+import json
 import os
-
-from data import load_tickers_from_json, download_history
-from scanners import (
-    scan_golden_cross_for_tickers,
-    scan_llv_sma50_value_for_tickers,
-    scan_mode4_combo_for_tickers,
-    scan_lower_low_3days_for_tickers,
-)
+import time
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+import metrics
+from data import load_tickers_from_json, memory_cache_stats
+from data.intervals import check_interval
+from jobs import get_job_manager, iter_scan
+from result_cache import result_cache_stats, run_mode_cached, run_modes_cached, scan_key
+from results import pyarrow, to_arrow, to_columns, to_csv, to_json
+from rules import RuleError, compile_rule
+from scanners import parse_modes, resolve_mode
+from scheduler import get_prewarmer
 
 app = Flask(__name__)
 
+# Refresh the caches after the market close when asked to
+if os.environ.get("STOCKS_PREWARM") == "1":
+    get_prewarmer().start()
+
+MEMORY_CACHE = metrics.gauge("stocks_memory_cache", "In-process history cache counters.", ("stat",))
+RESULT_CACHE = metrics.gauge("stocks_result_cache", "Scan result cache counters.", ("stat",))
+
+
+def _collect_cache_stats():
+    for name, value in memory_cache_stats().items():
+        MEMORY_CACHE.set(value, stat=name)
+    for name, value in result_cache_stats().items():
+        RESULT_CACHE.set(value, stat=name)
+
+
+metrics.add_collector(_collect_cache_stats)
+
 
 @app.route("/favicon.ico")
 def favicon():
     return send_from_directory(app.root_path, "favicon.ico", mimetype="image/vnd.microsoft.icon")
 
+
+def _load_universe(path):
+    """Resolve ``path`` next to this file and return (tickers, label)."""
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(__file__), path)
+    return load_tickers_from_json(path), os.path.basename(path)
+
+
+def _rule_error(rule):
+    """Return why a custom rule is invalid, or None."""
+    if not rule:
+        return None
+    try:
+        compile_rule(rule)
+    except RuleError as e:
+        return f"Invalid rule: {e}"
+    return None
+
+
+def _interval_error(interval):
+    """Return why a bar interval cannot be scanned, or None."""
+    try:
+        check_interval(interval)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+# Representations of GET /scan: format -> (mimetype, available)
+FORMATS = {
+    "json": ("application/json", True),
+    "msgpack": ("application/msgpack", msgpack is not None),
+    "csv": ("text/csv", True),
+    "arrow": ("application/vnd.apache.arrow.stream", pyarrow is not None),
+}
+# Formats that hold a single result table
+TABLE_FORMATS = ("csv", "arrow")
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+
+def _scan_format(several: bool = False):
+    """The ``format`` query param, or the best match for the Accept header.
+
+    Single-table formats are not offered for multi-mode scans.
+    """
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt.lower()
+    offered = {
+        mimetype: name
+        for name, (mimetype, available) in FORMATS.items()
+        if available and not (several and name in TABLE_FORMATS)
+    }
+    if msgpack is not None:
+        offered["application/x-msgpack"] = "msgpack"
+    return offered.get(request.accept_mimetypes.best_match(list(offered), default="application/json"), "json")
+
+
+def _scan_body(fmt, results, columns: bool):
+    """Serialize a ResultBatch (or mode -> ResultBatch) as ``fmt``."""
+    if fmt == "csv":
+        return to_csv(results)
+    if fmt == "arrow":
+        return to_arrow(results)
+    # MessagePack is always columnar; JSON keeps the row dicts unless asked
+    table = to_columns if columns or fmt == "msgpack" else to_json
+    data = {m: table(batch) for m, batch in results.items()} if isinstance(results, dict) else table(results)
+    payload = {"status": "ok", "data": data}
+    if fmt == "msgpack":
+        return msgpack.packb(payload)
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def _compress(response):
+    """Encode ``response`` with brotli or gzip if the client accepts it."""
+    if response.content_length is None or response.content_length < MIN_COMPRESS_SIZE:
+        return response
+    body = response.get_data()
+    if brotli is not None and request.accept_encodings["br"]:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif request.accept_encodings["gzip"]:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
 @app.route("/scan", methods=["GET"])
 def scan():
+    """Scan a universe.
+
+    The representation is chosen by ``format`` (json, msgpack, csv, arrow)
+    or the Accept header; ``columns=1`` makes JSON columnar. CSV and Arrow
+    take a single mode. ``interval`` selects the bars (default 1d; 1m, 5m,
+    15m and 1h scan intraday). Responses are gzip/brotli encoded when accepted and
+    carry an ETag derived from the result-cache keys, so a client revalidating
+    unchanged results gets a 304 without a scan.
+    """
 
     # Get query params
     path = request.args.get("file", "idx80.json")
     mode = request.args.get("mode", "1")
+    rule = request.args.get("rule", "").strip() or None
+    interval = request.args.get("interval", "1d").strip()
+    several = "," in mode and not rule
+    fmt = _scan_format(several)
+    columns = request.args.get("columns", "").lower() in ("1", "true", "yes")
+
+    error = _rule_error(rule) or _interval_error(interval)
+    if error:
+        return jsonify({"error": error}), 400
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unknown format {fmt!r}; use {', '.join(FORMATS)}"}), 400
+    if not FORMATS[fmt][1]:
+        return jsonify({"error": f"format={fmt} is not available on this server"}), 400
+    if fmt in TABLE_FORMATS and several:
+        return jsonify({"error": f"format={fmt} supports a single mode"}), 400
+
+    tickers, label = _load_universe(path)
+    if not tickers:
+        return jsonify({"error": "No tickers found"}), 400
 
-    # Resolve file path
-    if not os.path.isabs(path):
-        path = os.path.join(os.path.dirname(__file__), path)
+    # The keys change whenever the result could; the ETag adds the representation
+    if several:
+        keys = {m: scan_key(m, tickers, interval=interval) for m in parse_modes(mode)}
+    else:
+        keys = {resolve_mode(mode): scan_key(mode, tickers, rule=rule, interval=interval)}
+    tag = hashlib.sha1(json.dumps([fmt, columns, keys], sort_keys=True).encode()).hexdigest()
+    headers = {"Vary": "Accept, Accept-Encoding", "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(tag, weak=True)
+        return response
+
+    # Identical scans over unchanged data are served from the result cache
+    if several:
+        # Several modes in one pass; data is grouped by mode
+        results, _ = run_modes_cached(list(keys), tickers, label=label, keys=keys, interval=interval)
+    else:
+        key = next(iter(keys.values()))
+        results, _ = run_mode_cached(mode, tickers, label=label, rule=rule, key=key, interval=interval)
+
+    with metrics.timed("serialize"):
+        response = Response(_scan_body(fmt, results, columns), mimetype=FORMATS[fmt][0], headers=headers)
+        response.set_etag(tag, weak=True)
+        return _compress(response)
 
-    tickers = load_tickers_from_json(path)
+
+@app.route("/scan", methods=["POST"])
+def submit_scan():
+    # Parameters may come as JSON, form fields or query params
+    params = request.get_json(silent=True) or request.values
+    path = params.get("file", "idx80.json")
+    mode = params.get("mode", "1")
+    rule = (params.get("rule") or "").strip() or None
+    interval = (params.get("interval") or "1d").strip()
+
+    error = _rule_error(rule) or _interval_error(interval)
+    if error:
+        return jsonify({"error": error}), 400
+
+    tickers, label = _load_universe(path)
     if not tickers:
         return jsonify({"error": "No tickers found"}), 400
 
-    label = os.path.basename(path)
-
-    # Call scanners based on mode
-    if mode == "2":
-        result = scan_llv_sma50_value_for_tickers(
-            tickers,
-            llv_window=5,
-            sma_period=50,
-            near_low=0.99,
-            near_high=1.02,
-            min_value=1e9,
-            label=label,
-        )
+    job = get_job_manager().submit(mode, tickers, label=label, rule=rule, interval=interval)
+    return jsonify({"status": "accepted", "job": job.id, "url": f"/scan/{job.id}"}), 202
 
-    elif mode == "3":
-        result = scan_llv_sma50_value_for_tickers(
-            tickers,
-            llv_window=5,
-            sma_period=200,
-            near_low=0.99,
-            near_high=1.02,
-            min_value=1e9,
-            label=label,
-        )
 
-    elif mode == "4":
-        result = scan_mode4_combo_for_tickers(tickers, label=label)
+@app.route("/scan/stream", methods=["GET"])
+def scan_stream():
+    """Stream matches as they are found, then a summary.
+
+    Server-sent events by default; ``format=ndjson`` (or an
+    ``application/x-ndjson`` Accept header) emits one JSON object per line
+    instead. Errors are reported in the stream as an ``error`` event.
+    """
+    path = request.args.get("file", "idx80.json")
+    mode = request.args.get("mode", "1")
+    rule = request.args.get("rule", "").strip() or None
+    interval = request.args.get("interval", "1d").strip()
+    fmt = request.args.get("format")
+    if fmt is None:
+        fmt = "ndjson" if "application/x-ndjson" in request.headers.get("Accept", "") else "sse"
 
-    elif mode == "5":
-        result = scan_lower_low_3days_for_tickers(tickers, label=label)
+    if fmt == "ndjson":
+        mimetype = "application/x-ndjson"
 
+        def event(kind, data):
+            return json.dumps({"event": kind, "data": data}) + "\n"
     else:
-        result = scan_golden_cross_for_tickers(tickers, label=label)
+        mimetype = "text/event-stream"
+
+        def event(kind, data):
+            return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    tickers, label = _load_universe(path)
+
+    def generate():
+        error = _rule_error(rule) or _interval_error(interval)
+        if error:
+            yield event("error", {"error": error})
+            return
+        if not tickers:
+            yield event("error", {"error": "No tickers found"})
+            return
+        started = time.monotonic()
+        count = 0
+        processed = 0
+        cached = False
+        try:
+            for processed, batch, cached in iter_scan(mode, tickers, label=label, rule=rule, interval=interval):
+                for row in batch.records():
+                    count += 1
+                    yield event("row", row)
+                yield event("progress", {"processed": processed, "total": len(tickers)})
+        except Exception as e:
+            yield event("error", {"error": repr(e)})
+            return
+        yield event(
+            "summary",
+            {
+                "count": count,
+                "processed": processed,
+                "total": len(tickers),
+                "cached": cached,
+                "duration": round(time.monotonic() - started, 3),
+            },
+        )
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(generate(), mimetype=mimetype, headers=headers)
+
+
+@app.route("/scan/<job_id>", methods=["GET"])
+def scan_status(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown scan job"}), 404
+    return jsonify({"status": "ok", "job": job.to_dict()})
 
-    return jsonify({"status": "ok", "data": result})
+
+@app.route("/prewarm/status", methods=["GET"])
+def prewarm_status():
+    return jsonify(get_prewarmer().status())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/")
@@ -442,6 +676,11 @@ def home():
             <div class="mode-pill"><strong>5</strong> Three-day lower-low pattern on daily lows.</div>
           </div>
         </div>
+        <div class="row">
+          <div class="field-label">Custom rule (optional)</div>
+          <input id="rule-input" class="input" placeholder="close &gt; sma(50) and close * volume &gt;= 1e9" />
+          <div class="hint">Replaces the scan mode when set.</div>
+        </div>
         <div class="actions">
           <button id="run-btn" class="btn">
             <span class="dot"></span>
@@ -480,6 +719,7 @@ def home():
     const runBtn = document.getElementById("run-btn");
     const fileInput = document.getElementById("file-input");
     const modeInput = document.getElementById("mode-input");
+    const ruleInput = document.getElementById("rule-input");
     const statusBox = document.getElementById("status");
     const emptyState = document.getElementById("empty-state");
     const scrollArea = document.querySelector(".results-scroll");
@@ -561,6 +801,77 @@ def home():
       metaEl.textContent = "";
     }
 
+    let stream = null;
+    let streamKeys = null;
+
+    function appendRow(row) {
+      if (!streamKeys) {
+        streamKeys = orderKeys(Object.keys(row));
+        headRow.innerHTML = streamKeys
+          .map((k) => `<th>${toLabel(k)}</th>`)
+          .join("");
+        emptyState.style.display = "none";
+        scrollArea.style.display = "block";
+      }
+      const tr = document.createElement("tr");
+      tr.innerHTML = streamKeys.map((k) => {
+        const v = row[k];
+        const cls = isNumeric(v) ? "numeric" : "";
+        return `<td class="${cls}">${v == null ? "" : v}</td>`;
+      }).join("");
+      bodyEl.appendChild(tr);
+    }
+
+    function scanQuery(file, mode) {
+      const rule = ruleInput.value.trim();
+      let query = `file=${encodeURIComponent(file)}&mode=${encodeURIComponent(mode)}`;
+      if (rule) query += `&rule=${encodeURIComponent(rule)}`;
+      return query;
+    }
+
+    function streamScan(file, mode) {
+      if (stream) stream.close();
+      streamKeys = null;
+      bodyEl.innerHTML = "";
+      headRow.innerHTML = "";
+      let count = 0;
+
+      const url = `/scan/stream?${scanQuery(file, mode)}`;
+      stream = new EventSource(url);
+      const finish = () => {
+        stream.close();
+        stream = null;
+        runBtn.disabled = false;
+      };
+
+      stream.addEventListener("row", (e) => {
+        count += 1;
+        appendRow(JSON.parse(e.data));
+        setStatus("loading", `Running scan... ${count} result(s) so far.`);
+      });
+      stream.addEventListener("progress", (e) => {
+        const p = JSON.parse(e.data);
+        metaEl.textContent = `Scanned ${p.processed} of ${p.total} symbols...`;
+      });
+      stream.addEventListener("summary", (e) => {
+        const s = JSON.parse(e.data);
+        setStatus("ok", s.count === 0 ? "Scan completed – no matches." : `Scan completed – ${s.count} result(s).`);
+        if (s.count === 0) renderResults([], "");
+        else metaEl.textContent = "";
+        finish();
+      });
+      stream.addEventListener("error", (e) => {
+        // Server-sent error events carry a message; connection errors do not
+        let msg = "Failed to reach server.";
+        if (e.data) {
+          try { msg = JSON.parse(e.data).error || msg; } catch (_) {}
+        }
+        setStatus("error", msg);
+        if (count === 0) renderResults([], "");
+        finish();
+      });
+    }
+
     async function runScan() {
       const file = fileInput.value.trim() || "idx80.json";
       const mode = modeInput.value;
@@ -568,8 +879,13 @@ def home():
       setStatus("loading", "Running scan...");
       metaEl.textContent = "Running scan...";
 
+      if (window.EventSource) {
+        streamScan(file, mode);
+        return;
+      }
+
       try {
-        const url = `/scan?file=${encodeURIComponent(file)}&mode=${encodeURIComponent(mode)}`;
+        const url = `/scan?${scanQuery(file, mode)}`;
         const response = await fetch(url);
         const payload = await response.json().catch(() => null);
 
@@ -610,6 +926,13 @@ def home():
         runScan();
       }
     });
+
+    ruleInput.addEventListener("keydown", (e) => {
+      if (e.key === "Enter") {
+        e.preventDefault();
+        runScan();
+      }
+    });
   </script>
 </body>
 </html>
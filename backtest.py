@@ -0,0 +1,193 @@
+"""Historical backtests of the scan modes.
+
+``backtest`` evaluates a scan mode (or a custom rule) on every bar of a
+universe's cached history in one pass: the rule's indicators are computed
+over the whole dates x symbols panel, as for the latest-bar scans, and its
+condition is evaluated on all rows at once instead of only the last one.
+
+Every hit is reported with its close and the forward return over each
+horizon, counted in bars of that symbol's own history. The hits are then
+summarized per horizon against the unconditional forward returns of all
+bars where the rule could be evaluated.
+
+    python backtest.py --file ihsg.json --mode 4 --horizons 5,20,60
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import engine
+from data import load_tickers_from_json
+from metrics import instrumented
+from results import Field, ResultBatch, print_batch
+from rules import COLUMNS, compile_rule
+from scanners import describe, mode_rule
+
+# Forward-return horizons in bars, and the history backtests read by default
+HORIZONS = (5, 20, 60)
+BACKTEST_PERIOD = "5y"
+
+
+class Backtest:
+    """Outcome of a backtest: the hits and their per-horizon statistics."""
+
+    def __init__(self, hits: ResultBatch, stats: ResultBatch, symbols: int, bars: int):
+        self.hits = hits
+        self.stats = stats
+        self.symbols = symbols
+        self.bars = bars
+
+
+def forward_returns(close, horizon: int):
+    """Return from each bar's close to the close ``horizon`` bars later.
+
+    ``close`` is a right-aligned dates x symbols matrix; bars without a close
+    that far ahead get NaN.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(close.shape, np.nan)
+    if 0 < horizon < len(close):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[:-horizon] = close[horizon:] / close[:-horizon] - 1
+    return out
+
+
+def summarize(returns, mask):
+    """Count, hit rate, mean and median of the forward ``returns`` where ``mask``."""
+    values = returns[mask]
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return 0, np.nan, np.nan, np.nan
+    return len(values), float((values > 0).mean()), float(values.mean()), float(np.median(values))
+
+
+def _stats_fields():
+    return [
+        Field("horizon", "str", "Horizon"),
+        Field("signals", "float", "Signals", ",.0f"),
+        Field("hit_rate", "float", "Hit rate", ".1%"),
+        Field("mean", "float", "Mean", ".2%"),
+        Field("median", "float", "Median", ".2%"),
+        Field("base_hit_rate", "float", "Base hit rate", ".1%"),
+        Field("base_mean", "float", "Base mean", ".2%"),
+        Field("excess", "float", "Excess", ".2%"),
+    ]
+
+
+@instrumented("backtest")
+def backtest(
+    tickers,
+    mode="4",
+    rule: str = None,
+    horizons=HORIZONS,
+    period: str = BACKTEST_PERIOD,
+    start=None,
+    end=None,
+    entries_only: bool = False,
+):
+    """Replay scan ``mode`` (or a custom ``rule``) over ``tickers``' history.
+
+    Only bars dated within ``start``..``end`` (inclusive, both optional)
+    count as signals. With ``entries_only`` a symbol only signals on the
+    first bar of each run of consecutive hits. Returns a Backtest.
+
+    In the statistics, the hit rate is the share of signals followed by a
+    positive return; the base columns are the same figures over every bar
+    the rule could be evaluated on, and excess is mean minus base mean.
+    """
+    compiled = compile_rule(rule) if rule else mode_rule(mode)
+    horizons = sorted({int(h) for h in horizons if int(h) > 0})
+    fields = set(compiled.fields) | {"Close"}
+    fields = tuple(field for field in COLUMNS.values() if field in fields)
+    wide = engine.load_wide(tickers, period=period, interval="1d", fields=fields, timeframes=compiled.timeframes)
+    hit_fields = [Field("symbol", "str", "Symbol"), Field("date", "date", "Date"), Field("close", "float", "Close")]
+    hit_fields += [Field(f"fwd_{h}", "float", f"Fwd {h}", ".2%") for h in horizons]
+
+    if not wide.symbols:
+        empty = ResultBatch(hit_fields, title="Signals", empty="No data to backtest.")
+        return Backtest(empty, ResultBatch(_stats_fields(), title="Forward returns"), 0, 0)
+
+    match, valid = engine.rule_signals(compiled, wide)
+    dates = wide.dates
+    window = ~np.isnat(dates)
+    if start is not None:
+        window &= dates >= np.datetime64(pd.Timestamp(start), "ns")
+    if end is not None:
+        window &= dates <= np.datetime64(pd.Timestamp(end), "ns")
+    valid &= window
+    match &= window
+    if entries_only:
+        match[1:] &= ~match[:-1]
+
+    close = wide["Close"].to_numpy()
+    returns = {h: forward_returns(close, h) for h in horizons}
+
+    # Hits in date order, then ticker order
+    rows, cols = np.nonzero(match)
+    order = np.lexsort((cols, dates[rows, cols]))
+    rows, cols = rows[order], cols[order]
+    columns = {
+        "symbol": [wide.symbols[j] for j in cols],
+        "date": [str(d) for d in dates[rows, cols].astype("M8[D]")],
+        "close": close[rows, cols],
+    }
+    for h in horizons:
+        columns[f"fwd_{h}"] = returns[h][rows, cols]
+    label = describe(mode, rule)
+    hits = ResultBatch(hit_fields, columns, title=f"Signals for {label}", empty=f"No signals for {label}.")
+
+    stats = []
+    for h in horizons:
+        count, hit_rate, mean, median = summarize(returns[h], match)
+        _, base_hit_rate, base_mean, _ = summarize(returns[h], valid)
+        stats.append((f"{h} bars", count, hit_rate, mean, median, base_hit_rate, base_mean, mean - base_mean))
+    stats = ResultBatch.from_rows(_stats_fields(), stats, title="Forward returns after a signal")
+    return Backtest(hits, stats, len(wide.symbols), int(valid.any(axis=1).sum()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest a scan mode over the cached history.")
+    parser.add_argument("--file", default="idx80.json", help="JSON file with tickers (default: %(default)s)")
+    parser.add_argument("--mode", default="4", help="scan mode (default: %(default)s)")
+    parser.add_argument("--rule", help="custom rule instead of a mode")
+    parser.add_argument("--horizons", default=",".join(map(str, HORIZONS)), help="forward horizons in bars")
+    parser.add_argument("--period", default=BACKTEST_PERIOD, help="history to load (default: %(default)s)")
+    parser.add_argument("--start", help="first signal date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last signal date (YYYY-MM-DD)")
+    parser.add_argument("--entries-only", action="store_true", help="count only the first bar of each run of hits")
+    parser.add_argument("--hits", type=int, default=20, help="latest hits to list (default: %(default)s, -1 for all)")
+    args = parser.parse_args(argv)
+
+    path = args.file
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(__file__), path)
+    tickers = load_tickers_from_json(path)
+    if not tickers:
+        return 1
+
+    horizons = [int(part) for part in args.horizons.split(",") if part.strip()]
+    result = backtest(
+        tickers,
+        mode=args.mode,
+        rule=args.rule,
+        horizons=horizons,
+        period=args.period,
+        start=args.start,
+        end=args.end,
+        entries_only=args.entries_only,
+    )
+    print(f"\nBacktested {result.symbols} symbols over up to {result.bars} bars: {len(result.hits)} signal(s).")
+    hits = result.hits
+    if args.hits >= 0 and len(hits) > args.hits:
+        latest = hits.records()[len(hits) - args.hits:]
+        hits = ResultBatch.from_records(hits.fields, latest, title=f"{hits.title} (latest {args.hits})")
+    print_batch(hits)
+    print_batch(result.stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""Offline benchmarks for the scanners and the data layer.
+
+``python -m bench`` generates synthetic universes (30 / 100 / 870 / 5,000
+symbols x 1-10 years of daily bars) into the columnar cache format, times
+the scans and data loading on them and writes the timings as JSON. All
+downloads are served by a synthetic stand-in for ``yf.download``, so no
+network access is needed. See ``python -m bench --help``.
+
+Typical use::
+
+    python -m bench --quick --output baseline.json
+    # ... change something ...
+    python -m bench --quick --baseline baseline.json
+"""
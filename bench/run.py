@@ -0,0 +1,247 @@
+"""Benchmark runner.
+
+For every universe size x history length it writes a synthetic cache into a
+temporary directory and times:
+
+- ``load``: building the panel from the per-symbol caches (cold: nothing in
+  memory and no panel file) and loading it again (warm: panel mapped);
+- ``scan_mode<N>``: each ``scan_*_for_tickers`` mode (cold: no Mode 4
+  indicator state yet; warm: repeated scans) and ``scan_modes``, all modes
+  in one pass;
+- ``add_mode4_indicators`` over every symbol's history.
+
+Results are printed as a table and written as JSON. Given a baseline JSON
+from an earlier run, timings that got slower than the threshold allows are
+reported and the exit status is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import engine
+import kernels
+from bench.synthetic import SyntheticSource, offline, universe, write_universe
+from data import clear_memory_cache, close_panels, get_cache_backend, load_panel, set_cache_backend
+from data.cache import ColumnarCache
+from data.panel import panel_path
+from indicators import add_mode4_indicators
+from scanners import MODES, scan_modes_for_tickers
+
+SIZES = (30, 100, 870, 5000)
+YEARS = (1, 10)
+PERIOD = "1y"
+INTERVAL = "1d"
+
+# Relative slowdown reported as a regression, and the absolute noise floor
+THRESHOLD = 0.25
+MIN_DELTA = 0.005
+
+
+def _quiet(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def _time(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def measure(run, reset=None, repeat: int = 3):
+    """Time ``run`` once after ``reset`` (cold) and ``repeat`` more times (warm)."""
+    if reset is not None:
+        reset()
+    cold = _time(run)
+    runs = [_time(run) for _ in range(repeat)]
+    return {
+        "cold": round(cold, 6),
+        "warm": round(min(runs), 6) if runs else None,
+        "runs": [round(r, 6) for r in runs],
+    }
+
+
+def _drop_panel(root):
+    clear_memory_cache()
+    close_panels()
+    path = panel_path(root, PERIOD, INTERVAL)
+    base = os.path.splitext(os.path.basename(path))[0]
+    for name in os.listdir(root):
+        if name.startswith(base):
+            os.remove(os.path.join(root, name))
+
+
+def _drop_mode4_states(root):
+    engine.clear_mode4_states()
+    for name in os.listdir(root):
+        state = os.path.join(root, name, f"mode4_{PERIOD}.json")
+        if os.path.exists(state):
+            os.remove(state)
+
+
+def bench_universe(size: int, years: float, repeat: int = 3, modes=None):
+    """Run all benchmarks for one synthetic universe; returns result records."""
+    symbols = universe(size)
+    modes = list(modes or MODES)
+    previous = get_cache_backend()
+    root = tempfile.mkdtemp(prefix="stocks-bench-")
+    source = SyntheticSource(years)
+    records = []
+
+    def record(name, result, **extra):
+        records.append({"name": name, "symbols": size, "years": years, **extra, **result})
+
+    try:
+        set_cache_backend(ColumnarCache(root))
+        with offline(source):
+            started = time.perf_counter()
+            rows = write_universe(get_cache_backend(), symbols, years, PERIOD, INTERVAL)
+            print(f"  {size} symbols x {years}y: {rows:,} rows written in {time.perf_counter() - started:.1f}s")
+
+            result = measure(lambda: load_panel(symbols, PERIOD, INTERVAL), lambda: _drop_panel(root), repeat)
+            record("load", result, rows=rows)
+
+            for mode in modes:
+                scanner, params = MODES[mode]
+                result = measure(
+                    lambda: _quiet(scanner, symbols, workers=1, **params),
+                    lambda: _drop_mode4_states(root),
+                    repeat,
+                )
+                record(f"scan_mode{mode}", result)
+            result = measure(lambda: _quiet(scan_modes_for_tickers, symbols, modes), repeat=repeat)
+            record("scan_modes", result)
+
+            panel = load_panel(symbols, PERIOD, INTERVAL)
+            histories = [panel.history(symbol) for symbol in symbols if symbol in panel]
+            result = measure(lambda: [add_mode4_indicators(hist.copy()) for hist in histories], repeat=repeat)
+            record("add_mode4_indicators", result)
+
+        if source.calls:
+            print(f"  warning: {source.calls} download call(s) reached the synthetic source")
+    finally:
+        set_cache_backend(previous)
+        clear_memory_cache()
+        close_panels()
+        engine.clear_mode4_states()
+        shutil.rmtree(root, ignore_errors=True)
+    return records
+
+
+def environment():
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "kernels": kernels.BACKEND,
+    }
+
+
+def _key(record):
+    return (record["name"], record["symbols"], record["years"])
+
+
+def compare(results, baseline, threshold: float = THRESHOLD, min_delta: float = MIN_DELTA):
+    """Return the timings in ``results`` that regressed against ``baseline``.
+
+    A timing regresses when it is more than ``threshold`` (a fraction)
+    slower than the baseline and by at least ``min_delta`` seconds.
+    """
+    previous = {_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for record in results.get("results", []):
+        old = previous.get(_key(record))
+        if old is None:
+            continue
+        for field in ("cold", "warm"):
+            new_value, old_value = record.get(field), old.get(field)
+            if new_value is None or not old_value:
+                continue
+            if new_value > old_value * (1 + threshold) and new_value - old_value >= min_delta:
+                regressions.append(
+                    {
+                        "name": record["name"],
+                        "symbols": record["symbols"],
+                        "years": record["years"],
+                        "field": field,
+                        "baseline": old_value,
+                        "current": new_value,
+                        "ratio": round(new_value / old_value, 3),
+                    }
+                )
+    return regressions
+
+
+def print_results(records):
+    print(f"\n{'benchmark':<22} {'symbols':>7} {'years':>5} {'cold s':>10} {'warm s':>10}")
+    for r in records:
+        warm = f"{r['warm']:.4f}" if r["warm"] is not None else "-"
+        print(f"{r['name']:<22} {r['symbols']:>7} {r['years']:>5} {r['cold']:>10.4f} {warm:>10}")
+
+
+def _numbers(text, cast):
+    return [cast(part) for part in str(text).split(",") if part.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark the scanners on synthetic data.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="universe sizes (default: %(default)s)")
+    parser.add_argument("--years", default=",".join(map(str, YEARS)), help="years of history (default: %(default)s)")
+    parser.add_argument("--modes", default=",".join(MODES), help="scan modes to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs per benchmark (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help="only 30 and 100 symbols x 1 year")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown (default: %(default)s)")
+    parser.add_argument("--min-delta", type=float, default=MIN_DELTA, help="ignore changes below this many seconds")
+    args = parser.parse_args(argv)
+
+    sizes = (30, 100) if args.quick else _numbers(args.sizes, int)
+    years = (1,) if args.quick else _numbers(args.years, float)
+    years = [int(y) if float(y).is_integer() else y for y in years]
+    modes = [m for m in _numbers(args.modes, str) if m in MODES]
+
+    records = []
+    for size in sizes:
+        for length in years:
+            records.extend(bench_universe(size, length, repeat=args.repeat, modes=modes))
+    results = {"environment": environment(), "results": records}
+    print_results(records)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for r in regressions:
+                print(
+                    f"  {r['name']} ({r['symbols']} symbols, {r['years']}y, {r['field']}): "
+                    f"{r['baseline']:.4f}s -> {r['current']:.4f}s (x{r['ratio']})"
+                )
+            return 1
+        print(f"\nNo regressions above {args.threshold:.0%} against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
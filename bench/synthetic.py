@@ -0,0 +1,123 @@
+"""Synthetic OHLCV universes for offline benchmarks.
+
+Histories are random walks with per-symbol drift, volatility, price level
+and turnover, so every scan mode finds some matches. They are generated
+from a seed derived from the symbol name and end on today's date, which
+makes them deterministic and keeps the cache fresh (no top-ups are
+attempted). Some symbols list later than others, so universes have ragged
+histories like the real IDX lists do.
+"""
+import contextlib
+import zlib
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from data import set_downloader
+from data.cache import save_state
+
+TRADING_DAYS = 252
+
+
+def universe(size: int, prefix: str = "SYN"):
+    """Return ``size`` synthetic ticker symbols."""
+    return [f"{prefix}{i:05d}.JK" for i in range(size)]
+
+
+def _calendar(rows: int, end=None):
+    # Business days ending today, so cached histories count as up to date
+    end = pd.Timestamp(end or pd.Timestamp.now()).normalize()
+    dates = pd.bdate_range(end=end - pd.Timedelta(days=1), periods=rows - 1)
+    return dates.append(pd.DatetimeIndex([end])).rename("Date")
+
+
+def history(symbol: str, years: float = 1, end=None):
+    """Return a synthetic daily history for ``symbol`` in yfinance's layout."""
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    rows = max(2, int(round(years * TRADING_DAYS)))
+    dates = _calendar(rows, end)
+
+    # One in ten symbols listed part-way through the period
+    if rng.random() < 0.1:
+        listed = int(rng.integers(1, max(2, rows - TRADING_DAYS // 2)))
+        dates = dates[listed:]
+        rows = len(dates)
+
+    drift = rng.normal(0.0003, 0.0008)
+    vol = rng.uniform(0.01, 0.04)
+    returns = rng.normal(drift, vol, rows)
+    # Slow regime changes give trends (and crosses) to scan for
+    returns += np.repeat(rng.normal(0, vol / 4, rows // 60 + 1), 60)[:rows]
+    close = rng.lognormal(np.log(1000), 1.2) * np.exp(np.cumsum(returns))
+    open_ = close * np.exp(rng.normal(0, vol / 3, rows))
+    spread = np.abs(rng.normal(0, vol / 2, (2, rows)))
+    high = np.maximum(open_, close) * (1 + spread[0])
+    low = np.minimum(open_, close) * (1 - spread[1])
+    turnover = rng.lognormal(np.log(2e9), 1.5)
+    volume = np.maximum(100, turnover / close * rng.lognormal(0, 0.5, rows)).astype(np.int64)
+
+    return pd.DataFrame(
+        {
+            "Adj Close": close,
+            "Close": close,
+            "High": high,
+            "Low": low,
+            "Open": open_,
+            "Volume": volume,
+        },
+        index=dates,
+    )
+
+
+def write_universe(backend, symbols, years: float = 1, period: str = "1y", interval: str = "1d", end=None):
+    """Write synthetic histories for ``symbols`` into ``backend``'s cache.
+
+    The histories are recorded as complete and served whole to ``period``,
+    the period the scanners read, whatever their length. Returns the number
+    of rows written.
+    """
+    rows = 0
+    for symbol in symbols:
+        hist = history(symbol, years, end)
+        backend.save(symbol, interval, hist)
+        periods = {period: hist.index[0].isoformat()}
+        save_state(backend, symbol, interval, "range", {"start": None, "periods": periods})
+        rows += len(hist)
+    return rows
+
+
+class SyntheticSource:
+    """Stand-in for ``yf.download`` that serves synthetic histories."""
+
+    def __init__(self, years: float = 1, end=None):
+        self.years = years
+        self.end = end
+        self.calls = 0
+
+    def download(self, tickers, start=None, period=None, interval="1d", group_by="column", **kwargs):
+        self.calls += 1
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        frames = {}
+        for symbol in symbols:
+            hist = history(symbol, self.years, self.end)
+            if start is not None:
+                hist = hist[hist.index >= pd.Timestamp(start)]
+            frames[symbol] = hist
+        out = pd.concat(frames, axis=1, names=["Ticker", "Price"])
+        if group_by != "ticker":
+            out = out.swaplevel(0, 1, axis=1)
+        return out
+
+
+@contextlib.contextmanager
+def offline(source):
+    """Route every download through ``source`` instead of the network."""
+    original = yf.download
+    yf.download = source.download
+    set_downloader(source.download)
+    try:
+        yield source
+    finally:
+        set_downloader(None)
+        yf.download = original
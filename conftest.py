@@ -0,0 +1 @@
+"""Puts the repository root on sys.path so bare ``pytest`` can import the modules."""
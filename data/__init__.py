@@ -1,9 +1,24 @@
 import json
-import os
-from datetime import datetime
-
-import pandas as pd
-import yfinance as yf
+import threading
+
+from data.cache import load_state, save_state
+# The cache and fetch settings are part of this package's API
+from data.history import (
+    _between,
+    _cached_history,
+    _histories,
+    _wall,
+    clear_memory_cache,
+    configure_fetch,
+    get_cache_backend,
+    last_fetch_report,
+    memory_cache_stats,
+    set_cache_backend,
+    set_downloader,
+)
+from data.intervals import bar_length, is_intraday
+from data.panel import build_panel, open_panel, panel_lock, panel_path
+from metrics import CACHE_LOOKUPS, instrumented, timed
 
 
 def load_tickers_from_json(path: str):
@@ -31,105 +46,162 @@ def load_tickers_from_json(path: str):
     return tickers
 
 
-def _get_cache_path(symbol: str, period: str, interval: str):
-    safe_symbol = symbol.replace("/", "_").replace("\\", "_").replace(":", "_")
-    cache_dir = os.path.join(os.path.dirname(__file__), "cache")
-    return os.path.join(cache_dir, f"{safe_symbol}_{period}_{interval}.csv")
-
-
+@instrumented("download_history")
 def download_history(symbol: str, period: str, interval: str = "1d"):
     """Download price history for a single symbol using yfinance.
 
     Returns a pandas DataFrame with flattened column names, or None on error/empty.
+    When a fresh panel covering the symbol is already mapped in this process,
+    a zero-copy view of it is returned instead. Otherwise this is
+    ``download_histories`` for one symbol.
     """
-    cache_path = _get_cache_path(symbol, period, interval)
-    cached = None
-
-    # Try to load existing cache from disk
-    if os.path.exists(cache_path):
-        try:
-            cached = pd.read_csv(cache_path, index_col=0, parse_dates=True)
-        except Exception:
-            cached = None
-
-    # If we have cached data, try to append only missing days
-    if cached is not None and not cached.empty:
-        try:
-            # Ensure index is a DateTimeIndex
-            if not isinstance(cached.index, pd.DatetimeIndex):
-                cached.index = pd.to_datetime(cached.index)
-
-            last_timestamp = cached.index.max()
-            last_date = last_timestamp.date()
-            today = datetime.now().date()
-
-            # If cache already has data for today or later, just use it
-            if last_date >= today:
-                return cached
-
-            start_date = last_timestamp + pd.Timedelta(days=1)
-        except Exception:
-            start_date = None
-
-        if start_date is not None:
-            try:
-                new_hist = yf.download(
-                    symbol,
-                    start=start_date,
-                    interval=interval,
-                    auto_adjust=False,
-                    progress=False,
-                )
-            except Exception as e:
-                print(f"Failed to download data for {symbol}: {e}")
-                return cached
-
-            if new_hist is not None and not new_hist.empty:
-                # Flatten MultiIndex columns if needed
-                if isinstance(new_hist.columns, pd.MultiIndex):
-                    new_hist.columns = new_hist.columns.get_level_values(0)
-
-                updated = pd.concat([cached, new_hist])
-                # Drop duplicate index entries, keep the latest
-                updated = updated[~updated.index.duplicated(keep="last")]
-                updated = updated.sort_index()
-
-                try:
-                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-                    updated.to_csv(cache_path)
-                except Exception:
-                    pass
-
-                return updated
-
-        # If we cannot determine a start_date or there is no new data, fall back to cached
-        return cached
-
-    # No valid cache: download a fresh history using the requested period
-    try:
-        hist = yf.download(
-            symbol,
-            period=period,
-            interval=interval,
-            auto_adjust=False,
-            progress=False,
-        )
-    except Exception as e:
-        print(f"Failed to download data for {symbol}: {e}")
+    panel = _panels.get((period, interval))
+    if panel is not None and panel.is_current() and panel.is_fresh([symbol], _panel_max_age(interval)):
+        CACHE_LOOKUPS.inc(result="hit")
+        return panel.history(symbol)
+    return download_histories([symbol], period, interval).get(symbol)
+
+
+@instrumented("get_range")
+def get_range(symbol: str, start, end=None, interval: str = "1d"):
+    """Return the bars of ``symbol`` from ``start`` to ``end`` (inclusive).
+
+    ``start`` and ``end`` are dates or timestamps (exchange time for
+    intraday bars); ``start=None`` asks for everything there is and
+    ``end=None`` runs to the latest bar. The symbol's history at
+    ``interval`` is cached once, whatever range is asked for: only the bars
+    it lacks before its first one or after its last are downloaded, and
+    they are kept for later requests. Returns None if there is no data.
+    """
+    found = _histories([symbol], interval, start=start, end=end).get(symbol)
+    if found is None:
         return None
+    hist, since = found
+    hist = _between(hist, since, _wall(end) if end is not None else None)
+    return hist if not hist.empty else None
 
-    if hist is None or hist.empty:
-        return None
 
-    # Some yfinance versions return MultiIndex columns even for a single ticker.
-    # Flatten to the first level so we have simple 'Open','High','Low','Close','Volume' names.
-    if isinstance(hist.columns, pd.MultiIndex):
-        hist.columns = hist.columns.get_level_values(0)
+def load_indicator_state(symbol: str, period: str, interval: str, name: str):
+    """Return the persisted indicator state ``name`` of a history, or None."""
+    return load_state(get_cache_backend(), symbol, interval, f"{name}_{period}")
 
-    try:
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        hist.to_csv(cache_path)
-    except Exception:
-        pass
 
-    return hist
+def save_indicator_state(symbol: str, period: str, interval: str, name: str, state):
+    """Persist indicator state ``name`` (a JSON-able dict) next to the cached history."""
+    save_state(get_cache_backend(), symbol, interval, f"{name}_{period}", state)
+
+
+def download_histories(symbols, period: str, interval: str = "1d", chunk_size: int = 50, refetch_last: bool = False):
+    """Download price histories for many symbols at once.
+
+    Cache misses and incremental top-ups are grouped into chunked
+    multi-ticker ``yf.download`` calls, which run concurrently on the fetch
+    pool. Returns a dict mapping each symbol with data to its DataFrame, in
+    the order the symbols were given; see ``last_fetch_report()`` for the
+    symbols that could not be fetched. ``refetch_last`` also re-downloads
+    each symbol's last cached bar. Symbols without a cache of their own at
+    an intraday interval are resampled from a finer cached interval if they
+    have one. Weekly and monthly bars are derived from the daily histories,
+    so they cost no downloads of their own.
+
+    Histories are cached per symbol and interval, whatever the period: a
+    longer period than the cache holds only downloads the bars before its
+    first one. Each period's history starts where that period reached back
+    to the first time it was served, then grows with every top-up.
+    """
+    return {
+        symbol: _between(hist, since)
+        for symbol, (hist, since) in _histories(symbols, interval, period, None, None, chunk_size, refetch_last).items()
+    }
+
+
+# Panels opened by this process, keyed by (period, interval)
+_panels = {}
+# Serializes panel rebuilds between threads of this process (panel_lock
+# does between processes)
+_panel_lock = threading.RLock()
+
+
+def _panel_max_age(interval: str):
+    # Intraday panels go stale with every new bar, daily ones with the day
+    return bar_length(interval) if is_intraday(interval) else None
+
+
+def load_panel(symbols, period: str, interval: str = "1d", refresh: bool = False):
+    """Return a memory-mapped PanelStore that covers ``symbols``.
+
+    A panel built since the last session close (for intraday intervals:
+    within the last bar length) that already holds every symbol is mapped
+    as is, without touching the per-symbol caches. Otherwise the histories
+    are refreshed through ``download_histories`` and the panel is rebuilt;
+    symbols already in the old panel are carried over from the cache. A
+    daily panel that a close made stale re-downloads each symbol's last
+    cached bar, which may have been fetched before it was final.
+    ``refresh`` forces that path and the re-download. Returns None if no
+    symbol has any data.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    key = (period, interval)
+    path = panel_path(get_cache_backend().root, period, interval)
+
+    panel = _panels.get(key)
+    if panel is None or not panel.is_current():
+        panel = open_panel(path)
+    max_age = _panel_max_age(interval)
+    if panel is not None and panel.is_fresh(symbols, max_age) and not refresh:
+        _panels[key] = panel
+        return panel
+
+    # Threads of this process queue on _panel_lock, other processes on the
+    # panel's lock file; whoever waited may find the panel rebuilt already
+    with _panel_lock, panel_lock(path):
+        panel = open_panel(path)
+        if panel is not None and panel.is_fresh(symbols, max_age) and not refresh:
+            _panels[key] = panel
+            return panel
+
+        # A daily panel that went stale at a session close may hold that
+        # day's partial bars; fetch them again now that they are final
+        closed = panel is not None and max_age is None and not panel.is_fresh(())
+        histories = download_histories(symbols, period, interval, refetch_last=refresh or closed)
+        unavailable = [symbol for symbol in symbols if symbol not in histories]
+        if panel is not None:
+            for symbol in panel.symbols:
+                if symbol not in histories:
+                    cached = _cached_history(symbol, period, interval)
+                    if cached is not None:
+                        histories[symbol] = cached
+            # Keep today's known misses so other symbol sets stay fresh
+            if panel.is_fresh((), max_age) and not refresh:
+                unavailable += [s for s in panel._unavailable if s not in histories and s not in unavailable]
+
+        with timed("panel_build"):
+            panel = build_panel(path, histories, unavailable)
+        if panel is not None:
+            _panels[key] = panel
+        return panel
+
+
+def close_panels():
+    """Forget the panels mapped by this process; the next load reopens them."""
+    _panels.clear()
+
+
+def is_panel_fresh(symbols, period: str, interval: str = "1d"):
+    """True if ``load_panel`` would return without downloading anything."""
+    panel = _panels.get((period, interval))
+    if panel is None or not panel.is_current():
+        panel = open_panel(panel_path(get_cache_backend().root, period, interval))
+    return panel is not None and panel.is_fresh(list(dict.fromkeys(symbols)), _panel_max_age(interval))
+
+
+def data_fingerprint(symbols, period: str, interval: str = "1d"):
+    """Return a version string for the data of ``symbols``.
+
+    Refreshes the panel like ``load_panel``; the value changes whenever any
+    symbol gets a new bar.
+    """
+    panel = load_panel(symbols, period, interval)
+    if panel is None:
+        return "empty"
+    return panel.fingerprint(list(dict.fromkeys(symbols)))
@@ -0,0 +1,393 @@
+"""On-disk history cache backends.
+
+Histories are keyed by symbol and interval only: one entry holds every bar
+fetched for the pair, whatever lookback each request asked for (see
+``data.download_histories`` and ``data.get_range``).
+
+Two backends are available:
+
+- ``CsvCache`` keeps plain ``<SYM>_<interval>.csv`` files.
+- ``ColumnarCache`` stores each history as a directory of raw binary
+  columns (one file per OHLCV column plus an int64 nanosecond date index)
+  described by a small ``meta.json``. Loading is a handful of
+  ``np.fromfile`` calls instead of CSV/date parsing, and incremental
+  updates append the new rows to each column file instead of rewriting
+  the whole history.
+
+Run ``python -m data.cache migrate`` to convert existing CSV files and merge
+the per-period entries of older versions (``<SYM>_<period>_<interval>``).
+"""
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data.intervals import INTERVALS, PERIOD_PATTERN
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+
+# dtype codes used in column file names and meta.json
+_DTYPES = {"f4": np.float32, "f8": np.float64, "i8": np.int64}
+
+
+def _safe_symbol(symbol: str):
+    return symbol.replace("/", "_").replace("\\", "_").replace(":", "_")
+
+
+def _cache_key(symbol: str, interval: str):
+    return f"{_safe_symbol(symbol)}_{interval}"
+
+
+class CsvCache:
+    """One CSV file per (symbol, interval)."""
+
+    name = "csv"
+
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+
+    def path(self, symbol: str, interval: str):
+        return os.path.join(self.root, _cache_key(symbol, interval) + ".csv")
+
+    def load(self, symbol: str, interval: str):
+        return _read_csv(self.path(symbol, interval))
+
+    def signature(self, symbol: str, interval: str):
+        """Identify the stored version of a history, or None if there is none."""
+        return _stat_signature(self.path(symbol, interval))
+
+    def save(self, symbol: str, interval: str, hist):
+        path = self.path(symbol, interval)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            hist.to_csv(path)
+        except Exception:
+            pass
+
+    def append(self, symbol: str, interval: str, hist, new_rows):
+        # CSV cannot be appended safely (headers, quoting), rewrite it.
+        self.save(symbol, interval, hist)
+
+    def state_path(self, symbol: str, interval: str, name: str):
+        return os.path.join(self.root, f"{_cache_key(symbol, interval)}.{name}.json")
+
+
+class ColumnarCache:
+    """Binary columnar store with append-only incremental writes.
+
+    Layout of ``<root>/<SYM>_<interval>/``::
+
+        meta.json   {"rows": n, "last": <ns>, "tz": null, "columns": [["Close", "f8"], ...]}
+        index.i8    int64 nanoseconds since the epoch
+        c0.f8 ...   one raw little-endian file per column
+
+    ``meta.json`` is replaced atomically after the column files are
+    written, so readers never see a torn append: rows beyond ``rows`` are
+    ignored and truncated by the next writer.
+    """
+
+    name = "columnar"
+
+    def __init__(self, root: str = CACHE_DIR, price_dtype: str = "f8"):
+        if price_dtype not in ("f4", "f8"):
+            raise ValueError(f"price_dtype must be 'f4' or 'f8', got {price_dtype!r}")
+        self.root = root
+        self.price_dtype = price_dtype
+        self._csv = CsvCache(root)
+
+    def path(self, symbol: str, interval: str):
+        return os.path.join(self.root, _cache_key(symbol, interval))
+
+    def signature(self, symbol: str, interval: str):
+        """Identify the stored version of a history, or None if there is none.
+
+        Every write replaces meta.json, so its stat changes with the data.
+        """
+        signature = _stat_signature(os.path.join(self.path(symbol, interval), "meta.json"))
+        if signature is None:
+            return self._csv.signature(symbol, interval)
+        return signature
+
+    def load(self, symbol: str, interval: str):
+        path = self.path(symbol, interval)
+        meta = _read_meta(path)
+        if meta is None:
+            # Transparently pick up a cache written by the CSV backend.
+            hist = self._csv.load(symbol, interval)
+            if hist is not None:
+                self.save(symbol, interval, hist)
+            return hist
+
+        return _read_columns(path, meta)
+
+    def save(self, symbol: str, interval: str, hist):
+        path = self.path(symbol, interval)
+        try:
+            os.makedirs(path, exist_ok=True)
+            columns = [(str(name), self._dtype_code(hist[name])) for name in hist.columns]
+            _write_column(os.path.join(path, "index.i8"), _index_values(hist.index), "wb")
+            for i, (name, code) in enumerate(columns):
+                _write_column(os.path.join(path, f"c{i}.{code}"), _column_values(hist[name], code), "wb")
+            _write_meta(path, _make_meta(hist, columns))
+        except Exception:
+            pass
+
+    def append(self, symbol: str, interval: str, hist, new_rows):
+        """Persist ``hist`` (= stored rows + ``new_rows``), appending when possible.
+
+        ``new_rows`` may replace the last stored bars (e.g. a refetched
+        partial bar); only those are rewritten. Falls back to a full rewrite
+        when ``new_rows`` reaches further back or the column layout changed.
+        """
+        path = self.path(symbol, interval)
+        meta = _read_meta(path)
+        if meta is None or new_rows.empty:
+            self.save(symbol, interval, hist)
+            return
+
+        rows = meta["rows"]
+        columns = [tuple(c) for c in meta["columns"]]
+        names = [name for name, _ in columns]
+        # Stored rows before the first new one are kept as they are
+        keep = int(np.searchsorted(_index_values(hist.index), _index_values(new_rows.index[:1])[0]))
+        appendable = (
+            keep <= rows
+            and len(hist) == keep + len(new_rows)
+            and meta.get("last") is not None
+            and sorted(names) == sorted(str(c) for c in hist.columns)
+        )
+        if not appendable:
+            self.save(symbol, interval, hist)
+            return
+
+        tail = hist.iloc[keep:]
+        try:
+            values = [_column_values(tail[name], code) for name, code in columns]
+            _write_column(os.path.join(path, "index.i8"), _index_values(tail.index), "ab", keep)
+            for i, (_, code) in enumerate(columns):
+                _write_column(os.path.join(path, f"c{i}.{code}"), values[i], "ab", keep)
+            _write_meta(path, _make_meta(hist, columns))
+        except Exception:
+            self.save(symbol, interval, hist)
+
+    def state_path(self, symbol: str, interval: str, name: str):
+        return os.path.join(self.path(symbol, interval), f"{name}.json")
+
+    def _dtype_code(self, column):
+        if column.dtype.kind in "iu":
+            return "i8"
+        return self.price_dtype
+
+
+def _read_columns(path: str, meta):
+    """Load the history stored in the columnar directory ``path``, or None."""
+    rows = meta["rows"]
+    try:
+        index = np.fromfile(os.path.join(path, "index.i8"), dtype=np.int64, count=rows)
+        columns = {}
+        for i, (name, code) in enumerate(meta["columns"]):
+            columns[name] = np.fromfile(
+                os.path.join(path, f"c{i}.{code}"), dtype=_DTYPES[code], count=rows
+            )
+    except (OSError, ValueError, KeyError):
+        return None
+    # A reader racing an append can see column files already truncated
+    # for the rewritten tail; treat that like a missing entry
+    if rows == 0 or len(index) != rows or any(len(values) != rows for values in columns.values()):
+        return None
+
+    dates = pd.DatetimeIndex(index.view("M8[ns]"), name=meta.get("index_name") or "Date")
+    dates = dates.as_unit(meta.get("unit") or "ns")
+    if meta.get("tz"):
+        dates = dates.tz_localize("UTC").tz_convert(meta["tz"])
+    return pd.DataFrame(columns, index=dates)
+
+
+def _stat_signature(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _read_csv(cache_path: str):
+    """Load a cached CSV history, or None if missing/unreadable."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        cached = pd.read_csv(cache_path, index_col=0, parse_dates=True)
+    except Exception:
+        return None
+    if cached.empty:
+        return None
+    # Ensure index is a DateTimeIndex
+    if not isinstance(cached.index, pd.DatetimeIndex):
+        try:
+            cached.index = pd.to_datetime(cached.index)
+        except Exception:
+            return None
+    return cached
+
+
+def load_state(backend, symbol: str, interval: str, name: str):
+    """Load a JSON state stored next to a cached history, or None."""
+    try:
+        with open(backend.state_path(symbol, interval, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(backend, symbol: str, interval: str, name: str, state):
+    path = backend.state_path(symbol, interval, name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _read_meta(path: str):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path: str, meta):
+    tmp = os.path.join(path, "meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, "meta.json"))
+
+
+def _make_meta(hist, columns):
+    tz = getattr(hist.index, "tz", None)
+    return {
+        "rows": len(hist),
+        "last": int(_index_values(hist.index[-1:])[0]) if len(hist) else None,
+        "tz": str(tz) if tz is not None else None,
+        "unit": getattr(hist.index, "unit", "ns"),
+        "index_name": hist.index.name,
+        "columns": [list(c) for c in columns],
+    }
+
+
+def _index_values(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    return index.as_unit("ns").asi8
+
+
+def _column_values(column, code):
+    values = column.to_numpy(dtype=np.float64 if code != "i8" else None)
+    if code == "i8" and values.dtype.kind not in "iu":
+        # Integer columns that picked up NaNs cannot stay int64.
+        raise ValueError("non-integer values in an i8 column")
+    return np.ascontiguousarray(values, dtype=_DTYPES[code])
+
+
+def _write_column(path: str, values, mode: str, rows: int = 0):
+    with open(path, mode) as f:
+        if mode == "ab":
+            # Drop any tail left behind by an interrupted append.
+            f.truncate(rows * values.itemsize)
+            f.seek(0, os.SEEK_END)
+        values.tofile(f)
+
+
+BACKENDS = {"csv": CsvCache, "columnar": ColumnarCache}
+
+
+def make_backend(name: str, root: str = CACHE_DIR):
+    try:
+        return BACKENDS[name](root)
+    except KeyError:
+        raise ValueError(f"Unknown cache backend {name!r}, expected one of {sorted(BACKENDS)}")
+
+
+def _entry_key(name: str):
+    # (safe symbol, interval) of a cache entry name, with or without the
+    # period older versions keyed entries by; None for anything else
+    parts = name.rsplit("_", 2)
+    if len(parts) == 3 and PERIOD_PATTERN.fullmatch(parts[1]) and parts[2] in INTERVALS:
+        return parts[0], parts[2]
+    parts = name.rsplit("_", 1)
+    if len(parts) == 2 and parts[1] in INTERVALS:
+        return parts[0], parts[1]
+    return None
+
+
+def migrate_cache(root: str = CACHE_DIR, remove: bool = False):
+    """Convert the histories in ``root`` to columnar ``<SYM>_<interval>`` entries.
+
+    CSV files are converted, and the per-period entries of a symbol and
+    interval (``<SYM>_1y_1d``, ``<SYM>_5y_1d``...) are merged into one,
+    keeping the most recent version of each bar. Returns the number of
+    entries written. Pass ``remove=True`` to delete the sources once they
+    have been migrated.
+    """
+    if not os.path.isdir(root):
+        return 0
+
+    target = ColumnarCache(root)
+    sources = {}
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if name.endswith(".csv"):
+            key = _entry_key(name[:-4])
+            is_csv = True
+        elif _read_meta(path) is not None:
+            key = _entry_key(name)
+            is_csv = False
+        else:
+            continue
+        if key is not None:
+            sources.setdefault(key, []).append((path, is_csv))
+
+    migrated = 0
+    for (safe_symbol, interval), entries in sources.items():
+        if entries == [(target.path(safe_symbol, interval), False)]:
+            continue
+        frames = []
+        for path, is_csv in entries:
+            hist = _read_csv(path) if is_csv else _read_columns(path, _read_meta(path))
+            if hist is not None:
+                frames.append(hist)
+        if not frames:
+            continue
+        # Later bars win, so the freshest entry's version of a bar is kept
+        frames.sort(key=lambda hist: hist.index[-1])
+        hist = pd.concat(frames)
+        hist = hist[~hist.index.duplicated(keep="last")].sort_index()
+        target.save(safe_symbol, interval, hist)
+        if _read_meta(target.path(safe_symbol, interval)) is None:
+            print(f"Failed to migrate {safe_symbol} {interval}")
+            continue
+        migrated += 1
+        if remove:
+            for path, is_csv in entries:
+                if path == target.path(safe_symbol, interval):
+                    continue
+                if is_csv:
+                    os.remove(path)
+                else:
+                    shutil.rmtree(path, ignore_errors=True)
+    return migrated
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["migrate"]:
+        print("usage: python -m data.cache migrate [--remove]")
+        sys.exit(2)
+    count = migrate_cache(remove="--remove" in sys.argv[2:])
+    print(f"Migrated {count} cached histories to the columnar format.")
@@ -0,0 +1,240 @@
+"""Concurrent, rate-limited fetch layer for price downloads.
+
+``FetchPool`` runs download tasks (one ``yf.download`` call for one or more
+symbols) on a bounded thread pool. Calls are paced by a token bucket, failed
+calls are retried with exponential backoff, and a call that exceeds its
+timeout is abandoned and retried. When a multi-symbol task fails it is split
+into single-symbol tasks, so one slow or broken ticker cannot hold back the
+rest of its chunk.
+
+The download function is injectable: pass ``downloader=`` to ``FetchPool``
+(or use ``data.set_downloader``) to run fully offline against a stub with the
+same signature as ``yf.download``.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` calls per second."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class FetchTask:
+    """One download call: ``symbols`` plus the period/start arguments.
+
+    Set ``required=False`` for incremental top-ups, where getting no rows
+    back just means there is nothing new yet.
+    """
+
+    def __init__(self, symbols, kwargs, attempt: int = 1, required: bool = True):
+        self.symbols = list(symbols)
+        self.kwargs = kwargs
+        self.attempt = attempt
+        self.required = required
+        self.not_before = 0.0
+        self.started = None
+
+
+class FetchFailure:
+    """A symbol that could not be fetched, and why."""
+
+    def __init__(self, symbol: str, reason: str, attempts: int, error: str = ""):
+        self.symbol = symbol
+        self.reason = reason  # "error", "timeout" or "empty"
+        self.attempts = attempts
+        self.error = error
+
+    def to_dict(self):
+        return {
+            "symbol": self.symbol,
+            "reason": self.reason,
+            "attempts": self.attempts,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return f"FetchFailure({self.symbol!r}, {self.reason!r}, attempts={self.attempts})"
+
+
+class FetchReport:
+    """Outcome of a ``FetchPool.run`` call."""
+
+    def __init__(self):
+        self.fetched = []
+        self.failures = []
+        self.calls = 0
+        self.retries = 0
+        self.duration = 0.0
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def extend(self, other):
+        """Add the outcome of another run (e.g. an earlier round of the same download)."""
+        self.fetched = other.fetched + self.fetched
+        self.failures = other.failures + self.failures
+        self.calls += other.calls
+        self.retries += other.retries
+        self.duration += other.duration
+
+    def to_dict(self):
+        return {
+            "fetched": len(self.fetched),
+            "failures": [f.to_dict() for f in self.failures],
+            "calls": self.calls,
+            "retries": self.retries,
+            "duration": round(self.duration, 3),
+        }
+
+
+class FetchPool:
+    """Bounded concurrent executor for download tasks.
+
+    ``downloader(symbols, **kwargs)`` must return a raw yfinance-style frame;
+    ``splitter(frame, symbols)`` turns it into a symbol -> DataFrame dict.
+    """
+
+    def __init__(
+        self,
+        downloader,
+        splitter,
+        max_workers: int = 4,
+        rate: float = 4.0,
+        burst: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30.0,
+    ):
+        self.downloader = downloader
+        self.splitter = splitter
+        self.max_workers = max(1, max_workers)
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def run(self, tasks):
+        """Run ``tasks`` and return ``(frames, report)``."""
+        report = FetchReport()
+        frames = {}
+        pending = deque(tasks)
+        running = {}
+        started = time.monotonic()
+
+        # Abandoned (timed out) calls keep their thread until the download
+        # returns, so leave head-room beyond the concurrency limit.
+        executor = ThreadPoolExecutor(max_workers=self.max_workers * 2, thread_name_prefix="fetch")
+        try:
+            while pending or running:
+                self._launch(executor, pending, running, report)
+                if not running:
+                    # Everything left is waiting out a backoff delay
+                    time.sleep(max(0.0, min(t.not_before for t in pending) - time.monotonic()))
+                    continue
+
+                done, _ = wait(running, timeout=self._tick(running, pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        fetched = future.result()
+                    except Exception as e:
+                        self._retry(task, "error", repr(e), pending, report)
+                        continue
+                    for symbol in task.symbols:
+                        if symbol in fetched:
+                            frames[symbol] = fetched[symbol]
+                            report.fetched.append(symbol)
+                        elif task.required:
+                            report.failures.append(FetchFailure(symbol, "empty", task.attempt))
+
+                now = time.monotonic()
+                for future, task in list(running.items()):
+                    if task.started is not None and now - task.started > self.timeout:
+                        del running[future]
+                        self._retry(task, "timeout", f"no response after {self.timeout:.0f}s", pending, report)
+        finally:
+            executor.shutdown(wait=False)
+
+        report.duration = time.monotonic() - started
+        for failure in report.failures:
+            logger.warning(
+                "Failed to download data for %s (%s after %d attempt(s)) %s",
+                failure.symbol,
+                failure.reason,
+                failure.attempts,
+                failure.error,
+            )
+        return frames, report
+
+    def _launch(self, executor, pending, running, report):
+        now = time.monotonic()
+        for _ in range(len(pending)):
+            if len(running) >= self.max_workers:
+                return
+            task = pending.popleft()
+            if task.not_before > now:
+                pending.append(task)
+                continue
+            self.bucket.acquire()
+            report.calls += 1
+            running[executor.submit(self._attempt, task)] = task
+
+    def _attempt(self, task):
+        task.started = time.monotonic()
+        hist = self.downloader(task.symbols if len(task.symbols) > 1 else task.symbols[0], **task.kwargs)
+        return self.splitter(hist, task.symbols)
+
+    def _tick(self, running, pending):
+        # Wake up for the next timeout deadline or the end of a backoff delay;
+        # poll while submitted calls are still queued in the executor.
+        if any(t.started is None for t in running.values()):
+            return 0.05
+        wakeups = [t.started + self.timeout for t in running.values()]
+        wakeups += [t.not_before for t in pending]
+        return max(0.01, min(wakeups) - time.monotonic())
+
+    def _retry(self, task, reason, error, pending, report):
+        if len(task.symbols) > 1:
+            # Isolate the offending symbol(s) by retrying one at a time
+            parts = [[symbol] for symbol in task.symbols]
+        elif task.attempt < self.retries:
+            parts = [task.symbols]
+        else:
+            for symbol in task.symbols:
+                report.failures.append(FetchFailure(symbol, reason, task.attempt, error))
+            return
+
+        delay = self.backoff * (2 ** (task.attempt - 1))
+        for symbols in parts:
+            retry = FetchTask(symbols, task.kwargs, task.attempt + 1, task.required)
+            retry.not_before = time.monotonic() + delay * (1 + random.random() * 0.25)
+            pending.append(retry)
+            report.retries += 1
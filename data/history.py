@@ -0,0 +1,540 @@
+"""Per-symbol history caches and the ranges served from them.
+
+Each (symbol, interval) history is cached once, whatever lookback a request
+asks for. Its range state (``_load_range``) records where the fetched bars
+begin and where each period served from it starts, and ``_histories``
+brings a set of histories up to a requested range by downloading only the
+bars missing before the first cached one (the head) and after the last
+(the tail). Coarser intraday bars are resampled from a finer cached
+interval, and weekly and monthly bars are derived from the daily ones
+(``_derive``).
+
+Downloads go through ``yf.download`` (or the stub given to
+``set_downloader``) on a ``FetchPool``. The public entry points are
+``data.download_histories`` and ``data.get_range``.
+"""
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+import yfinance as yf
+
+from data.cache import load_state, make_backend, save_state
+from data.fetch import FetchPool, FetchTask
+from data.intervals import (
+    DERIVED,
+    bar_length,
+    bucket_start,
+    earliest_start,
+    finer_intervals,
+    is_intraday,
+    now_like,
+    period_start,
+    resample,
+    trim,
+)
+from data.memcache import HistoryCache
+from metrics import (
+    CACHE_LOOKUPS,
+    DOWNLOAD_CALLS,
+    DOWNLOAD_FRAME_BYTES,
+    SYMBOLS_DOWNLOADED,
+    SYMBOLS_SKIPPED,
+    instrumented,
+    timed,
+)
+
+_backend = None
+
+
+def get_cache_backend():
+    """Return the active history cache backend.
+
+    Defaults to the columnar binary store; set ``STOCKS_CACHE_BACKEND=csv``
+    to keep using plain CSV files.
+    """
+    global _backend
+    if _backend is None:
+        _backend = make_backend(os.environ.get("STOCKS_CACHE_BACKEND", "columnar"))
+    return _backend
+
+
+def set_cache_backend(backend):
+    """Switch the cache backend, given a backend instance or its name."""
+    global _backend
+    _backend = make_backend(backend) if isinstance(backend, str) else backend
+
+
+def _get_cache_path(symbol: str, interval: str):
+    return get_cache_backend().path(symbol, interval)
+
+
+# Histories already loaded by this process, shared across requests
+_memory_cache = HistoryCache(int(float(os.environ.get("STOCKS_MEMORY_CACHE_MB", "256")) * 1024 * 1024))
+
+
+def memory_cache_stats():
+    """Return hit/miss/eviction counters of the in-process history cache."""
+    return _memory_cache.stats()
+
+
+def clear_memory_cache():
+    _memory_cache.invalidate()
+
+
+@instrumented("cache_read")
+def _read_cache(symbol: str, interval: str):
+    """Load a cached history, or None if missing/unreadable.
+
+    Served from the in-process cache while the on-disk entry is unchanged
+    and it is still the same day; only a stat() touches the disk then.
+    """
+    backend = get_cache_backend()
+    key = (symbol, interval)
+    signature = backend.signature(symbol, interval)
+    if signature is None:
+        _memory_cache.invalidate(key)
+        return None
+
+    hist = _memory_cache.get(key, signature)
+    if hist is None:
+        hist = backend.load(symbol, interval)
+        if hist is None:
+            return None
+        # Loading may have converted the entry (e.g. CSV -> columnar)
+        _memory_cache.put(key, backend.signature(symbol, interval), hist)
+    # Callers add indicator columns; keep those off the shared frame
+    return hist.copy(deep=False)
+
+
+@instrumented("cache_write")
+def _write_cache(symbol: str, interval: str, hist, new_rows=None):
+    """Persist ``hist``; ``new_rows`` marks an incremental top-up to append.
+
+    Intraday histories are trimmed to their retention window first. Returns
+    the history as written.
+    """
+    backend = get_cache_backend()
+    kept = trim(hist, interval)
+    if len(kept) < len(hist):
+        hist, new_rows = kept, None
+    if new_rows is None:
+        backend.save(symbol, interval, hist)
+    else:
+        backend.append(symbol, interval, hist, new_rows)
+    _memory_cache.put((symbol, interval), backend.signature(symbol, interval), hist)
+    # The cached frame is shared; hand out a copy like _read_cache does
+    return hist.copy(deep=False)
+
+
+def _chunks(items, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _split_batch(hist, symbols):
+    """Split a (multi-ticker) yfinance frame into one flat frame per symbol."""
+    if hist is None or hist.empty:
+        return {}
+
+    if not isinstance(hist.columns, pd.MultiIndex):
+        return {symbols[0]: hist} if len(symbols) == 1 else {}
+
+    # The ticker level is the first one with group_by="ticker", but be
+    # tolerant of the (Price, Ticker) layout as well.
+    level = 0
+    if not set(symbols) & set(hist.columns.get_level_values(0)):
+        level = 1
+    available = set(hist.columns.get_level_values(level))
+
+    frames = {}
+    for symbol in symbols:
+        if symbol not in available:
+            continue
+        frame = hist.xs(symbol, axis=1, level=level).dropna(how="all")
+        if frame.empty:
+            continue
+        frame.columns.name = None
+        frames[symbol] = frame
+    return frames
+
+
+# Download function used by the fetch pool; None means yf.download.
+_downloader = None
+
+_fetch_options = {
+    "max_workers": int(os.environ.get("STOCKS_FETCH_WORKERS", "4")),
+    "rate": float(os.environ.get("STOCKS_FETCH_RATE", "4")),
+    "burst": int(os.environ.get("STOCKS_FETCH_BURST", "4")),
+    "retries": int(os.environ.get("STOCKS_FETCH_RETRIES", "3")),
+    "backoff": float(os.environ.get("STOCKS_FETCH_BACKOFF", "0.5")),
+    "timeout": float(os.environ.get("STOCKS_FETCH_TIMEOUT", "30")),
+}
+
+_last_fetch_report = None
+
+
+def set_downloader(downloader):
+    """Replace ``yf.download`` for all fetches, e.g. with an offline stub.
+
+    Pass None to restore ``yf.download``.
+    """
+    global _downloader
+    _downloader = downloader
+
+
+def configure_fetch(**options):
+    """Update fetch pool options (max_workers, rate, burst, retries, backoff, timeout)."""
+    unknown = set(options) - set(_fetch_options)
+    if unknown:
+        raise ValueError(f"Unknown fetch options: {', '.join(sorted(unknown))}")
+    _fetch_options.update(options)
+
+
+def last_fetch_report():
+    """Return the FetchReport of the most recent download, or None."""
+    return _last_fetch_report
+
+
+def _download(symbols, **kwargs):
+    downloader = _downloader or yf.download
+    return downloader(
+        symbols,
+        group_by="ticker",
+        auto_adjust=False,
+        progress=False,
+        timeout=_fetch_options["timeout"],
+        **kwargs,
+    )
+
+
+def _run_fetch(tasks):
+    global _last_fetch_report
+    pool = FetchPool(_download, _split_batch, **_fetch_options)
+    with timed("download"):
+        frames, _last_fetch_report = pool.run(tasks)
+    DOWNLOAD_CALLS.inc(_last_fetch_report.calls)
+    SYMBOLS_DOWNLOADED.inc(len(frames))
+    DOWNLOAD_FRAME_BYTES.inc(sum(int(f.memory_usage(index=True).sum()) for f in frames.values()))
+    if _last_fetch_report.failures:
+        SYMBOLS_SKIPPED.inc(len(_last_fetch_report.failures), reason="download_failed")
+    return frames
+
+
+# When this process last topped up each intraday cache entry (time.time())
+_top_ups = {}
+
+
+def _next_start(cached, interval: str = "1d", refetch_last: bool = False, checked=None):
+    """Return the first timestamp missing from ``cached``, or None if it is up to date.
+
+    With ``refetch_last`` the last cached bar is fetched again, e.g. to
+    replace a partial intraday bar with the final one after the close.
+
+    Daily histories are up to date once they hold today's bar. Intraday ones
+    are until the next bar can have started; their last bar is always
+    fetched again since it may have been partial. ``checked`` is when the
+    entry was last topped up, so a closed market is polled at most once per
+    bar.
+    """
+    last_timestamp = cached.index.max()
+    if is_intraday(interval):
+        length = bar_length(interval)
+        if refetch_last:
+            return last_timestamp
+        if now_like(cached.index) < last_timestamp + length:
+            return None
+        if checked is not None and time.time() - checked < length.total_seconds():
+            return None
+        return last_timestamp
+    if refetch_last:
+        return last_timestamp.normalize()
+    if last_timestamp.date() >= datetime.now().date():
+        return None
+    return last_timestamp + pd.Timedelta(days=1)
+
+
+def _merge_history(cached, new_hist):
+    updated = pd.concat([cached, new_hist])
+    # Drop duplicate index entries, keep the latest
+    updated = updated[~updated.index.duplicated(keep="last")]
+    return updated.sort_index()
+
+
+def _wall(value):
+    # A timestamp as naive wall-clock time (exchange time for intraday bars)
+    value = pd.Timestamp(value)
+    return value.tz_localize(None) if value.tz is not None else value
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _parse(value):
+    return pd.Timestamp(value) if value is not None else None
+
+
+def _load_range(symbol: str, interval: str, cached):
+    """The range state of a cached history.
+
+    ``start`` is where its fetched bars begin (None: at the first bar there
+    is) and ``periods`` maps each period served from it to the day that
+    period reached back to the first time, so a period's history keeps its
+    first bar and grows like a cache of its own would.
+    """
+    if cached is None:
+        return {"periods": {}}
+    state = load_state(get_cache_backend(), symbol, interval, "range") or {}
+    if "start" not in state:
+        # Cached before ranges were recorded: it covers what it holds
+        state["start"] = _iso(_wall(cached.index[0]))
+    state.setdefault("periods", {})
+    return state
+
+
+def _requested_start(periods, interval: str, period=None, start=None, now=None):
+    """Where a history asked for by ``period`` (or from ``start``) begins, as wall-clock time."""
+    if period is not None:
+        if period in periods:
+            return _parse(periods[period])
+        start = period_start(period, now)
+    earliest = earliest_start(interval, now if now is not None else datetime.now())
+    if earliest is not None and (start is None or start < earliest):
+        return earliest
+    return start
+
+
+def _bucket(start, interval: str):
+    # The start of the ``interval`` bar holding wall-clock time ``start``
+    return pd.Timestamp(bucket_start([start.to_datetime64()], interval)[0]) if start is not None else None
+
+
+def _covers(state, start):
+    """True if the bars fetched for ``state`` reach back to ``start``."""
+    if "start" not in state:
+        return False
+    begin = _parse(state["start"])
+    return begin is None or (start is not None and begin <= start)
+
+
+def _between(hist, start=None, end=None):
+    """The bars of ``hist`` from ``start`` to ``end`` (inclusive, wall-clock)."""
+    index = hist.index
+    first, last = 0, len(index)
+    if start is not None:
+        first = index.searchsorted(start.tz_localize(index.tz) if index.tz is not None else start)
+    if end is not None:
+        last = index.searchsorted(end.tz_localize(index.tz) if index.tz is not None else end, side="right")
+    if first == 0 and last == len(index):
+        return hist
+    return hist.iloc[first:last]
+
+
+def _finer_source(symbol: str, interval: str):
+    """A finer intraday interval with a cached history to resample from, or None."""
+    backend = get_cache_backend()
+    for finer in finer_intervals(interval):
+        if backend.signature(symbol, finer) is not None:
+            return finer
+    return None
+
+
+def _cached_history(symbol: str, period: str, interval: str):
+    """The cached history of ``period`` at ``interval``, resampled from a finer one if need be; never downloads."""
+    cached = _read_cache(symbol, interval)
+    ranged = DERIVED.get(interval, interval)
+    if cached is None:
+        ranged = _finer_source(symbol, interval)
+        fine = _read_cache(symbol, ranged) if ranged is not None else None
+        if fine is None:
+            return None
+        cached = _resampled(symbol, interval, ranged, fine)
+    periods = (load_state(get_cache_backend(), symbol, ranged, "range") or {}).get("periods", {})
+    since = _requested_start(periods, ranged, period, now=_wall(now_like(cached.index)))
+    return _between(cached, _bucket(since, interval) if interval in DERIVED else since)
+
+
+def _resampled(symbol: str, interval: str, source: str, fine):
+    """``fine`` (the ``source`` history) as ``interval`` bars, memoized per cache version."""
+    key = (symbol, interval, source)
+    signature = get_cache_backend().signature(symbol, source)
+    hist = _memory_cache.get(key, signature)
+    if hist is None:
+        hist = trim(resample(fine, interval), interval)
+        _memory_cache.put(key, signature, hist)
+    return hist.copy(deep=False)
+
+
+def _source_mark(source):
+    # The source bars a derived history was built from: first and last bar,
+    # row count and last close (a refetched bar can change in place)
+    stamps = source.index.as_unit("ns").asi8
+    close = float(source["Close"].iloc[-1]) if "Close" in source else None
+    return {"first": int(stamps[0]), "last": int(stamps[-1]), "rows": len(source), "close": close}
+
+
+def _derive(symbol: str, interval: str, source):
+    """Weekly/monthly bars of ``source`` (the symbol's daily history), cached.
+
+    The derived bars are stored like any other history, with a note of the
+    source bars they were built from. When the source has only grown since,
+    just the bars from the one holding the last source bar seen onwards are
+    rebuilt and appended; otherwise everything is resampled.
+    """
+    backend = get_cache_backend()
+    mark = _source_mark(source)
+    cached = _read_cache(symbol, interval)
+    seen = load_state(backend, symbol, interval, "source") if cached is not None else None
+    if seen == mark:
+        return cached
+
+    with timed("resample"):
+        stamps = source.index.as_unit("ns").asi8
+        extends = (
+            seen is not None
+            and seen.get("first") == mark["first"]
+            and 0 < seen.get("rows", 0) <= len(source)
+            and int(stamps[seen["rows"] - 1]) == seen.get("last")
+        )
+        if extends:
+            last = source.index[seen["rows"] - 1:seen["rows"]]
+            wall = last.tz_localize(None) if last.tz is not None else last
+            start = pd.Timestamp(bucket_start(wall.to_numpy(), interval)[0])
+            if last.tz is not None:
+                start = start.tz_localize(last.tz)
+            new_rows = resample(source[source.index >= start], interval)
+            hist = _write_cache(symbol, interval, pd.concat([cached[cached.index < start], new_rows]), new_rows)
+        else:
+            hist = _write_cache(symbol, interval, resample(source, interval))
+    save_state(backend, symbol, interval, "source", mark)
+    return hist
+
+
+def _histories(
+    symbols,
+    interval: str,
+    period=None,
+    start=None,
+    end=None,
+    chunk_size: int = 50,
+    refetch_last: bool = False,
+):
+    """Bring the cached histories of ``symbols`` at ``interval`` up to the range asked for.
+
+    The range starts at ``start``, or where ``period`` starts for each
+    symbol (see ``data.download_histories``), and runs to the latest bar, or to
+    ``end`` if that is already cached. Only the bars missing before the
+    first cached one (the head) and after the last (the tail) are
+    downloaded. Returns symbol -> (whole cached history, wall-clock start
+    of the range), in the order of ``symbols``.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if interval in DERIVED:
+        sources = _histories(symbols, DERIVED[interval], period, start, end, chunk_size, refetch_last)
+        # The range starts with the (whole) bar holding its first day
+        return {
+            symbol: (_derive(symbol, interval, hist), _bucket(since, interval))
+            for symbol, (hist, since) in sources.items()
+        }
+
+    start = _wall(start) if start is not None else None
+    end = _wall(end) if end is not None else None
+    histories = {}
+    ranges = {}
+    starts = {}
+    missing = {}
+    heads = {}
+    top_ups = {}
+    derived = {}
+
+    for symbol in symbols:
+        cached = _read_cache(symbol, interval)
+        if cached is None:
+            source = _finer_source(symbol, interval)
+            if source is not None:
+                derived.setdefault(source, []).append(symbol)
+                continue
+        state = ranges[symbol] = _load_range(symbol, interval, cached)
+        now = _wall(now_like(cached.index)) if cached is not None else None
+        first = starts[symbol] = _requested_start(state["periods"], interval, period, start, now)
+        if cached is None:
+            CACHE_LOOKUPS.inc(result="miss")
+            missing.setdefault(("period", period) if period is not None else ("start", first), []).append(symbol)
+            continue
+        histories[symbol] = cached
+        stale = not _covers(state, first)
+        if stale:
+            heads.setdefault((first, _wall(cached.index[0])), []).append(symbol)
+        key = (symbol, interval)
+        start_date = _next_start(cached, interval, refetch_last, checked=_top_ups.get(key))
+        if start_date is not None and end is not None and _wall(start_date) > end:
+            start_date = None
+        CACHE_LOOKUPS.inc(result="hit" if start_date is None and not stale else "stale")
+        if start_date is not None:
+            if is_intraday(interval):
+                _top_ups[key] = time.time()
+            # Most of a universe shares the same last bar, so grouping by
+            # start date keeps the number of batches small.
+            top_ups.setdefault(start_date, []).append(symbol)
+
+    results = {}
+    for source, group in derived.items():
+        for symbol, (fine, since) in _histories(group, source, period, start, end, chunk_size, refetch_last).items():
+            results[symbol] = (_resampled(symbol, interval, source, fine), since)
+
+    # Heads end where the cache starts; a symbol can need its tail too, so
+    # they are fetched in a round of their own
+    head_tasks = []
+    for (first, until), group in heads.items():
+        params = {"start": first, "end": until} if first is not None else {"period": "max"}
+        for chunk in _chunks(group, chunk_size):
+            head_tasks.append(FetchTask(chunk, {**params, "interval": interval}, required=False))
+    tasks = []
+    for start_date, group in top_ups.items():
+        for chunk in _chunks(group, chunk_size):
+            tasks.append(FetchTask(chunk, {"start": start_date, "interval": interval}, required=False))
+    for (kind, value), group in missing.items():
+        params = {"period": value} if kind == "period" or value is None else {"start": value}
+        for chunk in _chunks(group, chunk_size):
+            tasks.append(FetchTask(chunk, {**params, "interval": interval}))
+
+    head_symbols = {symbol for group in heads.values() for symbol in group}
+    head_rows, failed = {}, set()
+    if head_tasks:
+        head_rows = _run_fetch(head_tasks)
+        head_report = _last_fetch_report
+        failed = {failure.symbol for failure in head_report.failures}
+    new_rows = _run_fetch(tasks) if tasks else {}
+    if head_tasks and tasks:
+        _last_fetch_report.extend(head_report)
+
+    backend = get_cache_backend()
+    for symbol in symbols:
+        state = ranges.get(symbol)
+        if state is None:
+            continue
+        saved = json.dumps(state, sort_keys=True)
+        hist = histories.get(symbol)
+        head, tail = head_rows.get(symbol), new_rows.get(symbol)
+        if hist is None:
+            if tail is None:
+                continue
+            hist = _write_cache(symbol, interval, tail)
+            state["start"] = _iso(starts[symbol])
+        else:
+            if symbol in head_symbols and symbol not in failed:
+                state["start"] = _iso(starts[symbol])
+            if head is not None or tail is not None:
+                merged = _merge_history(head, hist) if head is not None else hist
+                merged = _merge_history(merged, tail) if tail is not None else merged
+                hist = _write_cache(symbol, interval, merged, tail if head is None else None)
+        if period is not None and period not in state["periods"] and _covers(state, starts[symbol]):
+            state["periods"][period] = _iso(starts[symbol])
+        if json.dumps(state, sort_keys=True) != saved:
+            save_state(backend, symbol, interval, "range", state)
+        results[symbol] = (hist, starts[symbol])
+
+    return {symbol: results[symbol] for symbol in symbols if symbol in results}
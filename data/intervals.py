@@ -0,0 +1,208 @@
+"""Bar intervals: their length, how much of them to keep, and resampling.
+
+Daily bars are topped up once per day. Intraday bars (1m, 5m, 15m, 1h) are
+topped up as soon as a new bar can exist, and their caches only keep a
+rolling window of recent history (``RETENTION``, at most what yfinance
+serves for the interval), so they do not grow without bound.
+
+A coarser intraday interval can be derived from a finer cached one with
+``resample`` instead of being downloaded separately: the bars are bucketed
+from the session open, so hourly bars line up with the exchange's own.
+Weekly and monthly bars are always derived, from the daily bars
+(``DERIVED``), and labelled with the first day of their week or month
+like yfinance's.
+
+``period_start`` turns a yfinance period (``1y``, ``60d``, ``ytd``...) into
+the date it reaches back to, so histories can be cached per interval only
+and sliced to whatever lookback a caller asks for.
+
+The daily session closes at ``STOCKS_SESSION_CLOSE`` (default ``16:00``) in
+``STOCKS_MARKET_TZ`` (default ``Asia/Jakarta``) on weekdays; ``last_close``
+is the latest such close, after which a day's daily bar is final.
+"""
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Bar length of each supported interval
+BAR_LENGTHS = {
+    "1m": pd.Timedelta(minutes=1),
+    "5m": pd.Timedelta(minutes=5),
+    "15m": pd.Timedelta(minutes=15),
+    "1h": pd.Timedelta(hours=1),
+    "1d": pd.Timedelta(days=1),
+}
+INTRADAY = ("1m", "5m", "15m", "1h")
+INTERVALS = INTRADAY + ("1d", "1wk", "1mo")
+
+# Calendar intervals built from another interval's bars instead of downloaded
+DERIVED = {"1wk": "1d", "1mo": "1d"}
+
+# History kept in the cache per intraday interval
+RETENTION = {
+    "1m": pd.Timedelta(days=7),
+    "5m": pd.Timedelta(days=60),
+    "15m": pd.Timedelta(days=60),
+    "1h": pd.Timedelta(days=730),
+}
+
+# History the scanners read per interval
+SCAN_PERIODS = {"1m": "7d", "5m": "60d", "15m": "60d", "1h": "1y", "1d": "1y", "1wk": "5y", "1mo": "10y"}
+
+# yfinance periods: a count of days/weeks/months/years, year to date or everything
+PERIOD_PATTERN = re.compile(r"(\d+)(d|wk|mo|y)|ytd|max")
+_PERIOD_UNITS = {"d": "days", "wk": "weeks", "mo": "months", "y": "years"}
+
+# Exchange time zone and the time of day its daily session closes
+MARKET_TZ = os.environ.get("STOCKS_MARKET_TZ", "Asia/Jakarta")
+SESSION_CLOSE = os.environ.get("STOCKS_SESSION_CLOSE", "16:00")
+
+# How each OHLCV column aggregates into a coarser bar
+AGGREGATION = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Adj Close": "last",
+    "Volume": "sum",
+}
+
+
+def check_interval(interval: str):
+    """Return ``interval`` if it is supported; raise ValueError otherwise."""
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown interval {interval!r}; use {', '.join(INTERVALS)}")
+    return interval
+
+
+def is_intraday(interval: str):
+    return interval in INTRADAY
+
+
+def bar_length(interval: str):
+    return BAR_LENGTHS[interval]
+
+
+def scan_period(interval: str):
+    """The history scans at ``interval`` load."""
+    return SCAN_PERIODS.get(interval, "1y")
+
+
+def period_start(period: str, now=None):
+    """The day ``period`` reaches back to from ``now`` (naive), or None for ``max``."""
+    match = PERIOD_PATTERN.fullmatch(period)
+    if match is None:
+        raise ValueError(f"Unknown period {period!r}")
+    if period == "max":
+        return None
+    today = pd.Timestamp(now if now is not None else datetime.now()).normalize()
+    if period == "ytd":
+        return today.replace(month=1, day=1)
+    count, unit = match.groups()
+    return today - pd.DateOffset(**{_PERIOD_UNITS[unit]: int(count)})
+
+
+def last_close(now=None):
+    """The latest weekday session close at or before ``now``, as a tz-aware Timestamp.
+
+    A naive ``now`` is taken to be exchange time. Exchange holidays are not
+    known, so their close counts like any other weekday's.
+    """
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz=MARKET_TZ)
+    now = now.tz_localize(MARKET_TZ) if now.tz is None else now.tz_convert(MARKET_TZ)
+    hour, minute = SESSION_CLOSE.split(":")
+    close = now.normalize() + pd.Timedelta(hours=int(hour), minutes=int(minute))
+    if close > now:
+        close -= pd.Timedelta(days=1)
+    while close.weekday() >= 5:
+        close -= pd.Timedelta(days=1)
+    return close
+
+
+def earliest_start(interval: str, now):
+    """The earliest start yfinance serves ``interval`` bars from, or None if unlimited.
+
+    One bar of margin keeps a request inside the window however long it
+    takes to be sent.
+    """
+    retention = RETENTION.get(interval)
+    if retention is None:
+        return None
+    return pd.Timestamp(now) - retention + bar_length(interval)
+
+
+def now_like(index):
+    """The current time in the time zone of ``index`` (naive if it has none)."""
+    return pd.Timestamp.now(tz=index.tz) if index.tz is not None else pd.Timestamp(datetime.now())
+
+
+def trim(hist, interval: str, now=None):
+    """Drop the bars of ``hist`` older than the retention window of ``interval``.
+
+    The cutoff is rounded down to midnight, so a cache is trimmed (and
+    rewritten) at most once a day.
+    """
+    retention = RETENTION.get(interval)
+    if retention is None or hist is None or hist.empty:
+        return hist
+    now = now if now is not None else now_like(hist.index)
+    cutoff = (now - retention).normalize()
+    if hist.index[0] >= cutoff:
+        return hist
+    return hist[hist.index >= cutoff]
+
+
+def finer_intervals(interval: str):
+    """Intraday intervals ``interval`` can be resampled from, coarsest first."""
+    if not is_intraday(interval):
+        return []
+    length = bar_length(interval)
+    finer = [i for i in INTRADAY if bar_length(i) < length and length % bar_length(i) == pd.Timedelta(0)]
+    return sorted(finer, key=bar_length, reverse=True)
+
+
+def bucket_start(dates, interval: str):
+    """Start of the ``1d``/``1wk``/``1mo`` bar each of ``dates`` falls in.
+
+    ``dates`` is a datetime64 array (wall-clock times); weeks start on
+    Monday. NaT stays NaT.
+    """
+    dates = np.asarray(dates, dtype="M8[ns]")
+    if interval == "1mo":
+        starts = dates.astype("M8[M]").astype("M8[ns]")
+    else:
+        starts = dates.astype("M8[D]")
+        if interval == "1wk":
+            # 1970-01-01 was a Thursday
+            starts = starts - (starts.view(np.int64) + 3) % 7
+        starts = starts.astype("M8[ns]")
+    return np.where(np.isnat(dates), np.datetime64("NaT"), starts)
+
+
+def resample(hist, interval: str):
+    """Aggregate ``hist`` into bars of ``interval``.
+
+    Intraday buckets start at the session open (the earliest time of day in
+    ``hist``) and never span two days; weekly and monthly ones start on the
+    first day of the week or month. The last bar is partial while its
+    bucket is still open.
+    """
+    index = hist.index
+    if interval in DERIVED:
+        wall = index.tz_localize(None) if index.tz is not None else index
+        buckets = pd.DatetimeIndex(bucket_start(wall.to_numpy(), interval)).as_unit(index.unit)
+        if index.tz is not None:
+            buckets = buckets.tz_localize(index.tz)
+    else:
+        length = bar_length(interval)
+        day = index.normalize()
+        since_midnight = index - day
+        session_open = since_midnight.min()
+        buckets = day + session_open + ((since_midnight - session_open) // length) * length
+    how = {column: AGGREGATION[column] for column in hist.columns if column in AGGREGATION}
+    bars = hist.groupby(buckets).agg(how)
+    bars.index.name = index.name
+    return bars
@@ -0,0 +1,85 @@
+"""In-process LRU cache of loaded histories.
+
+Entries are keyed by (symbol, interval) and remember the on-disk
+signature of the cache entry they were loaded from plus the day they were
+loaded on. A lookup misses when the file changed since (another worker
+topped it up) or a new day started, so a stale frame is never served.
+The cache is bounded by the total memory of the frames it holds.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+def _frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=False).sum())
+
+
+class HistoryCache:
+    """Byte-size-bounded LRU of DataFrames."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (signature, day, frame, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, signature):
+        today = datetime.now().date()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != signature or entry[1] != today):
+                self._drop(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, signature, frame):
+        if signature is None:
+            return
+        size = _frame_bytes(frame)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (signature, datetime.now().date(), frame, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Forget one entry, or everything when ``key`` is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
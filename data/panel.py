@@ -0,0 +1,272 @@
+"""Memory-mapped price panel for a whole ticker universe.
+
+All symbols' OHLCV for one (period, interval) live in a single float64
+array laid out as dates x symbols x fields, next to a small JSON index::
+
+    panel_<period>_<interval>.json           symbols, fields, per-symbol bounds
+    panel_<period>_<interval>.<token>.i8     trading calendar (int64 ns)
+    panel_<period>_<interval>.<token>.f8     values, shape (dates, symbols, fields)
+
+The data files carry a build token so a rebuild never rewrites arrays that
+another process has mapped: the JSON index is swapped atomically to point at
+the new files and stale ones are removed afterwards. Rebuilds of one panel
+are serialized across processes with ``panel_lock`` (a ``.lock`` file next
+to the index), so one builder never removes the files another is writing.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from data.intervals import last_close
+
+try:
+    import fcntl  # not available on Windows
+except ImportError:
+    fcntl = None
+
+FIELDS = ("Open", "High", "Low", "Close", "Adj Close", "Volume")
+
+
+def panel_path(root: str, period: str, interval: str):
+    return os.path.join(root, f"panel_{period}_{interval}.json")
+
+
+class PanelStore:
+    """Read-only view over a panel file.
+
+    ``field(name)`` returns a dates x symbols DataFrame and ``history(symbol)``
+    a dates x fields DataFrame; both are backed by the memory map without
+    copying whenever the requested slice is contiguous in the calendar.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        root = os.path.dirname(path)
+        stat = os.stat(path)
+
+        self.path = path
+        self.signature = (stat.st_ino, stat.st_mtime_ns)
+        self.built = meta["built"]
+        self.built_at = meta.get("built_at")
+        self.symbols = meta["symbols"]
+        self.fields = meta["fields"]
+        self.columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._field_index = {name: i for i, name in enumerate(self.fields)}
+        self._bounds = meta["bounds"]
+        self._dense = meta["dense"]
+        self._unavailable = set(meta.get("unavailable", []))
+
+        rows = meta["rows"]
+        shape = (rows, len(self.symbols), len(self.fields))
+        dates = np.memmap(os.path.join(root, meta["dates_file"]), dtype=np.int64, mode="r", shape=(rows,))
+        self.dates = pd.DatetimeIndex(np.asarray(dates).view("M8[ns]"), name="Date")
+        self.values = np.memmap(os.path.join(root, meta["values_file"]), dtype=np.float64, mode="r", shape=shape)
+
+    def __contains__(self, symbol):
+        return symbol in self.columns
+
+    def is_current(self):
+        """True if the panel file on disk is still the one that was mapped."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == self.signature
+
+    def is_fresh(self, symbols, max_age=None, now=None):
+        """True if the panel is still current and covers every symbol.
+
+        A daily panel is current until the first session close after it was
+        built (see ``intervals.last_close``), so one built during the session
+        goes stale once that day's bar is final. With ``max_age`` (a
+        Timedelta, e.g. one intraday bar) it must instead have been built
+        less than that long ago. ``now`` (tz-aware) defaults to the current
+        time. Symbols that had no data when the panel was built count as
+        covered.
+        """
+        if self.built_at is None:
+            return False
+        built = pd.Timestamp(datetime.fromisoformat(self.built_at).astimezone())
+        if max_age is None:
+            if built < last_close(now):
+                return False
+        else:
+            now = pd.Timestamp(now if now is not None else datetime.now().astimezone())
+            if now - built >= max_age:
+                return False
+        return all(symbol in self.columns or symbol in self._unavailable for symbol in symbols)
+
+    def fingerprint(self, symbols):
+        """Hash of each symbol's last bar (date and values).
+
+        It changes as soon as any of ``symbols`` gets a new or revised bar.
+        """
+        digest = hashlib.sha1()
+        for symbol in symbols:
+            col = self.columns.get(symbol)
+            if col is None:
+                digest.update(f"{symbol}:-;".encode())
+                continue
+            last = self._bounds[col][1] - 1
+            digest.update(f"{symbol}:{self.dates.asi8[last]}:".encode())
+            digest.update(np.ascontiguousarray(self.values[last, col, :]).tobytes())
+        return digest.hexdigest()
+
+    def field(self, name: str, symbols=None):
+        """Return one field as a dates x symbols DataFrame."""
+        values = self.values[:, :, self._field_index[name]]
+        columns = self.symbols
+        if symbols is not None and list(symbols) != self.symbols:
+            positions = [self.columns[s] for s in symbols if s in self.columns]
+            values = values[:, positions]
+            columns = [self.symbols[i] for i in positions]
+        return pd.DataFrame(values, index=self.dates, columns=columns, copy=False)
+
+    def history(self, symbol: str):
+        """Return one symbol's history as a dates x fields DataFrame, or None."""
+        col = self.columns.get(symbol)
+        if col is None:
+            return None
+        first, last = self._bounds[col]
+        if first >= last:
+            return None
+        frame = pd.DataFrame(
+            self.values[first:last, col, :],
+            index=self.dates[first:last],
+            columns=self.fields,
+            copy=False,
+        )
+        if not self._dense[col]:
+            # Dates the symbol did not trade on are all-NaN rows in the
+            # shared calendar; drop them so the history matches the cache.
+            frame = frame.dropna(how="all")
+        return frame
+
+
+def _wall_clock(index):
+    index = pd.DatetimeIndex(index)
+    return index.tz_localize(None) if index.tz is not None else index
+
+
+@contextlib.contextmanager
+def panel_lock(path: str):
+    """Hold the cross-process lock for rebuilding the panel at ``path``.
+
+    Not reentrant: a process must not take it twice for the same panel.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_panel(path: str, histories, unavailable=()):
+    """Write ``histories`` (symbol -> DataFrame) as a panel and open it.
+
+    ``unavailable`` lists requested symbols without any data, so they do not
+    force a rebuild on every load. Returns None when there is no data to write
+    (or the new panel cannot be opened). Call it under ``panel_lock``.
+    """
+    histories = {s: h for s, h in histories.items() if h is not None and not h.empty}
+    if not histories:
+        return None
+    symbols = list(histories)
+    present = set()
+    for hist in histories.values():
+        present.update(hist.columns)
+    fields = [name for name in FIELDS if name in present]
+
+    # Intraday indexes carry the exchange time zone; the calendar holds
+    # their wall-clock times, like the (naive) daily dates
+    indexes = {s: _wall_clock(h.index) for s, h in histories.items()}
+    calendar = pd.DatetimeIndex([])
+    for index in indexes.values():
+        calendar = calendar.union(index)
+    calendar = pd.DatetimeIndex(calendar).as_unit("ns")
+
+    root = os.path.dirname(path)
+    os.makedirs(root, exist_ok=True)
+    base = os.path.splitext(os.path.basename(path))[0]
+    token = uuid.uuid4().hex[:12]
+    dates_file = f"{base}.{token}.i8"
+    values_file = f"{base}.{token}.f8"
+
+    shape = (len(calendar), len(symbols), len(fields))
+    values = np.memmap(os.path.join(root, values_file), dtype=np.float64, mode="w+", shape=shape)
+    values[:] = np.nan
+
+    bounds = []
+    dense = []
+    for col, symbol in enumerate(symbols):
+        hist = histories[symbol]
+        rows = calendar.get_indexer(indexes[symbol].as_unit("ns"))
+        frame = hist.reindex(columns=fields).to_numpy(dtype=np.float64)
+        values[rows, col, :] = frame
+        first, last = int(rows.min()), int(rows.max()) + 1
+        bounds.append([first, last])
+        dense.append(bool(last - first == len(rows)))
+    values.flush()
+    del values
+
+    calendar.asi8.tofile(os.path.join(root, dates_file))
+
+    # With its UTC offset, so freshness does not depend on the server's zone
+    now = datetime.now().astimezone()
+    meta = {
+        "built": now.date().isoformat(),
+        "built_at": now.isoformat(),
+        "rows": len(calendar),
+        "symbols": symbols,
+        "fields": fields,
+        "bounds": bounds,
+        "dense": dense,
+        "unavailable": sorted(set(unavailable) - set(symbols)),
+        "dates_file": dates_file,
+        "values_file": values_file,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+    _remove_stale_files(root, base, token, os.stat(path).st_mtime_ns)
+    for attempt in range(3):
+        panel = open_panel(path)
+        if panel is not None:
+            return panel
+        time.sleep(0.05 * (attempt + 1))
+    return None
+
+
+def open_panel(path: str):
+    """Open an existing panel, or return None if there is none/it is unreadable."""
+    try:
+        return PanelStore(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _remove_stale_files(root: str, base: str, token: str, written: int):
+    # Only files older than the index just written (mtime ``written``) are
+    # stale; processes that still map one keep it alive until they unmap.
+    for filename in os.listdir(root):
+        if filename.startswith(base + ".") and token not in filename and filename[-3:] in (".i8", ".f8"):
+            path = os.path.join(root, filename)
+            try:
+                if os.stat(path).st_mtime_ns < written:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,383 @@
+"""Vectorized cross-sectional scan engine.
+
+The universe is loaded from the shared panel into wide dates x symbols
+matrices, every indicator is computed for all symbols in one pandas pass and
+each mode's conditions are evaluated column-wise. The modes are expressed as
+rules (see ``rules.py``); the mode functions return the same result tuples
+the per-symbol scanners used to build, in ticker order.
+
+Symbols do not all trade on every date of the shared calendar, so each
+column is first right-aligned on its own rows: row ``-1`` is every symbol's
+last bar and rolling windows see exactly the bars of that symbol's history.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data import load_indicator_state, load_panel, save_indicator_state
+from indicators import Mode4State
+from metrics import SYMBOLS_SKIPPED, instrumented, timed
+from rules import (
+    Evaluator,
+    Rule,
+    evaluate,
+    golden_cross_rule,
+    llv_sma_value_rule,
+    lower_low_rule,
+    mode4_rule,
+)
+
+
+class WidePanel:
+    """Right-aligned wide matrices for a set of symbols.
+
+    ``fields`` maps a field name to a DataFrame with a positional index and
+    one column per symbol; ``dates`` is the matching datetime64[ns] matrix
+    (NaT above a symbol's first bar). ``timeframes`` maps an interval to the
+    WidePanel of the same symbols on those bars, for multi-timeframe rules.
+    """
+
+    def __init__(self, symbols, dates, fields, timeframes=None):
+        self.symbols = symbols
+        self.dates = dates
+        self.fields = fields
+        self.timeframes = timeframes or {}
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+
+@instrumented("load_wide")
+def load_wide(tickers, period: str = "1y", interval: str = "1d", fields=("Close", "Low", "Volume"), timeframes=()):
+    """Load ``tickers`` from the panel store as a right-aligned WidePanel.
+
+    ``timeframes`` lists further intervals (e.g. ``rule.timeframes``) to load
+    alongside, over the same period; weekly and monthly bars come from the
+    daily cache without downloads of their own.
+    """
+    others = {
+        other: load_wide(tickers, period=period, interval=other, fields=fields)
+        for other in dict.fromkeys(timeframes)
+    }
+    panel = load_panel(tickers, period=period, interval=interval)
+    if panel is None:
+        return WidePanel([], np.empty((0, 0), dtype="M8[ns]"), {name: pd.DataFrame() for name in fields}, others)
+
+    symbols = [symbol for symbol in tickers if symbol in panel]
+    if len(symbols) < len(tickers):
+        SYMBOLS_SKIPPED.inc(len(tickers) - len(symbols), reason="no_data")
+    positions = [panel.columns[symbol] for symbol in symbols]
+    block = panel.values[:, positions, :]
+    present = ~np.isnan(block).all(axis=2)
+
+    dates = np.broadcast_to(panel.dates.to_numpy()[:, None], present.shape)
+    columns = [dates] + [block[:, :, panel.fields.index(name)] for name in fields if name in panel.fields]
+    aligned = _align_right(columns, present)
+
+    wide = {
+        name: pd.DataFrame(values, columns=symbols)
+        for name, values in zip([n for n in fields if n in panel.fields], aligned[1:])
+    }
+    return WidePanel(symbols, aligned[0], wide, others)
+
+
+def _align_right(arrays, mask):
+    """Move the rows selected by ``mask`` to the bottom of each column.
+
+    Rows keep their relative order; everything above them becomes NaN/NaT.
+    """
+    order = np.argsort(mask, axis=0, kind="stable")
+    keep = np.take_along_axis(mask, order, axis=0)
+    out = []
+    for values in arrays:
+        moved = np.take_along_axis(values, order, axis=0)
+        if moved.dtype.kind == "M":
+            moved = np.where(keep, moved, np.datetime64("NaT"))
+        else:
+            moved = np.where(keep, moved, np.nan)
+        out.append(moved)
+    return out
+
+
+def _last_valid(valid):
+    """Row index of the last True per column, and whether there is one."""
+    rows = valid.shape[0]
+    has = valid.any(axis=0)
+    last = rows - 1 - np.argmax(valid[::-1], axis=0)
+    return np.where(has, last, 0), has
+
+
+def _pick(values, rows):
+    values = np.asarray(values)
+    return values[rows, np.arange(values.shape[1])]
+
+
+def _to_date(value):
+    # Intraday bars keep their time of day
+    stamp = pd.Timestamp(value)
+    return stamp.date() if stamp == stamp.normalize() else stamp.to_pydatetime()
+
+
+def evaluator(wide: WidePanel, rows: int = None):
+    """A rules.Evaluator over ``wide``; share one to reuse indicators.
+
+    With ``rows`` only that many trailing rows are used, so indicators are
+    computed for the latest bars and their warm-up only. Other timeframes
+    are always evaluated over their whole history.
+    """
+    timeframes = {interval: evaluator(other) for interval, other in wide.timeframes.items()}
+    if rows is None:
+        return Evaluator(wide.symbols, wide.dates, wide.fields, timeframes=timeframes)
+    fields = {name: frame.iloc[-rows:] for name, frame in wide.fields.items()}
+    return Evaluator(wide.symbols, wide.dates[-rows:], fields, latest=True, timeframes=timeframes)
+
+
+def latest_window(rules):
+    """Trailing rows that cover every rule's latest bar, or None for all rows."""
+    windows = [rule.window() for rule in rules]
+    if not windows or any(window is None for window in windows):
+        return None
+    return max(windows)
+
+
+def evaluate_rule(rule: Rule, wide: WidePanel, ev: Evaluator = None, latest_only: bool = True):
+    """Symbols of ``wide`` matching ``rule``, in ticker order.
+
+    Each match is a dict with ``symbol``, the rule's outputs and ``date``
+    (the bar the rule was evaluated on: the last one where every value the
+    rule uses is available). Rules that report a date of their own, like the
+    golden cross date, leave ``date`` out.
+
+    ``latest_only`` computes the indicators just for the trailing rows the
+    rule needs (see ``Rule.window``) instead of the whole history.
+    """
+    if not wide.symbols:
+        return []
+    ev = ev or evaluator(wide, latest_window([rule]) if latest_only else None)
+    leaves = {node.key: ev.values(node) for node in rule.leaves}
+    with timed("evaluate"):
+        valid = np.logical_and.reduce([~np.isnan(v) for v in leaves.values()])
+        rows, has = _last_valid(valid)
+        if rule.min_rows > 1:
+            has &= valid.sum(axis=0) >= rule.min_rows
+        if not has.all():
+            SYMBOLS_SKIPPED.inc(int((~has).sum()), reason="insufficient_history")
+
+        last = {key: _pick(values, rows) for key, values in leaves.items()}
+        match = has & evaluate(rule.condition, last)
+    for node in rule.date_leaves:
+        last[node.key] = _pick(ev.values(node), rows)
+
+    dates = _pick(ev.dates, rows)
+    results = []
+    for j in np.flatnonzero(match):
+        row = {"symbol": wide.symbols[j]}
+        for name, expr in rule.outputs:
+            value = evaluate(expr, last)
+            value = value[j] if np.ndim(value) else value
+            row[name] = _to_date(value) if expr.kind == "date" else float(value)
+        if not rule.date_leaves:
+            row["date"] = _to_date(dates[j])
+        results.append(row)
+    return results
+
+
+def rule_signals(rule: Rule, wide: WidePanel, ev: Evaluator = None):
+    """Evaluate ``rule`` on every bar instead of only the last one.
+
+    Returns two boolean matrices shaped like ``wide``'s fields: where the
+    rule matched, and where it could be evaluated (every value it uses is
+    available and at least ``min_rows`` such bars have passed).
+    """
+    ev = ev or evaluator(wide)
+    leaves = {node.key: ev.values(node) for node in rule.leaves}
+    with timed("evaluate"):
+        valid = np.logical_and.reduce([~np.isnan(v) for v in leaves.values()])
+        if rule.min_rows > 1:
+            valid &= np.cumsum(valid, axis=0) >= rule.min_rows
+        match = valid & evaluate(rule.condition, leaves)
+    return match, valid
+
+
+def evaluate_rules(rules, wide: WidePanel, latest_only: bool = True):
+    """Evaluate several rules over one universe.
+
+    ``rules`` maps a name to a Rule; indicators used by more than one rule
+    are computed once. Returns name -> matches as from ``evaluate_rule``.
+    """
+    # Rules that need the whole history share a full evaluator; the rest
+    # share one over the longest trailing window among them.
+    bounded = [rule for rule in rules.values() if latest_only and rule.window() is not None]
+    latest = evaluator(wide, latest_window(bounded)) if bounded else None
+    full = None
+    results = {}
+    for name, rule in rules.items():
+        if latest is not None and rule in bounded:
+            ev = latest
+        else:
+            full = full or evaluator(wide)
+            ev = full
+        results[name] = evaluate_rule(rule, wide, ev)
+    return results
+
+
+def golden_cross(wide: WidePanel, lookback_days: int = 5):
+    """Symbols whose MA20 crossed above MA50 within ``lookback_days``.
+
+    Returns (symbol, last_close, gc_date) tuples.
+    """
+    return [
+        (row["symbol"], row["last_price"], row["gc_date"])
+        for row in evaluate_rule(golden_cross_rule(lookback_days), wide)
+    ]
+
+
+def llv_sma_value(
+    wide: WidePanel,
+    llv_window: int = 5,
+    sma_period: int = 50,
+    near_low: float = 0.99,
+    near_high: float = 1.02,
+    min_value: float = 1e9,
+):
+    """LLV(llv_window) > SMA, close near SMA and traded value >= min_value.
+
+    Returns (symbol, close, sma, value, date) tuples.
+    """
+    rule = llv_sma_value_rule(llv_window, sma_period, near_low, near_high, min_value)
+    return [
+        (row["symbol"], row["close"], row["sma"], row["value"], row["date"])
+        for row in evaluate_rule(rule, wide)
+    ]
+
+
+def mode4_combo(wide: WidePanel):
+    """Close > SMA50 > SMA150 > SMA200 and traded value >= 1B.
+
+    Returns (symbol, close, sma20, sma50, sma150, sma200, value, rsi14, date)
+    tuples.
+    """
+    return [
+        (
+            row["symbol"],
+            row["close"],
+            row["sma20"],
+            row["sma50"],
+            row["sma150"],
+            row["sma200"],
+            row["value"],
+            row["rsi14"],
+            row["date"],
+        )
+        for row in evaluate_rule(mode4_rule(), wide)
+    ]
+
+
+# Mode 4 indicator states kept by this process, keyed by (symbol, period, interval)
+_mode4_states = {}
+# One lock per key, so concurrent scans never feed a state the same bars twice
+_mode4_locks = {}
+_mode4_locks_guard = threading.Lock()
+
+
+def clear_mode4_states():
+    """Drop the Mode 4 states held in memory (persisted states are kept)."""
+    _mode4_states.clear()
+
+
+def _mode4_lock(key):
+    with _mode4_locks_guard:
+        lock = _mode4_locks.get(key)
+        if lock is None:
+            lock = _mode4_locks[key] = threading.Lock()
+        return lock
+
+
+def _mode4_state(symbol, period, interval, hist):
+    """Return the symbol's Mode4State advanced to the end of ``hist``.
+
+    Only bars after the last one the (persisted) state has seen are
+    processed; the state is rebuilt if the history was rewritten.
+    """
+    key = (symbol, period, interval)
+    with _mode4_lock(key):
+        state = _mode4_states.get(key)
+        if state is None:
+            saved = load_indicator_state(symbol, period, interval, "mode4")
+            try:
+                state = Mode4State.from_dict(saved) if saved is not None else None
+            except (KeyError, TypeError, ValueError):
+                state = None
+        if state is None or not state.matches(hist):
+            state = Mode4State()
+        with timed("indicator.mode4_state"):
+            advanced = state.advance(hist)
+        if advanced:
+            save_indicator_state(symbol, period, interval, "mode4", state.to_dict())
+        _mode4_states[key] = state
+        return state
+
+
+def mode4_combo_incremental(tickers, period: str = "1y", interval: str = "1d"):
+    """Mode 4 evaluated from incremental indicator state.
+
+    Same conditions and result tuples as ``mode4_combo``, but a daily
+    re-scan only feeds each symbol's newly appended bars through its
+    persisted state instead of recomputing the indicators over the whole
+    history.
+    """
+    panel = load_panel(tickers, period=period, interval=interval)
+    if panel is None:
+        return []
+
+    symbols = []
+    latest = []
+    for symbol in tickers:
+        hist = panel.history(symbol) if symbol in panel else None
+        if hist is None or not {"Close", "Volume"}.issubset(hist.columns):
+            SYMBOLS_SKIPPED.inc(reason="no_data")
+            continue
+        state = _mode4_state(symbol, period, interval, hist)
+        # Require all indicators present, on at least 20 rows
+        if state.latest is None or state.valid_rows < 20:
+            SYMBOLS_SKIPPED.inc(reason="insufficient_history")
+            continue
+        symbols.append(symbol)
+        latest.append(state.latest)
+    if not symbols:
+        return []
+
+    last = {name: np.array([row[name] for row in latest]) for name in latest[0]}
+    trading_value = last["Close"] * last["Volume"]
+    match = (
+        (last["Close"] > last["SMA50"])
+        & (last["SMA50"] > last["SMA150"])
+        & (last["SMA150"] > last["SMA200"])
+        & (trading_value >= 1e9)
+    )
+    return [
+        (
+            symbols[j],
+            float(last["Close"][j]),
+            float(last["SMA20"][j]),
+            float(last["SMA50"][j]),
+            float(last["SMA150"][j]),
+            float(last["SMA200"][j]),
+            float(trading_value[j]),
+            float(last["RSI14"][j]),
+            _to_date(np.datetime64(int(last["Date"][j]), "ns")),
+        )
+        for j in np.flatnonzero(match)
+    ]
+
+
+def lower_low_3days(wide: WidePanel):
+    """Three consecutive lower daily lows.
+
+    Returns (symbol, close, low_3, low_2, low_1, date) tuples.
+    """
+    return [
+        (row["symbol"], row["close"], row["low_3"], row["low_2"], row["low_1"], row["date"])
+        for row in evaluate_rule(lower_low_rule(), wide)
+    ]
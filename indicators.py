@@ -1,50 +1,378 @@
-import pandas as pd
+import math
+import sys
+from collections import deque
 
+from metrics import instrumented
 
+
+# The helpers below take either a Series (one symbol) or a DataFrame with one
+# column per symbol; pandas applies the rolling/ewm operations column-wise.
+
+
+@instrumented("indicator.sma")
+def sma(values, period: int):
+    """Simple moving average."""
+    return values.rolling(period).mean()
+
+
+@instrumented("indicator.llv_prev")
+def llv_prev(low, window: int):
+    """Lowest low of the previous ``window`` bars (excluding the current bar)."""
+    return low.rolling(window).min().shift(1)
+
+
+@instrumented("indicator.bollinger_width")
+def bollinger_width(close, period: int = 20):
+    """Bollinger Band width: upper - lower = 4 * std (±2 std)."""
+    return 4 * close.rolling(period).std()
+
+
+@instrumented("indicator.macd")
+def macd(close, fast: int = 12, slow: int = 26, signal: int = 9):
+    """Return the MACD line, signal line and histogram."""
+    ema_fast = close.ewm(span=fast, adjust=False).mean()
+    ema_slow = close.ewm(span=slow, adjust=False).mean()
+    line = ema_fast - ema_slow
+    signal_line = line.ewm(span=signal, adjust=False).mean()
+    return line, signal_line, line - signal_line
+
+
+@instrumented("indicator.rsi")
+def rsi(close, period: int = 14):
+    """RSI using simple moving averages of gains and losses."""
+    delta = close.diff()
+    gain = delta.clip(lower=0)
+    loss = -delta.clip(upper=0)
+    avg_gain = gain.rolling(period).mean()
+    avg_loss = loss.rolling(period).mean()
+    # A zero average loss leaves RSI undefined (NaN) rather than 100
+    rs = avg_gain / avg_loss.where(avg_loss != 0)
+    return 100 - (100 / (1 + rs))
+
+
+@instrumented("indicator.add_ma20_ma50_for_close")
 def add_ma20_ma50_for_close(df):
     """Add MA20 and MA50 columns based on the Close price."""
-    df["MA20"] = df["Close"].rolling(20).mean()
-    df["MA50"] = df["Close"].rolling(50).mean()
+    df["MA20"] = sma(df["Close"], 20)
+    df["MA50"] = sma(df["Close"], 50)
     return df
 
 
+@instrumented("indicator.add_sma_and_llv_prev")
 def add_sma_and_llv_prev(df, sma_period: int, llv_window: int):
     """Add SMA and LLV_prev columns used by the LLV/SMA scanners."""
-    df["SMA"] = df["Close"].rolling(sma_period).mean()
-    df["LLV_prev"] = df["Low"].rolling(llv_window).min().shift(1)
+    df["SMA"] = sma(df["Close"], sma_period)
+    df["LLV_prev"] = llv_prev(df["Low"], llv_window)
     return df
 
 
+@instrumented("indicator.add_mode4_indicators")
 def add_mode4_indicators(df):
     """Add all indicators required by the mode 4 combo scanner.
 
     This includes SMA20/50/150/200, Bollinger Band width, MACD and RSI14.
     """
     # Moving averages
-    df["SMA20"] = df["Close"].rolling(20).mean()
-    df["SMA50"] = df["Close"].rolling(50).mean()
-    df["SMA150"] = df["Close"].rolling(150).mean()
-    df["SMA200"] = df["Close"].rolling(200).mean()
+    df["SMA20"] = sma(df["Close"], 20)
+    df["SMA50"] = sma(df["Close"], 50)
+    df["SMA150"] = sma(df["Close"], 150)
+    df["SMA200"] = sma(df["Close"], 200)
 
     # Bollinger Band width (20 period, 2 std)
-    rolling20 = df["Close"].rolling(20)
-    bb_std = rolling20.std()
-    df["BB_width"] = 4 * bb_std  # upper - lower = 4 * std (±2 std)
+    df["BB_width"] = bollinger_width(df["Close"], 20)
 
     # MACD (12,26,9)
-    ema12 = df["Close"].ewm(span=12, adjust=False).mean()
-    ema26 = df["Close"].ewm(span=26, adjust=False).mean()
-    df["MACD"] = ema12 - ema26
-    df["MACD_signal"] = df["MACD"].ewm(span=9, adjust=False).mean()
-    df["MACD_hist"] = df["MACD"] - df["MACD_signal"]
+    df["MACD"], df["MACD_signal"], df["MACD_hist"] = macd(df["Close"])
 
     # RSI(14) using simple moving averages
-    delta = df["Close"].diff()
-    gain = delta.clip(lower=0)
-    loss = -delta.clip(upper=0)
-    avg_gain = gain.rolling(14).mean()
-    avg_loss = loss.rolling(14).mean()
-    rs = avg_gain / avg_loss.replace(0, pd.NA)
-    df["RSI14"] = 100 - (100 / (1 + rs))
+    df["RSI14"] = rsi(df["Close"], 14)
 
     return df
+
+
+# Incremental indicator state
+#
+# The classes below advance an indicator one bar at a time using the same
+# update rules as pandas' rolling/ewm kernels, so a state that has seen a
+# history from its first bar yields exactly the values a full recomputation
+# would. They serialize to plain dicts for persisting next to the price cache.
+
+
+class RollingMean:
+    """Rolling mean over a fixed window (Kahan-compensated add/remove)."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.total = 0.0
+        self.neg_ct = 0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_ct = 0
+        self.prev = math.nan
+
+    def update(self, value: float):
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+        self._add(value)
+
+        if self.nobs >= self.window and self.nobs > 0:
+            result = self.total / self.nobs
+            if self.same_ct >= self.nobs:
+                result = self.prev
+            elif self.neg_ct == 0 and result < 0:
+                result = 0.0
+            elif self.neg_ct == self.nobs and result > 0:
+                result = 0.0
+            return result
+        return math.nan
+
+    def _add(self, value):
+        if value != value:
+            return
+        self.nobs += 1
+        y = value - self.comp_add
+        t = self.total + y
+        self.comp_add = t - self.total - y
+        self.total = t
+        if math.copysign(1.0, value) < 0:
+            self.neg_ct += 1
+        self.same_ct = self.same_ct + 1 if value == self.prev else 1
+        self.prev = value
+
+    def _remove(self, value):
+        if value != value:
+            return
+        self.nobs -= 1
+        y = -value - self.comp_remove
+        t = self.total + y
+        self.comp_remove = t - self.total - y
+        self.total = t
+        if math.copysign(1.0, value) < 0:
+            self.neg_ct -= 1
+
+    def to_dict(self):
+        state = dict(self.__dict__)
+        state["values"] = list(self.values)
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        obj.values = deque(state["values"])
+        return obj
+
+
+class RollingStd(RollingMean):
+    """Rolling sample standard deviation (Welford with Kahan compensation)."""
+
+    # Like pandas, rebuild the window when a removal cancels the sum of
+    # squared deviations down to this fraction of itself
+    RESTART_TOLERANCE = 1e3 * sys.float_info.epsilon
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.mean = 0.0
+        self.ssqdm = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+
+    def update(self, value: float):
+        self.values.append(value)
+        if len(self.values) > self.window and self._remove(self.values.popleft()):
+            self.nobs = 0
+            self.mean = self.ssqdm = self.comp_add = self.comp_remove = 0.0
+            for v in self.values:
+                self._add(v)
+        else:
+            self._add(value)
+
+        if self.nobs >= self.window and self.nobs > 1:
+            variance = self.ssqdm / (self.nobs - 1)
+            return math.sqrt(variance) if variance > 0 else 0.0
+        return math.nan
+
+    def _add(self, value):
+        if value != value:
+            return
+        self.nobs += 1
+        prev_mean = self.mean - self.comp_add
+        y = value - self.comp_add
+        t = y - self.mean
+        self.comp_add = t + self.mean - y
+        self.mean = self.mean + t / self.nobs
+        self.ssqdm += (value - prev_mean) * (value - self.mean)
+
+    def _remove(self, value):
+        """Remove ``value``; returns True when the window must be rebuilt."""
+        if value != value:
+            return False
+        self.nobs -= 1
+        if self.nobs:
+            before = self.ssqdm
+            prev_mean = self.mean - self.comp_remove
+            y = value - self.comp_remove
+            t = y - self.mean
+            self.comp_remove = t + self.mean - y
+            self.mean -= t / self.nobs
+            self.ssqdm -= (value - prev_mean) * (value - self.mean)
+            return self.ssqdm < before * self.RESTART_TOLERANCE
+        self.mean = 0.0
+        self.ssqdm = 0.0
+        return False
+
+
+class Ema:
+    """Exponential moving average, as ``ewm(span=span, adjust=False).mean()``."""
+
+    def __init__(self, span: int):
+        self.alpha = 2.0 / (span + 1.0)
+        self.weighted = math.nan
+        self.old_wt = 1.0
+
+    def update(self, value: float):
+        if self.weighted == self.weighted:
+            self.old_wt *= 1.0 - self.alpha
+            if value == value:
+                if self.weighted != value:
+                    self.weighted = self.old_wt * self.weighted + self.alpha * value
+                    self.weighted /= self.old_wt + self.alpha
+                self.old_wt = 1.0
+        elif value == value:
+            self.weighted = value
+        return self.weighted
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        return obj
+
+
+class Mode4State:
+    """Incremental version of ``add_mode4_indicators`` for one symbol.
+
+    ``advance(df)`` feeds the rows of ``df`` that are newer than the last
+    bar seen. ``latest`` holds the Close/Volume/indicator values of the most
+    recent bar where all of them are defined (what the mode 4 scanner reads
+    after ``dropna``) and ``valid_rows`` counts such bars.
+    """
+
+    FEATURES = ("SMA20", "SMA50", "SMA150", "SMA200", "BB_width", "MACD_hist", "RSI14")
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.last_bar = None
+        self.rows = 0
+        self.valid_rows = 0
+        self.latest = None
+        self.prev_close = math.nan
+        self.sma = {period: RollingMean(period) for period in (20, 50, 150, 200)}
+        self.bb_std = RollingStd(20)
+        self.ema_fast = Ema(12)
+        self.ema_slow = Ema(26)
+        self.ema_signal = Ema(9)
+        self.avg_gain = RollingMean(14)
+        self.avg_loss = RollingMean(14)
+
+    def matches(self, df):
+        """True if ``df`` extends the history this state was built from.
+
+        The last bar seen is compared by value too, since a top-up can
+        replace a partial bar for the same date.
+        """
+        if self.last is None:
+            return True
+        if len(df) < self.rows:
+            return False
+        stamps = df.index.as_unit("ns").asi8
+        if int(stamps[0]) != self.first or int(stamps[self.rows - 1]) != self.last:
+            return False
+        last_bar = [float(df["Close"].iloc[self.rows - 1]), float(df["Volume"].iloc[self.rows - 1])]
+        return all(a == b or (a != a and b != b) for a, b in zip(last_bar, self.last_bar))
+
+    def advance(self, df):
+        """Feed the bars of ``df`` after the last one seen; return how many."""
+        stamps = df.index.as_unit("ns").asi8
+        start = self.rows if self.last is not None else 0
+        if start >= len(df):
+            return 0
+        closes = df["Close"].to_numpy(dtype=float)
+        volumes = df["Volume"].to_numpy(dtype=float)
+        for i in range(start, len(df)):
+            self._update(int(stamps[i]), float(closes[i]), float(volumes[i]))
+        if self.first is None:
+            self.first = int(stamps[0])
+        return len(df) - start
+
+    def _update(self, stamp, close, volume):
+        values = {"Close": close, "Volume": volume}
+        for period, window in self.sma.items():
+            values[f"SMA{period}"] = window.update(close)
+        values["BB_width"] = 4 * self.bb_std.update(close)
+
+        line = self.ema_fast.update(close) - self.ema_slow.update(close)
+        values["MACD_hist"] = line - self.ema_signal.update(line)
+
+        # Same gain/loss split (and signed zeros) as Series.clip
+        delta = close - self.prev_close
+        gain = delta if delta != delta or delta >= 0 else 0.0
+        loss = -(delta if delta != delta or delta <= 0 else 0.0)
+        self.prev_close = close
+        avg_gain = self.avg_gain.update(gain)
+        avg_loss = self.avg_loss.update(loss)
+        values["RSI14"] = 100 - (100 / (1 + avg_gain / avg_loss)) if avg_loss != 0 else math.nan
+
+        self.last = stamp
+        self.last_bar = [close, volume]
+        self.rows += 1
+        if all(v == v for v in values.values()):
+            self.valid_rows += 1
+            values["Date"] = stamp
+            self.latest = values
+
+    def to_dict(self):
+        return {
+            "first": self.first,
+            "last": self.last,
+            "last_bar": self.last_bar,
+            "rows": self.rows,
+            "valid_rows": self.valid_rows,
+            "latest": self.latest,
+            "prev_close": self.prev_close,
+            "sma": {str(p): w.to_dict() for p, w in self.sma.items()},
+            "bb_std": self.bb_std.to_dict(),
+            "ema_fast": self.ema_fast.to_dict(),
+            "ema_slow": self.ema_slow.to_dict(),
+            "ema_signal": self.ema_signal.to_dict(),
+            "avg_gain": self.avg_gain.to_dict(),
+            "avg_loss": self.avg_loss.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls.__new__(cls)
+        obj.first = state["first"]
+        obj.last = state["last"]
+        obj.last_bar = state["last_bar"]
+        obj.rows = state["rows"]
+        obj.valid_rows = state["valid_rows"]
+        obj.latest = state["latest"]
+        obj.prev_close = state["prev_close"]
+        obj.sma = {int(p): RollingMean.from_dict(w) for p, w in state["sma"].items()}
+        obj.bb_std = RollingStd.from_dict(state["bb_std"])
+        obj.ema_fast = Ema.from_dict(state["ema_fast"])
+        obj.ema_slow = Ema.from_dict(state["ema_slow"])
+        obj.ema_signal = Ema.from_dict(state["ema_signal"])
+        obj.avg_gain = RollingMean.from_dict(state["avg_gain"])
+        obj.avg_loss = RollingMean.from_dict(state["avg_loss"])
+        return obj
@@ -0,0 +1,187 @@
+"""Asynchronous scan jobs for the web API.
+
+``POST /scan`` submits a job and returns its id right away; the scan runs on
+a small bounded thread pool and ``GET /scan/<id>`` reports how many symbols
+have been processed and the matches found so far. A cold universe is
+fetched in chunks, so a scan that has to download most of its data shows
+progress as it goes, and is then loaded into its panels once; ``iter_scan``
+exposes the same scan to the streaming endpoint. Submitting a scan
+identical to one that is still queued or running returns the existing job
+instead of starting another.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from data import download_histories, is_panel_fresh, load_panel
+from data.intervals import check_interval, scan_period
+from result_cache import peek_result, store_result
+from results import ResultBatch, concat
+from rules import compile_rule
+from scanners import mode_layout, resolve_mode, rule_layout, run_mode
+
+# Symbols per progress step; matches the download batch size
+CHUNK_SIZE = 50
+
+
+def _scan_panels(tickers, rule: str = None, interval: str = "1d"):
+    """The (period, interval) panels a scan of ``tickers`` reads."""
+    period = scan_period(check_interval(interval))
+    timeframes = compile_rule(rule).timeframes if rule else ()
+    return [(period, other) for other in dict.fromkeys((interval, *timeframes))]
+
+
+def iter_scan(mode, tickers, label: str = "", chunk_size: int = CHUNK_SIZE, rule: str = None, interval: str = "1d"):
+    """Scan ``tickers`` chunk by chunk.
+
+    Yields ``(processed, batch, cached)`` steps, where ``processed`` counts
+    the symbols whose data is loaded and ``batch`` is a results.ResultBatch
+    of matches in ticker order. When the panels are not fresh, histories are
+    first fetched chunk by chunk (steps with empty batches) and the panels
+    are then built once for the whole universe; each chunk is evaluated
+    against them. A cached result is yielded as a single step; a freshly
+    computed one is stored in the result cache once the last chunk is done.
+    A custom ``rule`` takes the place of the mode; ``interval`` is the bar
+    size to scan.
+    """
+    tickers = list(tickers)
+    result = peek_result(mode, tickers, rule=rule, interval=interval)
+    if result is not None:
+        yield len(tickers), result, True
+        return
+
+    panels = _scan_panels(tickers, rule, interval)
+    if not all(is_panel_fresh(tickers, period, other) for period, other in panels):
+        fields = (rule_layout(compile_rule(rule)) if rule else mode_layout(mode))["fields"]
+        for start in range(0, len(tickers), chunk_size):
+            chunk = tickers[start:start + chunk_size]
+            for period, other in panels:
+                download_histories(chunk, period, other)
+            yield start + len(chunk), ResultBatch.from_rows(fields, []), False
+        for period, other in panels:
+            load_panel(tickers, period, other)
+
+    batches = []
+    for start in range(0, len(tickers), chunk_size):
+        batch = run_mode(mode, tickers[start:start + chunk_size], label=label, rule=rule, interval=interval)
+        batches.append(batch)
+        yield len(tickers), batch, False
+    if batches:
+        store_result(mode, tickers, concat(batches), rule=rule, interval=interval)
+
+
+class ScanJob:
+    """State of one submitted scan."""
+
+    def __init__(self, mode, tickers, label: str = "", rule: str = None, interval: str = "1d"):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.rule = rule
+        self.interval = interval
+        self.tickers = list(tickers)
+        self.label = label
+        self.state = "queued"  # queued, running, done or error
+        self.processed = 0
+        self.results = []
+        self.cached = False
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def key(self):
+        return (self.mode, self.rule, self.interval, tuple(self.tickers))
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "rule": self.rule,
+            "interval": self.interval,
+            "file": self.label,
+            "state": self.state,
+            "processed": self.processed,
+            "total": len(self.tickers),
+            "cached": self.cached,
+            "error": self.error,
+            "data": list(self.results),
+        }
+
+
+class JobManager:
+    """Runs scan jobs on a bounded executor and keeps recent ones for polling."""
+
+    def __init__(self, max_workers: int = 2, max_jobs: int = 100, ttl: float = 3600.0):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="scan")
+        self._jobs = OrderedDict()
+        self._active = {}  # job key -> job, for coalescing
+        self._lock = threading.Lock()
+
+    def submit(self, mode, tickers, label: str = "", rule: str = None, interval: str = "1d"):
+        """Start a scan, or return the matching job that is already in flight."""
+        job = ScanJob(None if rule else resolve_mode(mode), tickers, label, rule=rule, interval=interval)
+        with self._lock:
+            existing = self._active.get(job.key)
+            if existing is not None:
+                return existing
+            self._prune()
+            self._jobs[job.id] = job
+            self._active[job.key] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.state = "running"
+        state = "error"
+        try:
+            scan = iter_scan(job.mode, job.tickers, label=job.label, rule=job.rule, interval=job.interval)
+            for processed, batch, cached in scan:
+                job.results.extend(batch.records())
+                job.processed = processed
+                job.cached = cached
+            state = "done"
+        except Exception as e:
+            job.error = repr(e)
+        finally:
+            # finished is set before the job stops counting as active, so
+            # _prune never sees an inactive job without it
+            with self._lock:
+                job.finished = time.time()
+                job.state = state
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def _prune(self):
+        # Drop finished jobs that expired, then the oldest finished ones
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if not job.active and job.finished is not None and now - job.finished > self.ttl:
+                del self._jobs[job_id]
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) < self.max_jobs:
+                break
+            if not job.active:
+                del self._jobs[job_id]
+
+
+_manager = None
+
+
+def get_job_manager():
+    global _manager
+    if _manager is None:
+        _manager = JobManager(max_workers=int(os.environ.get("STOCKS_SCAN_JOBS", "2")))
+    return _manager
@@ -0,0 +1,386 @@
+"""Array kernels for the indicators used by the scanners.
+
+Each routine takes a 1-D array (one symbol) or a 2-D dates x symbols array
+and returns an array of the same shape. They follow the exact update rules of
+pandas' rolling/ewm implementations (Kahan-compensated rolling sums, Welford
+variance, the ``adjust=False`` EMA recurrence), so results are bit-for-bit
+equal to ``indicators.sma``, ``bollinger_width``, ``macd`` and ``rsi`` on the
+same data, including NaN handling.
+
+With numba installed the kernels are compiled loops over each column;
+otherwise every step is a NumPy operation across all symbols at once, which
+replaces pandas' per-column loop. Set ``STOCKS_KERNELS=numpy`` to skip numba.
+"""
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # optional dependency
+    numba = None
+
+if os.environ.get("STOCKS_KERNELS", "").lower() == "numpy":
+    numba = None
+
+BACKEND = "numba" if numba is not None else "numpy"
+
+# pandas recomputes a rolling variance window from scratch when removing a
+# value cancels the sum of squared deviations down to this fraction of itself
+RESTART_TOLERANCE = 1e3 * np.finfo(np.float64).eps
+
+
+def _as_2d(values):
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        return values[:, None], True
+    return values, False
+
+
+def _restore(out, flat):
+    return out[:, 0] if flat else out
+
+
+# Scalar kernels: one pass per column. These are what numba compiles; in pure
+# Python they are only practical for small inputs.
+
+
+def _rolling_mean_loop(values, window, out):
+    rows, cols = values.shape
+    for j in range(cols):
+        nobs = 0
+        neg_ct = 0
+        same_ct = 0
+        total = 0.0
+        comp_add = 0.0
+        comp_remove = 0.0
+        prev = np.nan
+        for i in range(rows):
+            if i >= window:
+                value = values[i - window, j]
+                if value == value:
+                    nobs -= 1
+                    y = -value - comp_remove
+                    t = total + y
+                    comp_remove = t - total - y
+                    total = t
+                    if np.signbit(value):
+                        neg_ct -= 1
+            value = values[i, j]
+            if value == value:
+                nobs += 1
+                y = value - comp_add
+                t = total + y
+                comp_add = t - total - y
+                total = t
+                if np.signbit(value):
+                    neg_ct += 1
+                same_ct = same_ct + 1 if value == prev else 1
+                prev = value
+            if nobs >= window and nobs > 0:
+                result = total / nobs
+                if same_ct >= nobs:
+                    result = prev
+                elif neg_ct == 0 and result < 0:
+                    result = 0.0
+                elif neg_ct == nobs and result > 0:
+                    result = 0.0
+                out[i, j] = result
+            else:
+                out[i, j] = np.nan
+    return out
+
+
+def _rolling_std_loop(values, window, out):
+    rows, cols = values.shape
+    for j in range(cols):
+        nobs = 0
+        mean = 0.0
+        ssqdm = 0.0
+        comp_add = 0.0
+        comp_remove = 0.0
+        for i in range(rows):
+            restart = False
+            if i >= window:
+                value = values[i - window, j]
+                if value == value:
+                    nobs -= 1
+                    if nobs:
+                        before = ssqdm
+                        prev_mean = mean - comp_remove
+                        y = value - comp_remove
+                        t = y - mean
+                        comp_remove = t + mean - y
+                        mean -= t / nobs
+                        ssqdm -= (value - prev_mean) * (value - mean)
+                        restart = ssqdm < before * RESTART_TOLERANCE
+                    else:
+                        mean = 0.0
+                        ssqdm = 0.0
+            first = i
+            if restart:
+                # Cancellation wiped out the sum of squares: rebuild the window
+                nobs = 0
+                mean = ssqdm = comp_add = comp_remove = 0.0
+                first = i - window + 1
+            for k in range(first, i + 1):
+                value = values[k, j]
+                if value == value:
+                    nobs += 1
+                    prev_mean = mean - comp_add
+                    y = value - comp_add
+                    t = y - mean
+                    comp_add = t + mean - y
+                    mean = mean + t / nobs
+                    ssqdm += (value - prev_mean) * (value - mean)
+            if nobs >= window and nobs > 1:
+                variance = ssqdm / (nobs - 1)
+                out[i, j] = np.sqrt(variance) if variance > 0 else 0.0
+            else:
+                out[i, j] = np.nan
+    return out
+
+
+def _ema_loop(values, alpha, out):
+    rows, cols = values.shape
+    for j in range(cols):
+        weighted = np.nan
+        old_wt = 1.0
+        for i in range(rows):
+            value = values[i, j]
+            if weighted == weighted:
+                old_wt *= 1.0 - alpha
+                if value == value:
+                    if weighted != value:
+                        weighted = (old_wt * weighted + alpha * value) / (old_wt + alpha)
+                    old_wt = 1.0
+            elif value == value:
+                weighted = value
+            out[i, j] = weighted
+    return out
+
+
+# Vectorized kernels: the same recurrences, one row at a time across all
+# columns.
+
+
+def _rolling_mean_rows(values, window, out):
+    cols = values.shape[1]
+    nobs = np.zeros(cols, dtype=np.int64)
+    neg_ct = np.zeros(cols, dtype=np.int64)
+    same_ct = np.zeros(cols, dtype=np.int64)
+    total = np.zeros(cols)
+    comp_add = np.zeros(cols)
+    comp_remove = np.zeros(cols)
+    prev = np.full(cols, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i in range(values.shape[0]):
+            if i >= window:
+                value = values[i - window]
+                seen = value == value
+                nobs -= seen
+                y = -value - comp_remove
+                t = total + y
+                comp_remove = np.where(seen, t - total - y, comp_remove)
+                total = np.where(seen, t, total)
+                neg_ct -= seen & np.signbit(value)
+            value = values[i]
+            seen = value == value
+            nobs += seen
+            y = value - comp_add
+            t = total + y
+            comp_add = np.where(seen, t - total - y, comp_add)
+            total = np.where(seen, t, total)
+            neg_ct += seen & np.signbit(value)
+            same_ct = np.where(seen, np.where(value == prev, same_ct + 1, 1), same_ct)
+            prev = np.where(seen, value, prev)
+
+            result = total / nobs
+            result = np.where(
+                same_ct >= nobs,
+                prev,
+                np.where(
+                    (neg_ct == 0) & (result < 0),
+                    0.0,
+                    np.where((neg_ct == nobs) & (result > 0), 0.0, result),
+                ),
+            )
+            out[i] = np.where((nobs >= window) & (nobs > 0), result, np.nan)
+    return out
+
+
+def _rolling_std_rows(values, window, out):
+    cols = values.shape[1]
+    nobs = np.zeros(cols, dtype=np.int64)
+    mean = np.zeros(cols)
+    ssqdm = np.zeros(cols)
+    comp_add = np.zeros(cols)
+    comp_remove = np.zeros(cols)
+
+    def add(value, mask):
+        nonlocal mean, ssqdm, comp_add
+        seen = mask & (value == value)
+        nobs[seen] += 1
+        prev_mean = mean - comp_add
+        y = value - comp_add
+        t = y - mean
+        new_mean = mean + t / nobs
+        comp_add = np.where(seen, t + mean - y, comp_add)
+        ssqdm = np.where(seen, ssqdm + (value - prev_mean) * (value - new_mean), ssqdm)
+        mean = np.where(seen, new_mean, mean)
+
+    everywhere = np.ones(cols, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i in range(values.shape[0]):
+            if i >= window:
+                value = values[i - window]
+                seen = value == value
+                nobs -= seen
+                left = seen & (nobs > 0)
+                emptied = seen & (nobs == 0)
+                prev_mean = mean - comp_remove
+                y = value - comp_remove
+                t = y - mean
+                new_mean = mean - t / nobs
+                new_ssqdm = ssqdm - (value - prev_mean) * (value - new_mean)
+                restart = left & (new_ssqdm < ssqdm * RESTART_TOLERANCE)
+                comp_remove = np.where(left, t + mean - y, comp_remove)
+                ssqdm = np.where(left, new_ssqdm, np.where(emptied, 0.0, ssqdm))
+                mean = np.where(left, new_mean, np.where(emptied, 0.0, mean))
+
+                if restart.any():
+                    # Rare: rebuild those columns from the window's values
+                    nobs[restart] = 0
+                    mean[restart] = ssqdm[restart] = 0.0
+                    comp_add[restart] = comp_remove[restart] = 0.0
+                    for k in range(i - window + 1, i):
+                        add(values[k], restart)
+
+            add(values[i], everywhere)
+            variance = ssqdm / (nobs - 1)
+            result = np.where(variance > 0, np.sqrt(variance), 0.0)
+            out[i] = np.where((nobs >= window) & (nobs > 1), result, np.nan)
+    return out
+
+
+def _ema_rows(values, alpha, out):
+    cols = values.shape[1]
+    weighted = np.full(cols, np.nan)
+    old_wt = np.ones(cols)
+    with np.errstate(invalid="ignore"):
+        for i in range(values.shape[0]):
+            value = values[i]
+            started = weighted == weighted
+            present = value == value
+            old_wt = np.where(started, old_wt * (1.0 - alpha), old_wt)
+            update = started & present & (weighted != value)
+            blended = (old_wt * weighted + alpha * value) / (old_wt + alpha)
+            weighted = np.where(update, blended, weighted)
+            old_wt = np.where(started & present, 1.0, old_wt)
+            weighted = np.where(~started & present, value, weighted)
+            out[i] = weighted
+    return out
+
+
+if numba is not None:
+    _rolling_mean_impl = numba.njit(cache=True)(_rolling_mean_loop)
+    _rolling_std_impl = numba.njit(cache=True)(_rolling_std_loop)
+    _ema_impl = numba.njit(cache=True)(_ema_loop)
+else:
+    _rolling_mean_impl = _rolling_mean_rows
+    _rolling_std_impl = _rolling_std_rows
+    _ema_impl = _ema_rows
+
+
+# Public kernels
+
+
+def sma(values, window: int):
+    """Simple moving average, as ``rolling(window).mean()``."""
+    values, flat = _as_2d(values)
+    out = np.empty(values.shape)
+    return _restore(_rolling_mean_impl(values, int(window), out), flat)
+
+
+def sma_many(values, windows):
+    """Simple moving averages for several windows from one cumulative sum.
+
+    Returns window -> array. One pass serves every window, which makes it
+    much cheaper than ``sma`` per window when sweeping periods; the running
+    sum is not compensated, so results agree with ``sma`` up to rounding.
+    """
+    values, flat = _as_2d(values)
+    present = ~np.isnan(values)
+    sums = np.zeros((len(values) + 1, values.shape[1]))
+    np.cumsum(np.where(present, values, 0.0), axis=0, out=sums[1:])
+    counts = np.zeros(sums.shape, dtype=np.int64)
+    np.cumsum(present, axis=0, out=counts[1:])
+    out = {}
+    for window in dict.fromkeys(int(w) for w in windows):
+        result = np.full(values.shape, np.nan)
+        if 0 < window <= len(values):
+            total = sums[window:] - sums[:-window]
+            full = counts[window:] - counts[:-window] == window
+            result[window - 1:] = np.where(full, total / window, np.nan)
+        out[window] = _restore(result, flat)
+    return out
+
+
+def rolling_std(values, window: int):
+    """Sample standard deviation, as ``rolling(window).std()``."""
+    values, flat = _as_2d(values)
+    out = np.empty(values.shape)
+    return _restore(_rolling_std_impl(values, int(window), out), flat)
+
+
+def _sliding(values, window, reduce):
+    values, flat = _as_2d(values)
+    out = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        view = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+        out[window - 1:] = reduce(view, axis=-1)
+    return _restore(out, flat)
+
+
+def rolling_min(values, window: int):
+    """Rolling minimum, as ``rolling(window).min()``."""
+    return _sliding(values, int(window), np.min)
+
+
+def rolling_max(values, window: int):
+    """Rolling maximum, as ``rolling(window).max()``."""
+    return _sliding(values, int(window), np.max)
+
+
+def ema(values, span: int):
+    """Exponential moving average, as ``ewm(span=span, adjust=False).mean()``."""
+    values, flat = _as_2d(values)
+    out = np.empty(values.shape)
+    return _restore(_ema_impl(values, 2.0 / (span + 1.0), out), flat)
+
+
+def macd(values, fast: int = 12, slow: int = 26, signal: int = 9):
+    """Return the MACD line, signal line and histogram."""
+    line = ema(values, fast) - ema(values, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger_width(values, period: int = 20):
+    """Bollinger Band width: 4 * rolling std."""
+    return 4 * rolling_std(values, period)
+
+
+def rsi(values, period: int = 14):
+    """RSI from simple moving averages of gains and losses; NaN on zero loss."""
+    values = np.asarray(values, dtype=np.float64)
+    delta = np.full(values.shape, np.nan)
+    delta[1:] = values[1:] - values[:-1]
+    # Same split (and signed zeros) as Series.clip
+    gain = np.where(delta < 0, 0.0, delta)
+    loss = -np.where(delta > 0, 0.0, delta)
+    avg_gain = sma(gain, period)
+    avg_loss = sma(loss, period)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rs = avg_gain / np.where(avg_loss != 0, avg_loss, np.nan)
+        return 100 - (100 / (1 + rs))
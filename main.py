@@ -1,11 +1,13 @@
 import os
-from data import load_tickers_from_json, download_history
-from scanners import (
-    scan_golden_cross_for_tickers,
-    scan_llv_sma50_value_for_tickers,
-    scan_mode4_combo_for_tickers,
-    scan_lower_low_3days_for_tickers,
-)
+import sys
+
+import metrics
+from data import load_tickers_from_json
+from data.intervals import INTERVALS, check_interval
+from result_cache import run_mode_cached, run_modes_cached
+from results import print_batch, print_table
+from rules import RuleError
+from scanners import describe, parse_modes
 
 
 def main():
@@ -29,37 +31,69 @@ def main():
     print("3 - LLV(5) > SMA200, close near SMA200 (0.99-1.02), value > 1B")
     print("4 - Trend + squeeze + MACD + RSI combo filter")
     print("5 - 3 consecutive lower daily lows")
-    mode = input("Enter 1, 2, 3, 4 or 5 (default: 1): ").strip()
+    print("r - Custom rule, e.g. close > sma(50) and close * volume >= 1e9")
+    print("Several modes can be scanned together, e.g. 1,2,4")
+    mode = input("Enter 1, 2, 3, 4, 5 or r (default: 1): ").strip()
+
+    intervals = ", ".join(INTERVALS)
+    interval = input(f"Enter bar interval ({intervals}; default: 1d): ").strip() or "1d"
+    try:
+        check_interval(interval)
+    except ValueError as e:
+        print(f"\n{e}")
+        return
+    bars = "" if interval == "1d" else f" on {interval} bars"
+
+    if "," in mode:
+        modes = parse_modes(mode)
+        print(f"\nScanning {label} for modes {', '.join(modes)}{bars}...")
+        results, hits = run_modes_cached(modes, tickers, label=label, interval=interval)
+        for m, batch in results.items():
+            if m in hits:
+                print(f"\nMode {m}: using cached results for {label}.")
+            else:
+                print(f"\nMode {m}: {len(batch)} match(es)")
+            print_batch(batch)
+        return
 
-    if mode == "2":
-        # Filter around SMA50: LLV(5) > SMA50, close ~ SMA50, value > 1B
-        scan_llv_sma50_value_for_tickers(
-            tickers,
-            llv_window=5,
-            sma_period=50,
-            near_low=0.99,
-            near_high=1.02,
-            min_value=1e9,
-            label=label,
-        )
-    elif mode == "3":
-        # Filter around SMA200: LLV(5) > SMA200, close ~ SMA200, value > 1B
-        scan_llv_sma50_value_for_tickers(
-            tickers,
-            llv_window=5,
-            sma_period=200,
-            near_low=0.99,
-            near_high=1.02,
-            min_value=1e9,
-            label=label,
-        )
-    elif mode == "4":
-        scan_mode4_combo_for_tickers(tickers, label=label)
-    elif mode == "5":
-        scan_lower_low_3days_for_tickers(tickers, label=label)
-    else:
-        scan_golden_cross_for_tickers(tickers, label=label)
+    rule = None
+    if mode.lower() == "r":
+        rule = input("Enter rule: ").strip()
+
+    try:
+        print(f"\nScanning {label} for {describe(mode, rule)}{bars}...")
+        result, hit = run_mode_cached(mode, tickers, label=label, rule=rule, interval=interval)
+    except RuleError as e:
+        print(f"\nInvalid rule: {e}")
+        return
+    if hit:
+        print(f"\nUsing cached results for {label} (data unchanged since the last scan).")
+    print_batch(result)
+
+
+def print_profile():
+    """Print where the time went, per stage, and the scan counters."""
+    summary = metrics.summary()
+    if not summary["stages"]:
+        print("\nNo timings recorded (is STOCKS_METRICS=0 set?).")
+        return
+    print("\nProfile:")
+    print_table(
+        ["Stage", "Calls", "Total s", "Mean ms", "Max ms"],
+        [
+            (s["stage"], s["calls"], f"{s['total']:.3f}", f"{s['mean'] * 1e3:.2f}", f"{s['max'] * 1e3:.2f}")
+            for s in summary["stages"]
+        ],
+    )
+    if summary["counters"]:
+        print()
+        for name, value in summary["counters"].items():
+            print(f"{name}: {value:,.0f}")
 
 
 if __name__ == "__main__":
+    # --profile prints a per-stage timing breakdown after the scan
+    profile = "--profile" in sys.argv[1:]
     main()
+    if profile:
+        print_profile()
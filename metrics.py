@@ -0,0 +1,246 @@
+"""Lightweight in-process instrumentation.
+
+Counters and latency histograms for the stages of a scan: cache reads,
+downloads, panel builds, indicator computation, rule evaluation and JSON
+serialization. Stages are timed with ``timed(stage)`` (a context manager)
+or the ``instrumented(stage)`` decorator; everything lands in
+``stocks_stage_seconds{stage=...}``.
+
+``render()`` returns all metrics in the Prometheus text format (served at
+``GET /metrics``) and ``summary()`` a per-stage breakdown (printed by
+``main.py --profile``). Values are per process, so each gunicorn worker
+reports its own. Set ``STOCKS_METRICS=0`` to turn the timers off.
+"""
+import contextlib
+import functools
+import math
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("STOCKS_METRICS", "1") != "0"
+
+# Latency buckets in seconds, from a cache read to a cold universe download
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """Yield ``(suffix, label values, extra labels, value)`` tuples."""
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels_text(self.labels, key, extra)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts, sum, count, max
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+            state[3] = max(state[3], value)
+
+    def snapshot(self):
+        """label values -> {"count", "sum", "max"}."""
+        with self._lock:
+            return {key: {"count": s[2], "sum": s[1], "max": s[3]} for key, s in self._values.items()}
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield "_bucket", key, (("le", _number(bound)),), cumulative
+            yield "_bucket", key, (("le", "+Inf"),), count
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+
+_registry = []
+_collectors = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def counter(name: str, doc: str, labels=()):
+    return _register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels=()):
+    return _register(Gauge(name, doc, labels))
+
+
+def histogram(name: str, doc: str, labels=(), buckets=BUCKETS):
+    return _register(Histogram(name, doc, labels, buckets))
+
+
+def add_collector(callback):
+    """Call ``callback()`` before every render, e.g. to refresh gauges."""
+    _collectors.append(callback)
+
+
+STAGE_SECONDS = histogram("stocks_stage_seconds", "Time spent in each stage of a scan.", ("stage",))
+CACHE_LOOKUPS = counter(
+    "stocks_cache_lookups_total",
+    "History cache lookups: hit (up to date), stale (needs a top-up) or miss.",
+    ("result",),
+)
+DOWNLOAD_FRAME_BYTES = counter(
+    "stocks_download_frame_bytes_total",
+    "In-memory size of the downloaded price frames (not bytes received over the network).",
+)
+DOWNLOAD_CALLS = counter("stocks_download_calls_total", "yf.download calls, including retries.")
+SYMBOLS_DOWNLOADED = counter("stocks_symbols_downloaded_total", "Symbols with data in a download.")
+SYMBOLS_SKIPPED = counter(
+    "stocks_symbols_skipped_total",
+    "Requested symbols left out of a scan or download, by reason.",
+    ("reason",),
+)
+
+
+@contextlib.contextmanager
+def timed(stage: str):
+    """Record the time spent in the ``with`` block under ``stage``."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def instrumented(stage: str):
+    """Decorator form of ``timed``."""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    for callback in _collectors:
+        try:
+            callback()
+        except Exception:
+            pass
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Per-stage timings (sorted by total time) and the counters."""
+    stages = [
+        {
+            "stage": key[0],
+            "calls": s["count"],
+            "total": s["sum"],
+            "mean": s["sum"] / s["count"] if s["count"] else 0.0,
+            "max": s["max"],
+        }
+        for key, s in STAGE_SECONDS.snapshot().items()
+    ]
+    stages.sort(key=lambda s: s["total"], reverse=True)
+    counters = {}
+    for metric in _registry:
+        if isinstance(metric, Counter):
+            for _, key, _, value in metric.samples():
+                label = ",".join(f"{n}={v}" for n, v in zip(metric.labels, key))
+                counters[f"{metric.name}{{{label}}}" if label else metric.name] = value
+    return {"stages": stages, "counters": counters}
+
+
+def reset():
+    """Zero every metric (e.g. before profiling one run)."""
+    for metric in _registry:
+        metric.reset()
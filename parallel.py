@@ -0,0 +1,132 @@
+"""Process-pool execution of scans.
+
+Large universes can be sharded across CPU cores: the parent process brings
+the shared panel up to date once, then each worker scans a contiguous slice
+of the tickers. Workers map the panel from the cache directory themselves,
+so only ticker lists go to the workers and only result batches come back.
+The shards' batches are concatenated, which keeps the input order.
+
+The worker count comes from ``STOCKS_SCAN_PROCESSES`` (default 1, i.e.
+serial) or the ``workers=`` argument of the scanners. Small universes, and
+any failure of the pool itself, fall back to a serial scan.
+"""
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from data import get_cache_backend, load_panel, set_cache_backend
+from results import concat
+
+logger = logging.getLogger(__name__)
+
+# Shards smaller than this are not worth a round-trip to a worker
+MIN_SHARD_SIZE = 25
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def scan_workers(workers=None):
+    """Return the configured number of scan processes (at least 1)."""
+    if workers is None:
+        try:
+            workers = int(os.environ.get("STOCKS_SCAN_PROCESSES", "1"))
+        except ValueError:
+            workers = 1
+    return max(1, int(workers))
+
+
+def _init_worker(backend):
+    set_cache_backend(backend)
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # Spawned workers do not inherit locks held by the web server's threads
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(get_cache_backend(),),
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _reset_pool():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+        _pool_workers = 0
+
+
+def _scan_shard(scanner, tickers, label, params):
+    # Workers stay quiet; only the parent reports progress
+    with contextlib.redirect_stdout(io.StringIO()):
+        return scanner(tickers, label=label, workers=1, **params)
+
+
+def shards(tickers, workers: int):
+    """Split ``tickers`` into at most ``workers`` contiguous slices."""
+    tickers = list(tickers)
+    count = max(1, min(workers, len(tickers) // MIN_SHARD_SIZE))
+    size, extra = divmod(len(tickers), count)
+    out = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        out.append(tickers[start:end])
+        start = end
+    return out
+
+
+def run_sharded(
+    scanner,
+    tickers,
+    label: str = "",
+    params=None,
+    workers=None,
+    period: str = "1y",
+    interval: str = "1d",
+    timeframes=(),
+):
+    """Run ``scanner`` over ``tickers`` on the process pool.
+
+    ``timeframes`` lists the other intervals the scan reads (e.g. ``1wk``
+    for a rule using ``weekly()``); their panels are built here too.
+
+    Returns the merged results.ResultBatch in ticker order, or None when the
+    scan should run serially instead (one worker, a small universe, or the
+    pool failed).
+    """
+    params = params or {}
+    workers = scan_workers(workers)
+    parts = shards(tickers, workers)
+    if len(parts) < 2:
+        return None
+
+    # Download and build the panels once for the whole universe, so workers
+    # only read them instead of rebuilding them from their own shard
+    for other in (interval, *timeframes):
+        load_panel(tickers, period=period, interval=other)
+
+    try:
+        pool = _get_pool(workers)
+        futures = [pool.submit(_scan_shard, scanner, part, label, params) for part in parts]
+        return concat(future.result() for future in futures)
+    except (BrokenProcessPool, OSError) as e:
+        logger.warning("Process pool failed (%r), scanning serially", e)
+        _reset_pool()
+        return None
@@ -0,0 +1,209 @@
+"""Cache of scan results shared by the web API and the CLI.
+
+A scan result depends only on the ticker list, the mode and its parameters,
+the bar interval and the data as of each symbol's last bar. Results are
+stored under a key derived from all of these plus the panel fingerprint of
+the universe and ``RESULT_VERSION``, so a new bar for any symbol (or a
+deploy that changes the scans) yields a new key and the old entry is simply
+never hit again. Entries live in a small in-process LRU of result batches
+backed by JSON files under the cache directory, which gunicorn workers
+share. Every write prunes the files that are older than ``max_age`` seconds
+(three days by default) or beyond the newest ``max_files``.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from data import data_fingerprint, get_cache_backend, is_panel_fresh
+from data.intervals import scan_period
+from results import ResultBatch
+from rules import compile_rule
+from scanners import MODES, resolve_mode, run_mode, scan_modes_for_tickers
+
+# Part of every result key: bump it when a mode's logic or the ResultBatch
+# fields change, so results stored by an older version are never served
+RESULT_VERSION = 1
+
+# Scans read one year of daily bars unless given another interval
+SCAN_INTERVAL = "1d"
+SCAN_PERIOD = scan_period(SCAN_INTERVAL)
+
+
+class ResultCache:
+    """In-memory LRU of scan results with a shared on-disk copy."""
+
+    def __init__(self, root: str = None, max_entries: int = 256, max_files: int = 2000, max_age: float = 3 * 86400):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _dir(self):
+        return self.root or os.path.join(get_cache_backend().root, "results")
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        try:
+            with open(os.path.join(self._dir(), key + ".json"), "r", encoding="utf-8") as f:
+                result = ResultBatch.from_dict(json.load(f)["result"])
+        except (OSError, ValueError, KeyError, TypeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        self._remember(key, result)
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result):
+        self._remember(key, result)
+        path = os.path.join(self._dir(), key + ".json")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"result": result.to_dict()}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+        self._prune_files()
+
+    def _prune_files(self):
+        # Old data fingerprints are never hit again; drop expired files, then
+        # the oldest beyond max_files
+        root = self._dir()
+        try:
+            names = [name for name in os.listdir(root) if name.endswith(".json")]
+        except OSError:
+            return
+        files = []
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                files.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+        files.sort(reverse=True)
+        cutoff = time.time() - self.max_age
+        for i, (mtime, path) in enumerate(files):
+            if i >= self.max_files or mtime < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = ResultCache()
+
+
+def result_cache_stats():
+    return _cache.stats()
+
+
+def scan_key(mode, tickers, rule: str = None, interval: str = SCAN_INTERVAL):
+    """Key of the result of ``mode`` (or ``rule``) over ``tickers`` for the current data."""
+    if rule:
+        # Rules that only differ in spelling share a key
+        spec = {"rule": compile_rule(rule).key}
+    else:
+        mode = resolve_mode(mode)
+        spec = {"mode": mode, "params": MODES[mode][1]}
+    period = scan_period(interval)
+    payload = {
+        "version": RESULT_VERSION,
+        "universe": list(tickers),
+        **spec,
+        "period": period,
+        "interval": interval,
+        "data": data_fingerprint(tickers, period, interval),
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def run_mode_cached(mode, tickers, label: str = "", rule: str = None, key: str = None, interval: str = SCAN_INTERVAL):
+    """Run ``mode`` (or a custom ``rule``) over ``tickers``, reusing a cached
+    result when possible.
+
+    Returns ``(result, hit)``, where ``result`` is a results.ResultBatch.
+    ``key`` is the ``scan_key`` of the scan if the caller already has it.
+    """
+    if not tickers:
+        return run_mode(mode, tickers, label=label, rule=rule, interval=interval), False
+
+    key = key or scan_key(mode, tickers, rule=rule, interval=interval)
+    result = _cache.get(key)
+    if result is not None:
+        return result, True
+
+    result = run_mode(mode, tickers, label=label, rule=rule, interval=interval)
+    _cache.put(key, result)
+    return result, False
+
+
+def run_modes_cached(modes, tickers, label: str = "", keys=None, interval: str = SCAN_INTERVAL):
+    """Run several modes over ``tickers`` in one pass, reusing cached results.
+
+    Modes already in the cache are not rescanned; the others are scanned
+    together. Returns ``(results, hits)``: mode -> ResultBatch, and the modes
+    that came from the cache. ``keys`` (mode -> ``scan_key``) may be passed
+    in if the caller already has them.
+    """
+    modes = list(dict.fromkeys(resolve_mode(mode) for mode in modes))
+    if not tickers:
+        return scan_modes_for_tickers(tickers, modes, label=label, interval=interval), []
+
+    keys = keys or {mode: scan_key(mode, tickers, interval=interval) for mode in modes}
+    results = {}
+    for mode, key in keys.items():
+        result = _cache.get(key)
+        if result is not None:
+            results[mode] = result
+    hits = list(results)
+
+    missing = [mode for mode in modes if mode not in results]
+    if missing:
+        for mode, result in scan_modes_for_tickers(tickers, missing, label=label, interval=interval).items():
+            _cache.put(keys[mode], result)
+            results[mode] = result
+    return {mode: results[mode] for mode in modes}, hits
+
+
+def peek_result(mode, tickers, rule: str = None, interval: str = SCAN_INTERVAL):
+    """Cached result of ``mode`` over ``tickers``, or None.
+
+    Unlike ``run_mode_cached`` this never downloads: a universe whose data
+    is not already current counts as a miss.
+    """
+    if not tickers or not is_panel_fresh(tickers, scan_period(interval), interval):
+        return None
+    return _cache.get(scan_key(mode, tickers, rule=rule, interval=interval))
+
+
+def store_result(mode, tickers, result, rule: str = None, interval: str = SCAN_INTERVAL):
+    """Remember a result that was computed outside ``run_mode_cached``."""
+    if tickers:
+        _cache.put(scan_key(mode, tickers, rule=rule, interval=interval), result)
@@ -0,0 +1,243 @@
+"""Scan results as typed columnar batches, and the sinks that render them.
+
+Scanners return a ``ResultBatch``: one array per output column plus the
+column types and how to present them. Nothing is formatted until a sink
+asks for it, so a scan run for the web API never builds a console table:
+
+- ``print_batch`` prints the console table used by ``main.py``;
+- ``to_json`` returns the list of row dicts the API has always served and
+  ``to_columns`` the compact ``{"columns": [...], "data": [[...], ...]}``;
+- ``to_csv`` and ``to_arrow`` give CSV text and an Arrow IPC stream
+  (the latter needs pyarrow).
+
+Float columns are float64 arrays; symbols and dates (ISO strings, with the
+time of day for intraday bars) are lists.
+"""
+import csv
+import io
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # optional dependency
+    pyarrow = None
+
+KINDS = ("str", "float", "date")
+
+
+class Field:
+    """One output column: its name, type and console presentation."""
+
+    def __init__(self, name: str, kind: str = "float", header: str = None, fmt: str = None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown column type {kind!r}")
+        self.name = name
+        self.kind = kind
+        self.header = header or name
+        self.fmt = fmt or (",.2f" if kind == "float" else "")
+
+    def to_dict(self):
+        return {"name": self.name, "kind": self.kind, "header": self.header, "fmt": self.fmt}
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec["name"], spec["kind"], spec.get("header"), spec.get("fmt"))
+
+    def __eq__(self, other):
+        return isinstance(other, Field) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Field({self.name!r}, {self.kind!r})"
+
+
+def _column(field, values):
+    if field.kind == "float":
+        return np.asarray(values, dtype=np.float64)
+    return [str(value) for value in values]
+
+
+class ResultBatch:
+    """Matches of one scan, stored column by column.
+
+    ``title`` heads the console table and ``empty`` is printed instead when
+    there are no matches.
+    """
+
+    def __init__(self, fields, columns=None, title: str = "", empty: str = "No matches."):
+        self.fields = list(fields)
+        columns = columns or {}
+        self.columns = {field.name: _column(field, columns.get(field.name, ())) for field in self.fields}
+        self.title = title
+        self.empty = empty
+        lengths = {len(values) for values in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("Result columns differ in length")
+
+    @classmethod
+    def from_rows(cls, fields, rows, **meta):
+        """Build a batch from tuples in ``fields`` order."""
+        fields = list(fields)
+        columns = list(zip(*rows)) if rows else [()] * len(fields)
+        return cls(fields, {field.name: values for field, values in zip(fields, columns)}, **meta)
+
+    @classmethod
+    def from_records(cls, fields, records, **meta):
+        """Build a batch from dicts keyed by field name."""
+        fields = list(fields)
+        return cls(fields, {field.name: [record[field.name] for record in records] for field in fields}, **meta)
+
+    @property
+    def names(self):
+        return [field.name for field in self.fields]
+
+    def __len__(self):
+        return len(self.columns[self.fields[0].name]) if self.fields else 0
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ResultBatch)
+            and self.fields == other.fields
+            and self.records() == other.records()
+        )
+
+    def __repr__(self):
+        return f"<ResultBatch {len(self)} x {self.names}>"
+
+    def rows(self):
+        """Matches as tuples in column order, with Python floats."""
+        columns = [self.columns[name] for name in self.names]
+        columns = [values.tolist() if isinstance(values, np.ndarray) else values for values in columns]
+        return list(zip(*columns))
+
+    def records(self):
+        """Matches as dicts, the layout of the JSON API."""
+        names = self.names
+        return [dict(zip(names, row)) for row in self.rows()]
+
+    def to_dict(self):
+        """JSON-serializable form, for the result cache."""
+        return {
+            "fields": [field.to_dict() for field in self.fields],
+            "columns": {
+                name: values.tolist() if isinstance(values, np.ndarray) else list(values)
+                for name, values in self.columns.items()
+            },
+            "title": self.title,
+            "empty": self.empty,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Inverse of ``to_dict``; raises KeyError/TypeError/ValueError if malformed."""
+        fields = [Field.from_dict(spec) for spec in data["fields"]]
+        return cls(fields, data["columns"], title=data.get("title", ""), empty=data.get("empty", "No matches."))
+
+
+def concat(batches):
+    """Append batches with the same columns, e.g. the shards of one scan.
+
+    The first batch's title and messages are kept.
+    """
+    batches = list(batches)
+    if not batches:
+        return None
+    first = batches[0]
+    columns = {}
+    for field in first.fields:
+        parts = [batch.columns[field.name] for batch in batches]
+        columns[field.name] = np.concatenate(parts) if field.kind == "float" else [v for part in parts for v in part]
+    return ResultBatch(first.fields, columns, title=first.title, empty=first.empty)
+
+
+# Sinks
+
+
+def print_table(headers, rows):
+    if not rows:
+        return
+
+    col_count = len(headers)
+    widths = [len(str(h)) for h in headers]
+
+    for row in rows:
+        for i in range(col_count):
+            if i >= len(row):
+                continue
+            value = "" if row[i] is None else str(row[i])
+            if len(value) > widths[i]:
+                widths[i] = len(value)
+
+    header_line = "  ".join(str(h).ljust(widths[i]) for i, h in enumerate(headers))
+    print(header_line)
+    print("-" * len(header_line))
+
+    for row in rows:
+        cells = []
+        for i in range(col_count):
+            value = "" if i >= len(row) or row[i] is None else str(row[i])
+            num_like = value.replace(",", "").replace(".", "").isdigit()
+            if num_like:
+                cells.append(value.rjust(widths[i]))
+            else:
+                cells.append(value.ljust(widths[i]))
+        print("  ".join(cells))
+
+
+def print_batch(batch: ResultBatch):
+    """Print ``batch`` as a console table under its title; NaN shows as ``-``."""
+    if not len(batch):
+        print(f"\n{batch.empty}")
+        return
+    if batch.title:
+        print(f"\n{batch.title}:")
+    rows = [
+        tuple("-" if value != value else format(value, field.fmt) for field, value in zip(batch.fields, row))
+        for row in batch.rows()
+    ]
+    print_table([field.header for field in batch.fields], rows)
+
+
+def to_json(batch: ResultBatch):
+    """JSON-ready list of row dicts."""
+    return batch.records()
+
+
+def to_columns(batch: ResultBatch):
+    """Column names once, then one list of values per match."""
+    return {"columns": batch.names, "data": [list(row) for row in batch.rows()]}
+
+
+def to_csv(batch: ResultBatch):
+    """CSV text with a header row of column names."""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(batch.names)
+    writer.writerows(batch.rows())
+    return out.getvalue()
+
+
+def to_arrow(batch: ResultBatch):
+    """Arrow IPC stream bytes; dates become date32 (intraday: timestamp) columns."""
+    if pyarrow is None:
+        raise RuntimeError("Arrow output requires pyarrow")
+    arrays = []
+    for field in batch.fields:
+        values = batch.columns[field.name]
+        if field.kind == "float":
+            arrays.append(pyarrow.array(values, type=pyarrow.float64()))
+        elif field.kind == "date" and any(len(value) > 10 for value in values):
+            arrays.append(pyarrow.array(np.array(values, dtype="datetime64[s]"), type=pyarrow.timestamp("s")))
+        elif field.kind == "date":
+            arrays.append(pyarrow.array(np.array(values, dtype="datetime64[D]"), type=pyarrow.date32()))
+        else:
+            arrays.append(pyarrow.array(values, type=pyarrow.string()))
+    table = pyarrow.Table.from_arrays(arrays, names=batch.names)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,808 @@
+"""Declarative scan rules.
+
+A rule is a boolean expression over price columns and indicators, e.g.::
+
+    close > sma(50) and sma(50) > sma(150) > sma(200) and close * volume >= 1e9
+
+It compiles to a plan in which every distinct subexpression appears once:
+``sma(50)`` above is computed a single time however often it is written, and
+rules evaluated together (see ``Evaluator``) share their indicators too.
+Indicators are computed over whole dates x symbols frames. The comparisons
+are then evaluated per symbol on the last bar where every referenced value is
+available, which is how the built-in scan modes pick their row.
+
+Columns: ``open``, ``high``, ``low``, ``close``, ``adj_close``, ``volume``.
+Functions (the leading series argument is optional and defaults as shown):
+
+- ``sma([close,] n)``, ``ema([close,] n)``, ``std([close,] n)``
+- ``llv([low,] n)``, ``hhv([high,] n)`` - lowest low / highest high
+- ``prev(x[, k])`` - ``x`` as of ``k`` bars earlier (default 1)
+- ``rsi([close,] [n])``, ``bb_width([close,] [n])``
+- ``macd([close])``, ``macd_signal([close])``, ``macd_hist([close])``
+- ``days_since_cross(a, b)`` - calendar days since ``a`` last crossed above ``b``
+- ``cross_date(a, b)`` - date of that cross (output only)
+- ``daily(x)``, ``weekly(x)``, ``monthly(x)`` - ``x`` computed on daily,
+  weekly or monthly bars, e.g. ``weekly(close) > weekly(sma(30))``. Each
+  bar sees the value of the last such bar completed before its own day,
+  week or month began, so a backtest never looks ahead.
+
+A weekly trend with a daily trigger::
+
+    weekly(close) > weekly(sma(30)) and close > prev(hhv(high, 20))
+
+Operators: ``+ - * /``, comparisons (chains such as ``a > b > c`` mean
+``a > b and b > c``), ``and``, ``or``, ``not`` and parentheses.
+"""
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+import kernels
+from data.intervals import bucket_start
+from metrics import timed
+
+
+class RuleError(ValueError):
+    """A rule that cannot be parsed or compiled."""
+
+
+COLUMNS = {
+    "open": "Open",
+    "high": "High",
+    "low": "Low",
+    "close": "Close",
+    "adj_close": "Adj Close",
+    "volume": "Volume",
+}
+
+
+# Expression nodes. ``key`` is a canonical spelling used to dedupe
+# subexpressions; ``label`` is the short form shown to users.
+
+
+class Node:
+    kind = "number"
+    key = ""
+    label = ""
+    children = ()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.key})"
+
+
+class Const(Node):
+    def __init__(self, value: float):
+        self.value = float(value)
+        self.key = self.label = repr(self.value) if not self.value.is_integer() else str(int(self.value))
+
+
+class Column(Node):
+    def __init__(self, name: str):
+        self.name = name
+        self.field = COLUMNS[name]
+        self.key = self.label = name
+
+
+class Call(Node):
+    def __init__(self, name: str, args, params, label: str):
+        self.name = name
+        self.args = list(args)  # series arguments
+        self.params = list(params)  # numeric parameters
+        self.children = tuple(self.args)
+        self.kind = FUNCTIONS[name][2]
+        parts = [a.key for a in self.args] + [_number_key(p) for p in self.params]
+        self.key = f"{name}({', '.join(parts)})"
+        self.label = label
+
+
+class BinOp(Node):
+    def __init__(self, op: str, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.key = f"({left.key} {op} {right.key})"
+        self.label = f"{left.label} {op} {right.label}"
+
+
+class Neg(Node):
+    def __init__(self, operand):
+        self.operand = operand
+        self.children = (operand,)
+        self.key = f"(-{operand.key})"
+        self.label = f"-{operand.label}"
+
+
+class Compare(Node):
+    kind = "bool"
+
+    def __init__(self, op: str, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.key = f"({left.key} {op} {right.key})"
+        self.label = f"{left.label} {op} {right.label}"
+
+
+class Logic(Node):
+    kind = "bool"
+
+    def __init__(self, op: str, items):
+        self.op = op
+        self.items = list(items)
+        self.children = tuple(self.items)
+        self.key = "(" + f" {op} ".join(i.key for i in self.items) + ")"
+        self.label = f" {op} ".join(i.label for i in self.items)
+
+
+class Not(Node):
+    kind = "bool"
+
+    def __init__(self, operand):
+        self.operand = operand
+        self.children = (operand,)
+        self.key = f"(not {operand.key})"
+        self.label = f"not {operand.label}"
+
+
+def _number_key(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Indicator implementations: (evaluator, series args, params) -> DataFrame
+
+
+def _sliding(frame, window: int, reduce, **kwargs):
+    """``reduce`` over trailing windows of every column, NaN-propagating.
+
+    Used on the short trailing frames of latest-only evaluation, where one
+    vectorized pass beats pandas' column-by-column rolling loop.
+    """
+    values = frame.to_numpy(dtype=float)
+    out = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        view = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+        out[window - 1:] = reduce(view, axis=-1, **kwargs)
+    return pd.DataFrame(out, index=frame.index, columns=frame.columns)
+
+
+def _kernel(frame, compute, *args):
+    """Run an array kernel over ``frame`` and wrap the result like it."""
+    out = compute(frame.to_numpy(dtype=float), *args)
+    return pd.DataFrame(out, index=frame.index, columns=frame.columns)
+
+
+def _sma(ev, args, params):
+    if ev.latest:
+        return _sliding(ev.frame(args[0]), int(params[0]), np.mean)
+    return _kernel(ev.frame(args[0]), kernels.sma, int(params[0]))
+
+
+def _ema(ev, args, params):
+    return _kernel(ev.frame(args[0]), kernels.ema, int(params[0]))
+
+
+def _std(ev, args, params):
+    if ev.latest:
+        return _sliding(ev.frame(args[0]), int(params[0]), np.std, ddof=1)
+    return _kernel(ev.frame(args[0]), kernels.rolling_std, int(params[0]))
+
+
+def _llv(ev, args, params):
+    if ev.latest:
+        return _sliding(ev.frame(args[0]), int(params[0]), np.min)
+    return _kernel(ev.frame(args[0]), kernels.rolling_min, int(params[0]))
+
+
+def _hhv(ev, args, params):
+    if ev.latest:
+        return _sliding(ev.frame(args[0]), int(params[0]), np.max)
+    return _kernel(ev.frame(args[0]), kernels.rolling_max, int(params[0]))
+
+
+def _prev(ev, args, params):
+    return ev.frame(args[0]).shift(int(params[0]))
+
+
+def _rsi(ev, args, params):
+    if ev.latest:
+        period = int(params[0])
+        delta = ev.frame(args[0]).diff()
+        avg_gain = _sliding(delta.clip(lower=0), period, np.mean)
+        avg_loss = _sliding(-delta.clip(upper=0), period, np.mean)
+        rs = avg_gain / avg_loss.where(avg_loss != 0)
+        return 100 - (100 / (1 + rs))
+    return _kernel(ev.frame(args[0]), kernels.rsi, int(params[0]))
+
+
+def _bb_width(ev, args, params):
+    if ev.latest:
+        return 4 * _std(ev, args, params)
+    return _kernel(ev.frame(args[0]), kernels.bollinger_width, int(params[0]))
+
+
+def _macd_part(index):
+    def compute(ev, args, params):
+        return _kernel(ev.frame(args[0]), lambda values: kernels.macd(values, *(int(p) for p in params))[index])
+
+    return compute
+
+
+def _cross_date(ev, args, params):
+    # Crosses are measured between consecutive rows where both series exist
+    a = ev.frame(args[0]).to_numpy()
+    b = ev.frame(args[1]).to_numpy()
+    valid = ~np.isnan(a) & ~np.isnan(b)
+    above = np.where(valid, (a > b).astype(float), np.nan)
+    before = pd.DataFrame(above).ffill().shift(1).to_numpy()
+    cross = valid & (above == 1) & (before == 0)
+    dates = pd.DataFrame(np.where(cross, ev.dates, np.datetime64("NaT"))).ffill().to_numpy()
+    return pd.DataFrame(np.where(valid, dates, np.datetime64("NaT")), columns=ev.symbols)
+
+
+def _timeframe(interval):
+    def compute(ev, args, params):
+        # Line every bar up with the last higher-timeframe bar that started
+        # before the bar's own day/week/month
+        sub = ev.timeframe(interval)
+        values = sub.values(args[0])
+        columns = {symbol: j for j, symbol in enumerate(sub.symbols)}
+        starts = bucket_start(ev.dates, interval)
+        out = np.full(np.shape(ev.dates), np.nan)
+        for j, symbol in enumerate(ev.symbols):
+            k = columns.get(symbol)
+            if k is None:
+                continue
+            labels = sub.dates[:, k]
+            present = ~np.isnat(labels)
+            labels, column = labels[present], values[present, k]
+            pos = np.searchsorted(labels, starts[:, j], side="left") - 1
+            found = (pos >= 0) & ~np.isnat(starts[:, j])
+            out[found, j] = column[pos[found]]
+        index = next(iter(ev.fields.values())).index if ev.fields else None
+        return pd.DataFrame(out, index=index, columns=ev.symbols)
+
+    return compute
+
+
+def _days_since_cross(ev, args, params):
+    cross = ev.frame(Call("cross_date", args, params, "")).to_numpy()
+    days = (ev.dates - cross) / np.timedelta64(1, "D")
+    return pd.DataFrame(days, columns=ev.symbols)
+
+
+# A bounded EMA warm-up: enough bars for the seed's weight to fall below this
+EMA_WARMUP_TOLERANCE = 1e-12
+
+
+def _ema_warmup(span: int):
+    alpha = 2.0 / (span + 1.0)
+    return int(math.ceil(math.log(EMA_WARMUP_TOLERANCE) / math.log(1.0 - alpha)))
+
+
+def _window(params):
+    return params[0] - 1
+
+
+def _macd_warmup(params):
+    fast, slow, signal = params
+    return max(_ema_warmup(fast), _ema_warmup(slow)) + _ema_warmup(signal)
+
+
+_SERIES = "series"
+
+# name -> (implementation, [(argument kind, default), ...], result kind,
+#          warm-up: bars of history needed before the first exact value,
+#          or None when the value depends on the whole history)
+FUNCTIONS = {
+    "sma": (_sma, [(_SERIES, "close"), (int, None)], "number", _window),
+    "ema": (_ema, [(_SERIES, "close"), (int, None)], "number", lambda p: _ema_warmup(p[0])),
+    "std": (_std, [(_SERIES, "close"), (int, None)], "number", _window),
+    "llv": (_llv, [(_SERIES, "low"), (int, None)], "number", _window),
+    "hhv": (_hhv, [(_SERIES, "high"), (int, None)], "number", _window),
+    "prev": (_prev, [(_SERIES, None), (int, 1)], "number", lambda p: p[0]),
+    "rsi": (_rsi, [(_SERIES, "close"), (int, 14)], "number", lambda p: p[0]),
+    "bb_width": (_bb_width, [(_SERIES, "close"), (int, 20)], "number", _window),
+    "macd": (_macd_part(0), [(_SERIES, "close"), (int, 12), (int, 26), (int, 9)], "number", _macd_warmup),
+    "macd_signal": (_macd_part(1), [(_SERIES, "close"), (int, 12), (int, 26), (int, 9)], "number", _macd_warmup),
+    "macd_hist": (_macd_part(2), [(_SERIES, "close"), (int, 12), (int, 26), (int, 9)], "number", _macd_warmup),
+    "days_since_cross": (_days_since_cross, [(_SERIES, None), (_SERIES, None)], "number", None),
+    "cross_date": (_cross_date, [(_SERIES, None), (_SERIES, None)], "date", None),
+    "daily": (_timeframe("1d"), [(_SERIES, None)], "number", lambda p: 0),
+    "weekly": (_timeframe("1wk"), [(_SERIES, None)], "number", lambda p: 0),
+    "monthly": (_timeframe("1mo"), [(_SERIES, None)], "number", lambda p: 0),
+}
+
+# Functions that evaluate their argument on another timeframe -> its interval
+TIMEFRAMES = {"daily": "1d", "weekly": "1wk", "monthly": "1mo"}
+
+
+def lookback(node):
+    """Bars before the current one that ``node`` needs, or None if unbounded.
+
+    EMAs carry their whole history; they count as needing the bounded
+    warm-up after which the seed weighs less than ``EMA_WARMUP_TOLERANCE``.
+    A timeframe function needs none: its argument is computed on the other
+    timeframe's own history.
+    """
+    if isinstance(node, Call) and node.name in TIMEFRAMES:
+        return 0
+    own = 0
+    if isinstance(node, Call):
+        warmup = FUNCTIONS[node.name][3]
+        if warmup is None:
+            return None
+        own = warmup(node.params)
+    needed = 0
+    for child in node.children:
+        child_needed = lookback(child)
+        if child_needed is None:
+            return None
+        needed = max(needed, child_needed)
+    return needed + own
+
+
+# Parser
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<number>\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)"
+    r"|(?P<name>[A-Za-z_][A-Za-z_0-9]*)"
+    r"|(?P<op>>=|<=|==|!=|[-+*/()<>,]))"
+)
+_COMPARISONS = (">", "<", ">=", "<=", "==", "!=")
+
+
+def _tokenize(text: str):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise RuleError(f"Unexpected character {text[pos:].strip()[:1]!r} at position {pos}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name" and value.lower() in ("and", "or", "not"):
+            kind, value = "op", value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if kind is None or (value is not None and token != value):
+            expected = f"{value!r}" if value else "an expression"
+            found = repr(token) if token is not None else "end of rule"
+            raise RuleError(f"Expected {expected}, found {found}")
+        self.pos += 1
+        return kind, token
+
+    def parse(self):
+        node = self.disjunction()
+        if self.peek()[0] is not None:
+            raise RuleError(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def disjunction(self):
+        items = [self.conjunction()]
+        while self.peek() == ("op", "or"):
+            self.take()
+            items.append(self.conjunction())
+        return items[0] if len(items) == 1 else Logic("or", items)
+
+    def conjunction(self):
+        items = [self.negation()]
+        while self.peek() == ("op", "and"):
+            self.take()
+            items.append(self.negation())
+        return items[0] if len(items) == 1 else Logic("and", items)
+
+    def negation(self):
+        if self.peek() == ("op", "not"):
+            self.take()
+            return Not(self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        operands = [self.additive()]
+        ops = []
+        while self.peek()[1] in _COMPARISONS and self.peek()[0] == "op":
+            ops.append(self.take()[1])
+            operands.append(self.additive())
+        if not ops:
+            return operands[0]
+        # a > b > c means a > b and b > c
+        items = [Compare(op, operands[i], operands[i + 1]) for i, op in enumerate(ops)]
+        return items[0] if len(items) == 1 else Logic("and", items)
+
+    def additive(self):
+        node = self.multiplicative()
+        while self.peek()[1] in ("+", "-") and self.peek()[0] == "op":
+            op = self.take()[1]
+            node = BinOp(op, node, self.multiplicative())
+        return node
+
+    def multiplicative(self):
+        node = self.unary()
+        while self.peek()[1] in ("*", "/") and self.peek()[0] == "op":
+            op = self.take()[1]
+            node = BinOp(op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            operand = self.unary()
+            return Const(-operand.value) if isinstance(operand, Const) else Neg(operand)
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.atom()
+
+    def atom(self):
+        kind, token = self.take()
+        if kind == "number":
+            return Const(float(token))
+        if kind == "op" and token == "(":
+            node = self.disjunction()
+            self.take(")")
+            return node
+        if kind == "name":
+            name = token.lower()
+            if self.peek() == ("op", "("):
+                self.take()
+                args = []
+                if self.peek() != ("op", ")"):
+                    args.append(self.disjunction())
+                    while self.peek() == ("op", ","):
+                        self.take()
+                        args.append(self.disjunction())
+                self.take(")")
+                return _make_call(name, args)
+            if name in COLUMNS:
+                return Column(name)
+            raise RuleError(f"Unknown column {token!r}; expected one of {', '.join(COLUMNS)}")
+        raise RuleError(f"Unexpected {token!r}")
+
+
+def _make_call(name: str, args):
+    if name not in FUNCTIONS:
+        raise RuleError(f"Unknown function {name!r}")
+    spec = FUNCTIONS[name][1]
+    args = list(args)
+    # The leading series may be left out: sma(50) is sma(close, 50)
+    if spec[0][0] == _SERIES and spec[0][1] is not None and (not args or isinstance(args[0], Const)):
+        args.insert(0, Column(spec[0][1]))
+    if len(args) > len(spec):
+        raise RuleError(f"{name}() takes at most {len(spec)} arguments")
+
+    series, params, shown = [], [], []
+    for i, (kind, default) in enumerate(spec):
+        given = i < len(args)
+        if kind == _SERIES:
+            if not given:
+                raise RuleError(f"{name}() needs a series argument")
+            arg = args[i]
+            if arg.kind != "number":
+                raise RuleError(f"{name}() argument {i + 1} must be a numeric series")
+            if name in TIMEFRAMES and any(
+                isinstance(n, Call) and n.name in TIMEFRAMES for n in _walk(arg)
+            ):
+                raise RuleError(f"{name}() cannot contain another timeframe function")
+            series.append(arg)
+            if default is None or arg.key != default:
+                shown.append(arg.label)
+        else:
+            if not given:
+                if default is None:
+                    raise RuleError(f"{name}() needs a window length")
+                params.append(default)
+                continue
+            arg = args[i]
+            if not isinstance(arg, Const) or not arg.value.is_integer() or arg.value < 1:
+                raise RuleError(f"{name}() argument {i + 1} must be a positive whole number")
+            params.append(int(arg.value))
+            if int(arg.value) != default:
+                shown.append(str(int(arg.value)))
+    return Call(name, series, params, f"{name}({', '.join(shown)})")
+
+
+def parse(text: str):
+    """Parse a rule expression into its node tree."""
+    if not text or not text.strip():
+        raise RuleError("Empty rule")
+    return _Parser(text).parse()
+
+
+# Plans
+
+
+def _walk(node):
+    yield node
+    for child in node.children:
+        yield from _walk(child)
+
+
+def _walk_series(node):
+    # Like _walk, but not into the arguments of timeframe functions, which
+    # are computed on their own timeframe
+    yield node
+    if not (isinstance(node, Call) and node.name in TIMEFRAMES):
+        for child in node.children:
+            yield from _walk_series(child)
+
+
+def _leaves(node, out):
+    # Maximal series nodes of a row-level expression: columns and calls
+    if isinstance(node, (Column, Call)):
+        out.setdefault(node.key, node)
+    else:
+        for child in node.children:
+            _leaves(child, out)
+
+
+class Rule:
+    """A compiled rule.
+
+    ``condition`` selects the matching symbols, ``outputs`` are the
+    (name, expression) pairs reported for each match and ``require`` lists
+    further values that must be available on the chosen bar. ``min_rows`` is
+    the minimum number of bars on which all of them are available.
+    """
+
+    def __init__(self, condition, outputs=(), require=(), min_rows: int = 1, text: str = ""):
+        self.condition = parse(condition) if isinstance(condition, str) else condition
+        if self.condition.kind != "bool":
+            raise RuleError("A rule must be a condition, e.g. close > sma(50)")
+        self.text = text or (condition if isinstance(condition, str) else self.condition.label)
+        self.outputs = [(name, parse(expr) if isinstance(expr, str) else expr) for name, expr in outputs]
+        self.require = [parse(expr) if isinstance(expr, str) else expr for expr in require]
+        self.min_rows = min_rows
+
+        for node in _walk(self.condition):
+            if node.kind == "date":
+                raise RuleError(f"{node.label} is a date and can only be reported, not compared")
+
+        # Values that must exist on the evaluated bar (dates are reported only)
+        leaves = {}
+        for node in [self.condition] + [expr for _, expr in self.outputs] + self.require:
+            _leaves(node, leaves)
+        self.leaves = [node for node in leaves.values() if node.kind != "date"]
+        self.date_leaves = [node for node in leaves.values() if node.kind == "date"]
+
+    @property
+    def fields(self):
+        """Panel fields the rule reads, in canonical order."""
+        used = set()
+        for node in [self.condition] + [e for _, e in self.outputs] + self.require:
+            used.update(n.field for n in _walk(node) if isinstance(n, Column))
+        return tuple(f for f in COLUMNS.values() if f in used)
+
+    @property
+    def timeframes(self):
+        """Intervals of the timeframe functions the rule uses, e.g. ``("1wk",)``."""
+        used = set()
+        for node in [self.condition] + [e for _, e in self.outputs] + self.require:
+            used.update(TIMEFRAMES[n.name] for n in _walk(node) if isinstance(n, Call) and n.name in TIMEFRAMES)
+        return tuple(sorted(used))
+
+    @property
+    def key(self):
+        """Canonical form, equal for rules that differ only in spelling."""
+        parts = [self.condition.key]
+        parts += [f"{name}={expr.key}" for name, expr in self.outputs]
+        parts += [expr.key for expr in self.require]
+        return "; ".join(parts) + f"; min_rows={self.min_rows}"
+
+    def window(self, bars: int = 1):
+        """Trailing rows needed to evaluate the last ``bars`` bars.
+
+        Covers the warm-up of every value the rule uses plus ``min_rows``, so
+        the values on those bars match a full computation up to rounding.
+        None when some value depends on the whole history.
+        """
+        needed = 0
+        for node in self.leaves + self.date_leaves:
+            node_needed = lookback(node)
+            if node_needed is None:
+                return None
+            needed = max(needed, node_needed)
+        return needed + max(bars, self.min_rows)
+
+    def plan(self):
+        """Distinct series computations, dependencies first."""
+        order = {}
+        for node in self.leaves + self.date_leaves:
+            for sub in reversed(list(_walk_series(node))):
+                if isinstance(sub, (Column, Call, BinOp, Neg)) and sub.key not in order:
+                    order[sub.key] = sub
+        return list(order.values())
+
+
+def compile_rule(text: str):
+    """Compile a user rule; matches report close plus every referenced value."""
+    condition = parse(text)
+    if condition.kind != "bool":
+        raise RuleError("A rule must be a condition, e.g. close > sma(50)")
+    leaves = {}
+    _leaves(condition, leaves)
+    outputs = [("close", Column("close"))]
+    outputs += [(node.label, node) for key, node in leaves.items() if key != "close"]
+    return Rule(condition, outputs=outputs, text=text.strip())
+
+
+# Evaluation
+
+
+class Evaluator:
+    """Computes series for one universe, sharing them between rules.
+
+    ``fields`` maps panel field names to dates x symbols DataFrames and
+    ``dates`` is the matching datetime64[ns] matrix. A ``latest`` evaluator
+    only holds the trailing rows a rule needs (see ``Rule.window``) and
+    computes windowed indicators with vectorized NumPy reductions; values
+    then agree with the full pandas computation up to rounding.
+
+    ``timeframes`` maps an interval (``1d``, ``1wk``, ``1mo``) to the
+    Evaluator of the same universe on those bars, for the timeframe
+    functions.
+    """
+
+    def __init__(self, symbols, dates, fields, latest: bool = False, timeframes=None):
+        self.symbols = list(symbols)
+        self.dates = dates
+        self.fields = fields
+        self.latest = latest
+        self.timeframes = timeframes or {}
+        self._frames = {}
+
+    def timeframe(self, interval: str):
+        """The Evaluator of this universe on ``interval`` bars."""
+        sub = self.timeframes.get(interval)
+        if sub is None:
+            raise RuleError(f"{interval} bars are not loaded")
+        return sub
+
+    def frame(self, node):
+        """DataFrame of ``node`` over every date and symbol (memoized)."""
+        cached = self._frames.get(node.key)
+        if cached is not None:
+            return cached
+        if isinstance(node, Column):
+            if node.field not in self.fields:
+                raise RuleError(f"Column {node.name!r} is not loaded")
+            result = self.fields[node.field]
+        elif isinstance(node, Call):
+            with timed(f"indicator.{node.name}"):
+                result = FUNCTIONS[node.name][0](self, node.args, node.params)
+        elif isinstance(node, BinOp):
+            result = _apply(node.op, self._operand(node.left), self._operand(node.right))
+        elif isinstance(node, Neg):
+            result = -self.frame(node.operand)
+        else:
+            raise RuleError(f"{node.label} is not a series")
+        self._frames[node.key] = result
+        return result
+
+    def seed(self, node, frame):
+        """Use ``frame`` as the values of ``node``, e.g. when computed in bulk."""
+        self._frames[node.key] = frame
+
+    def _operand(self, node):
+        return node.value if isinstance(node, Const) else self.frame(node)
+
+    def values(self, node):
+        return self.frame(node).to_numpy()
+
+
+def _apply(op, left, right):
+    if op == "+":
+        return left + right
+    if op == "-":
+        return left - right
+    if op == "*":
+        return left * right
+    return left / right
+
+
+def evaluate(node, leaves):
+    """Evaluate a row-level expression given the values of its leaves.
+
+    ``leaves`` maps leaf keys to arrays (one value per symbol, or whole
+    matrices); comparisons involving NaN are False.
+    """
+    if node.key in leaves:
+        return leaves[node.key]
+    if isinstance(node, Const):
+        return node.value
+    if isinstance(node, BinOp):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _apply(node.op, evaluate(node.left, leaves), evaluate(node.right, leaves))
+    if isinstance(node, Neg):
+        return -evaluate(node.operand, leaves)
+    if isinstance(node, Compare):
+        left = evaluate(node.left, leaves)
+        right = evaluate(node.right, leaves)
+        with np.errstate(invalid="ignore"):
+            if node.op == ">":
+                return np.greater(left, right)
+            if node.op == "<":
+                return np.less(left, right)
+            if node.op == ">=":
+                return np.greater_equal(left, right)
+            if node.op == "<=":
+                return np.less_equal(left, right)
+            if node.op == "==":
+                return np.equal(left, right)
+            return np.not_equal(left, right)
+    if isinstance(node, Logic):
+        combine = np.logical_and if node.op == "and" else np.logical_or
+        result = evaluate(node.items[0], leaves)
+        for item in node.items[1:]:
+            result = combine(result, evaluate(item, leaves))
+        return result
+    if isinstance(node, Not):
+        return np.logical_not(evaluate(node.operand, leaves))
+    raise RuleError(f"Cannot evaluate {node.label}")
+
+
+# The built-in scan modes expressed as rules
+
+
+def golden_cross_rule(lookback_days: int = 5):
+    return Rule(
+        f"days_since_cross(sma(20), sma(50)) <= {lookback_days}",
+        outputs=[("last_price", "close"), ("gc_date", "cross_date(sma(20), sma(50))")],
+    )
+
+
+def llv_sma_value_rule(
+    llv_window: int = 5,
+    sma_period: int = 50,
+    near_low: float = 0.99,
+    near_high: float = 1.02,
+    min_value: float = 1e9,
+):
+    s = f"sma({sma_period})"
+    return Rule(
+        f"prev(llv({llv_window})) > {s} and close >= {s} * {near_low!r} and close <= {s} * {near_high!r}"
+        f" and close * volume >= {min_value!r}",
+        outputs=[("close", "close"), ("sma", s), ("value", "close * volume")],
+        require=["low"],
+    )
+
+
+def mode4_rule():
+    return Rule(
+        "close > sma(50) > sma(150) > sma(200) and close * volume >= 1e9",
+        outputs=[
+            ("close", "close"),
+            ("sma20", "sma(20)"),
+            ("sma50", "sma(50)"),
+            ("sma150", "sma(150)"),
+            ("sma200", "sma(200)"),
+            ("value", "close * volume"),
+            ("rsi14", "rsi(14)"),
+        ],
+        require=["bb_width(20)", "macd_hist()"],
+        min_rows=20,
+    )
+
+
+def lower_low_rule():
+    return Rule(
+        "prev(low, 2) > prev(low) > low",
+        outputs=[("close", "close"), ("low_3", "prev(low, 2)"), ("low_2", "prev(low)"), ("low_1", "low")],
+    )
@@ -1,106 +1,159 @@
-from datetime import timedelta
-
-import pandas as pd
-
-from data import download_history
-from indicators import (
-    add_ma20_ma50_for_close,
-    add_sma_and_llv_prev,
-    add_mode4_indicators,
-)
-
-
-def print_table(headers, rows):
-    if not rows:
-        return
-
-    col_count = len(headers)
-    widths = [len(str(h)) for h in headers]
-
-    for row in rows:
-        for i in range(col_count):
-            if i >= len(row):
-                continue
-            value = "" if row[i] is None else str(row[i])
-            if len(value) > widths[i]:
-                widths[i] = len(value)
-
-    header_line = "  ".join(str(h).ljust(widths[i]) for i, h in enumerate(headers))
-    print(header_line)
-    print("-" * len(header_line))
-
-    for row in rows:
-        cells = []
-        for i in range(col_count):
-            value = "" if i >= len(row) or row[i] is None else str(row[i])
-            num_like = value.replace(",", "").replace(".", "").isdigit()
-            if num_like:
-                cells.append(value.rjust(widths[i]))
-            else:
-                cells.append(value.ljust(widths[i]))
-        print("  ".join(cells))
-
-
-def scan_golden_cross_for_tickers(tickers, lookback_days: int = 5, label: str = ""):
-    if not tickers:
-        print("\nNo tickers to scan.")
-        return []
-
-    label_text = label or "provided tickers"
-    print(f"\nScanning {label_text} for 20/50 MA golden crosses...")
-    results = []
-    for symbol in tickers:
-        
-        hist = download_history(symbol, period="1y", interval="1d")
-        if hist is None or "Close" not in hist.columns:
-            continue
-
-        hist = add_ma20_ma50_for_close(hist)
-        valid = hist["MA20"].notna() & hist["MA50"].notna()
-        hist_valid = hist.loc[valid]
-        if hist_valid.empty:
-            continue
-
-        signal = (hist_valid["MA20"] > hist_valid["MA50"]).astype(int)
-        cross = signal.diff()
-        golden_crosses = hist_valid[cross == 1]
-        if golden_crosses.empty:
-            continue
-
-        last_gc_date = golden_crosses.index[-1]
-        last_date = hist_valid.index[-1]
-        if last_gc_date >= last_date - timedelta(days=lookback_days):
-            # extract last close as a scalar from the Close column (Series or DataFrame)
-            close_array = hist_valid["Close"].tail(1).to_numpy().ravel()
-            if close_array.size == 0:
-                continue
-            last_close = float(close_array[0])
-            results.append((symbol, last_close, last_gc_date.date()))
-
-    if not results:
-        print("\nNo recent 20/50 MA golden crosses found in the selected lookback window.")
-        return []
-
-    print("\nStocks with recent 20/50 MA golden crosses:")
-    headers = ["Symbol", "Last Price", "GC Date"]
-    rows = [
-        (symbol, f"{last_close:,.2f}", str(gc_date))
-        for symbol, last_close, gc_date in results
-    ]
-    print_table(headers, rows)
-
-    data = [
-        {
-            "symbol": symbol,
-            "last_price": float(last_close),
-            "gc_date": str(gc_date),
-        }
-        for symbol, last_close, gc_date in results
-    ]
-    return data
+import functools
+
+import engine
+from data.intervals import check_interval, scan_period
+from metrics import instrumented, timed
+from parallel import run_sharded, scan_workers
+from results import Field, ResultBatch
+from rules import COLUMNS, compile_rule, golden_cross_rule, llv_sma_value_rule, lower_low_rule, mode4_rule
+
+
+def parallel_scan(scanner):
+    """Let ``scanner`` shard its tickers across processes.
+
+    Adds a ``workers`` argument (default: ``STOCKS_SCAN_PROCESSES``); with
+    more than one worker the scan runs on the process pool and the shards'
+    batches are merged; the panels of the scan's ``interval`` (and of the
+    other timeframes a rule reads) are loaded once up front. The scan is
+    timed as stage ``scan.<name>`` (e.g. ``scan.golden_cross``).
+    """
+    stage = "scan." + scanner.__name__.removeprefix("scan_").removesuffix("_for_tickers")
+
+    @functools.wraps(scanner)
+    def wrapper(tickers, label: str = "", workers=None, **params):
+        with timed(stage):
+            if tickers and scan_workers(workers) > 1:
+                interval = params.get("interval", "1d")
+                rule = params.get("rule")
+                results = run_sharded(
+                    wrapper,
+                    tickers,
+                    label=label,
+                    params=params,
+                    workers=workers,
+                    period=_period(interval),
+                    interval=interval,
+                    timeframes=compile_rule(rule).timeframes if rule else (),
+                )
+                if results is not None:
+                    return results
+            return scanner(tickers, label=label, **params)
+
+    return wrapper
+
+
+# Output columns and console messages of each scanner, given its parameters
+
 
+def golden_cross_layout(lookback_days: int = 5):
+    return {
+        "fields": [
+            Field("symbol", "str", "Symbol"),
+            Field("last_price", "float", "Last Price"),
+            Field("gc_date", "date", "GC Date"),
+        ],
+        "title": "Stocks with recent 20/50 MA golden crosses",
+        "empty": "No recent 20/50 MA golden crosses found in the selected lookback window.",
+        "about": "20/50 MA golden crosses",
+    }
 
 
+def llv_sma_value_layout(
+    llv_window: int = 5,
+    sma_period: int = 50,
+    near_low: float = 0.99,
+    near_high: float = 1.02,
+    min_value: float = 1e9,
+):
+    return {
+        "fields": [
+            Field("symbol", "str", "Symbol"),
+            Field("close", "float", "Close"),
+            Field("sma", "float", f"SMA{sma_period}"),
+            Field("value", "float", "Value", ",.0f"),
+            Field("date", "date", "Date"),
+        ],
+        "title": f"Stocks matching LLV({llv_window}) > SMA{sma_period}, close near SMA{sma_period}, value > 1B",
+        "empty": f"No stocks matched the LLV/SMA{sma_period} + value filter in the selected lookback window.",
+        "about": (
+            f"LLV({llv_window}) > SMA{sma_period}, close near SMA{sma_period} "
+            f"and value > {min_value:,.0f}"
+        ),
+    }
+
+
+def mode4_combo_layout():
+    return {
+        "fields": [
+            Field("symbol", "str", "Symbol"),
+            Field("close", "float", "Close"),
+            Field("sma20", "float", "SMA20"),
+            Field("sma50", "float", "SMA50"),
+            Field("sma150", "float", "SMA150"),
+            Field("sma200", "float", "SMA200"),
+            Field("value", "float", "Value", ",.0f"),
+            Field("rsi14", "float", "RSI14", ".2f"),
+            Field("date", "date", "Date"),
+        ],
+        "title": "Stocks matching mode 4 combo filter",
+        "empty": "No stocks matched the mode 4 combo filter in the selected lookback window.",
+        "about": "mode 4 combo: Close > SMA50 > SMA150 > SMA200 and traded value >= 1B IDR",
+    }
+
+
+def lower_low_layout():
+    return {
+        "fields": [
+            Field("symbol", "str", "Symbol"),
+            Field("close", "float", "Close"),
+            Field("low_3", "float", "Low-3"),
+            Field("low_2", "float", "Low-2"),
+            Field("low_1", "float", "Low-1"),
+            Field("date", "date", "Date"),
+        ],
+        "title": "Stocks with 3 consecutive lower daily lows",
+        "empty": "No stocks matched the 3-day consecutive lower low pattern in the selected lookback window.",
+        "about": "3 consecutive lower daily lows",
+    }
+
+
+def rule_layout(compiled):
+    """Layout of a custom rule: the symbol, its outputs and the bar's date."""
+    fields = [Field("symbol", "str")]
+    fields += [Field(name, "date" if expr.kind == "date" else "float") for name, expr in compiled.outputs]
+    if not compiled.date_leaves:
+        fields.append(Field("date", "date"))
+    return {
+        "fields": fields,
+        "title": "Stocks matching the rule",
+        "empty": "No stocks matched the rule.",
+        "about": f"rule: {compiled.text}",
+    }
+
+
+def _period(interval: str):
+    """The history a scan at ``interval`` reads; raises ValueError for unknown intervals."""
+    return scan_period(check_interval(interval))
+
+
+def _batch(layout, rows=(), records=None):
+    """A ResultBatch of tuples ``rows`` (or dicts ``records``) in ``layout``."""
+    meta = {"title": layout["title"], "empty": layout["empty"]}
+    if records is not None:
+        return ResultBatch.from_records(layout["fields"], records, **meta)
+    return ResultBatch.from_rows(layout["fields"], list(rows), **meta)
+
+
+@parallel_scan
+def scan_golden_cross_for_tickers(tickers, lookback_days: int = 5, interval: str = "1d", label: str = ""):
+    layout = golden_cross_layout(lookback_days)
+    if not tickers:
+        return _batch(layout)
+    wide = engine.load_wide(tickers, period=_period(interval), interval=interval, fields=("Close",))
+    return _batch(layout, engine.golden_cross(wide, lookback_days=lookback_days))
+
+
+@parallel_scan
 def scan_llv_sma50_value_for_tickers(
     tickers,
     llv_window: int = 5,
@@ -108,289 +161,163 @@ def scan_llv_sma50_value_for_tickers(
     near_low: float = 0.99,
     near_high: float = 1.02,
     min_value: float = 1e9,
+    interval: str = "1d",
     label: str = "",
 ):
+    layout = llv_sma_value_layout(llv_window, sma_period, near_low, near_high, min_value)
     if not tickers:
-        print("\nNo tickers to scan.")
-        return []
-
-    label_text = label or "provided tickers"
-    print(
-        f"\nScanning {label_text} for LLV({llv_window}) > SMA{sma_period}, "
-        f"close near SMA{sma_period} and value > {min_value:,.0f}..."
+        return _batch(layout)
+
+    wide = engine.load_wide(tickers, period=_period(interval), interval=interval)
+    results = engine.llv_sma_value(
+        wide,
+        llv_window=llv_window,
+        sma_period=sma_period,
+        near_low=near_low,
+        near_high=near_high,
+        min_value=min_value,
     )
+    return _batch(layout, results)
 
-    results = []
-    for symbol in tickers:
-        # Use longer history for larger SMA periods (e.g. SMA200)
-        download_period = "1y"
-        hist = download_history(symbol, period=download_period, interval="1d")
-        if hist is None:
-            continue
-
-        required_cols = {"Close", "Low", "Volume"}
-        if not required_cols.issubset(hist.columns):
-            continue
-
-        # Work on a small DataFrame to avoid multi-index or extra columns issues
-        df = hist[["Close", "Low", "Volume"]].copy()
-        df = add_sma_and_llv_prev(df, sma_period=sma_period, llv_window=llv_window)
-
-        # Drop rows where any of the required values is NaN
-        df = df.dropna(subset=["Close", "Low", "Volume", "SMA", "LLV_prev"])
-        if df.empty:
-            continue
-
-        last = df.iloc[-1]
-        sma = float(last["SMA"])
-        llv_prev = float(last["LLV_prev"])
-        close = float(last["Close"])
-        volume = float(last["Volume"])
-        idx = df.index[-1]
-        last_date = idx.date() if hasattr(idx, "date") else idx
-
-        # generic LLV/SMA filter using function parameters
-        cond_trend = llv_prev > sma
-        cond_near = (close >= sma * near_low) and (close <= sma * near_high)
-        trading_value = close * volume
-        cond_value = trading_value >= min_value
-
-        if cond_trend and cond_near and cond_value:
-            results.append((symbol, close, sma, trading_value, last_date))
-
-    if not results:
-        print("\nNo stocks matched the LLV/SMA{} + value filter in the selected lookback window.".format(sma_period))
-        return []
-
-    print("\nStocks matching LLV(5) > SMA{}, close near SMA{}, value > 1B:".format(sma_period, sma_period))
-    headers = ["Symbol", "Close", f"SMA{sma_period}", "Value", "Date"]
-    rows = [
-        (symbol, f"{close:,.2f}", f"{sma:,.2f}", f"{value:,.0f}", str(dt))
-        for symbol, close, sma, value, dt in results
-    ]
-    print_table(headers, rows)
-
-    data = [
-        {
-            "symbol": symbol,
-            "close": float(close),
-            "sma": float(sma),
-            "value": float(value),
-            "date": str(dt),
-        }
-        for symbol, close, sma, value, dt in results
-    ]
-    return data
-
-
-
-def scan_mode4_combo_for_tickers(tickers, label: str = ""):
+
+@parallel_scan
+def scan_mode4_combo_for_tickers(tickers, interval: str = "1d", label: str = ""):
+    layout = mode4_combo_layout()
     if not tickers:
-        print("\nNo tickers to scan.")
-        return []
+        return _batch(layout)
+    return _batch(layout, engine.mode4_combo_incremental(tickers, period=_period(interval), interval=interval))
+
+
+@parallel_scan
+def scan_lower_low_3days_for_tickers(tickers, interval: str = "1d", label: str = ""):
+    layout = lower_low_layout()
+    if not tickers:
+        return _batch(layout)
+    wide = engine.load_wide(tickers, period=_period(interval), interval=interval, fields=("Low", "Close"))
+    return _batch(layout, engine.lower_low_3days(wide))
+
 
-    label_text = label or "provided tickers"
-    print(
-        f"\nScanning {label_text} for mode 4 combo: "
-        "Close > SMA50 > SMA150 > SMA200 and traded value >= 1B IDR..."
+@parallel_scan
+def scan_rule_for_tickers(tickers, rule: str, interval: str = "1d", label: str = ""):
+    """Scan for a custom rule such as ``close > sma(50) and close * volume >= 1e9``.
+
+    Raises rules.RuleError if the rule is invalid.
+    """
+    compiled = compile_rule(rule)
+    layout = rule_layout(compiled)
+    if not tickers:
+        return _batch(layout)
+    wide = engine.load_wide(
+        tickers,
+        period=_period(interval),
+        interval=interval,
+        fields=compiled.fields,
+        timeframes=compiled.timeframes,
     )
+    return _batch(layout, records=engine.evaluate_rule(compiled, wide))
 
-    results = []
-    for symbol in tickers:
-        hist = download_history(symbol, period="1y", interval="1d")
-        if hist is None:
-            continue
-
-        required_cols = {"Close", "Volume"}
-        if not required_cols.issubset(hist.columns):
-            continue
-
-        df = hist[["Close", "Volume"]].copy()
-        df = add_mode4_indicators(df)
-
-        # Require all indicators present
-        df = df.dropna(
-            subset=[
-                "Close",
-                "Volume",
-                "SMA20",
-                "SMA50",
-                "SMA150",
-                "SMA200",
-                "BB_width",
-                "MACD_hist",
-                "RSI14",
-            ]
-        )
-        if df.empty or len(df) < 20:
-            continue
-
-        last = df.iloc[-1]
-        close = float(last["Close"])
-        sma20 = float(last["SMA20"])
-        sma50 = float(last["SMA50"])
-        sma150 = float(last["SMA150"])
-        sma200 = float(last["SMA200"])
-        volume = float(last["Volume"])
-        rsi14 = float(last["RSI14"])
-        idx = df.index[-1]
-        last_date = idx.date() if hasattr(idx, "date") else idx
-
-        # 1) Close above SMA50
-        cond_close_sma50 = close > sma50
-
-        # 2) Longer-term stack: SMA50 > SMA150 > SMA200
-        cond_sma_stack = sma50 > sma150 > sma200
-
-        # 3) Traded value (close * volume) >= 1B IDR
-        trading_value = close * volume
-        cond_value = trading_value >= 1e9
-
-        if cond_close_sma50 and cond_sma_stack and cond_value:
-            results.append(
-                (
-                    symbol,
-                    close,
-                    sma20,
-                    sma50,
-                    sma150,
-                    sma200,
-                    trading_value,
-                    rsi14,
-                    last_date,
-                )
-            )
-
-    if not results:
-        print("\nNo stocks matched the mode 4 combo filter in the selected lookback window.")
-        return []
-
-    print("\nStocks matching mode 4 combo filter:")
-    headers = [
-        "Symbol",
-        "Close",
-        "SMA20",
-        "SMA50",
-        "SMA150",
-        "SMA200",
-        "Value",
-        "RSI14",
-        "Date",
-    ]
-    rows = []
-    for (
-        symbol,
-        close,
-        sma20,
-        sma50,
-        sma150,
-        sma200,
-        value,
-        rsi14,
-        dt,
-    ) in results:
-        rows.append(
-            (
-                symbol,
-                f"{close:,.2f}",
-                f"{sma20:,.2f}",
-                f"{sma50:,.2f}",
-                f"{sma150:,.2f}",
-                f"{sma200:,.2f}",
-                f"{value:,.0f}",
-                f"{rsi14:.2f}",
-                str(dt),
-            )
-        )
-    print_table(headers, rows)
-
-    data = [
-        {
-            "symbol": symbol,
-            "close": float(close),
-            "sma20": float(sma20),
-            "sma50": float(sma50),
-            "sma150": float(sma150),
-            "sma200": float(sma200),
-            "value": float(value),
-            "rsi14": float(rsi14),
-            "date": str(dt),
-        }
-        for (
-            symbol,
-            close,
-            sma20,
-            sma50,
-            sma150,
-            sma200,
-            value,
-            rsi14,
-            dt,
-        ) in results
-    ]
-    return data
-
-
-def scan_lower_low_3days_for_tickers(tickers, label: str = ""):
+
+# Scan modes offered by the CLI and the web API: mode -> (scanner, parameters)
+MODES = {
+    "1": (scan_golden_cross_for_tickers, {"lookback_days": 5}),
+    # Filter around SMA50: LLV(5) > SMA50, close ~ SMA50, value > 1B
+    "2": (
+        scan_llv_sma50_value_for_tickers,
+        {"llv_window": 5, "sma_period": 50, "near_low": 0.99, "near_high": 1.02, "min_value": 1e9},
+    ),
+    # Filter around SMA200: LLV(5) > SMA200, close ~ SMA200, value > 1B
+    "3": (
+        scan_llv_sma50_value_for_tickers,
+        {"llv_window": 5, "sma_period": 200, "near_low": 0.99, "near_high": 1.02, "min_value": 1e9},
+    ),
+    "4": (scan_mode4_combo_for_tickers, {}),
+    "5": (scan_lower_low_3days_for_tickers, {}),
+}
+
+
+def resolve_mode(mode):
+    """Return a known mode key; anything unrecognised falls back to mode 1."""
+    mode = str(mode).strip()
+    return mode if mode in MODES else "1"
+
+
+# The rule each scanner evaluates, given the same parameters
+_SCANNER_RULES = {
+    scan_golden_cross_for_tickers: golden_cross_rule,
+    scan_llv_sma50_value_for_tickers: llv_sma_value_rule,
+    scan_mode4_combo_for_tickers: mode4_rule,
+    scan_lower_low_3days_for_tickers: lower_low_rule,
+}
+
+
+# ... and the layout of its results
+_SCANNER_LAYOUTS = {
+    scan_golden_cross_for_tickers: golden_cross_layout,
+    scan_llv_sma50_value_for_tickers: llv_sma_value_layout,
+    scan_mode4_combo_for_tickers: mode4_combo_layout,
+    scan_lower_low_3days_for_tickers: lower_low_layout,
+}
+
+
+def mode_rule(mode):
+    """The rules.Rule behind scan ``mode`` with its standard parameters."""
+    scanner, params = MODES[resolve_mode(mode)]
+    return _SCANNER_RULES[scanner](**params)
+
+
+def mode_layout(mode):
+    """Result columns and console messages of scan ``mode``."""
+    scanner, params = MODES[resolve_mode(mode)]
+    return _SCANNER_LAYOUTS[scanner](**params)
+
+
+def describe(mode, rule: str = None):
+    """What scan ``mode`` (or a custom ``rule``) looks for, for progress messages."""
+    if rule:
+        return rule_layout(compile_rule(rule))["about"]
+    return mode_layout(mode)["about"]
+
+
+def parse_modes(text):
+    """Split a mode list such as ``"1,2,4"`` into known mode keys, in order."""
+    return list(dict.fromkeys(resolve_mode(part) for part in str(text).split(",") if part.strip()))
+
+
+@instrumented("scan.modes")
+def scan_modes_for_tickers(tickers, modes, label: str = "", interval: str = "1d"):
+    """Run several scan modes over one universe on ``interval`` bars.
+
+    The histories are loaded once and indicators shared between modes (e.g.
+    SMA50 for modes 2 and 4) are computed once. Returns mode -> ResultBatch,
+    with the same columns the single-mode scanners return.
+    """
+    modes = list(dict.fromkeys(resolve_mode(mode) for mode in modes))
+    period = _period(interval)
     if not tickers:
-        print("\nNo tickers to scan.")
-        return []
-
-    label_text = label or "provided tickers"
-    print(f"\nScanning {label_text} for 3 consecutive lower daily lows...")
-
-    results = []
-    for symbol in tickers:
-        hist = download_history(symbol, period="1y", interval="1d")
-        if hist is None:
-            continue
-
-        required_cols = {"Low", "Close"}
-        if not required_cols.issubset(hist.columns):
-            continue
-
-        df = hist[["Low", "Close"]].dropna()
-        if len(df) < 3:
-            continue
-
-        last3 = df.iloc[-3:]
-        lows = last3["Low"].to_list()
-
-        if lows[0] > lows[1] > lows[2]:
-            last = last3.iloc[-1]
-            close = float(last["Close"])
-            idx = last3.index[-1]
-            last_date = idx.date() if hasattr(idx, "date") else idx
-            results.append((symbol, close, lows[0], lows[1], lows[2], last_date))
-
-    if not results:
-        print("\nNo stocks matched the 3-day consecutive lower low pattern in the selected lookback window.")
-        return []
-
-    print("\nStocks with 3 consecutive lower daily lows:")
-    headers = ["Symbol", "Close", "Low-3", "Low-2", "Low-1", "Date"]
-    rows = [
-        (
-            symbol,
-            f"{close:,.2f}",
-            f"{low1:,.2f}",
-            f"{low2:,.2f}",
-            f"{low3:,.2f}",
-            str(dt),
-        )
-        for symbol, close, low1, low2, low3, dt in results
-    ]
-    print_table(headers, rows)
-
-    data = [
-        {
-            "symbol": symbol,
-            "close": float(close),
-            "low_3": float(low1),
-            "low_2": float(low2),
-            "low_1": float(low3),
-            "date": str(dt),
-        }
-        for symbol, close, low1, low2, low3, dt in results
-    ]
-    return data
+        return {mode: _batch(mode_layout(mode)) for mode in modes}
+
+    rules = {mode: mode_rule(mode) for mode in modes}
+    fields = set()
+    timeframes = set()
+    for rule in rules.values():
+        fields.update(rule.fields)
+        timeframes.update(rule.timeframes)
+    fields = tuple(field for field in COLUMNS.values() if field in fields)
+    wide = engine.load_wide(tickers, period=period, interval=interval, fields=fields, timeframes=sorted(timeframes))
+
+    return {
+        mode: _batch(mode_layout(mode), records=rows)
+        for mode, rows in engine.evaluate_rules(rules, wide).items()
+    }
+
+
+def run_mode(mode, tickers, label: str = "", workers=None, rule: str = None, interval: str = "1d"):
+    """Run scan ``mode`` over ``tickers`` with its standard parameters.
+
+    A custom ``rule`` takes the place of the mode. ``interval`` is the bar
+    size to scan (``1d`` or an intraday one such as ``15m``).
+    """
+    if rule:
+        return scan_rule_for_tickers(tickers, rule=rule, interval=interval, label=label, workers=workers)
+    scanner, params = MODES[resolve_mode(mode)]
+    return scanner(tickers, label=label, workers=workers, interval=interval, **params)
@@ -0,0 +1,226 @@
+"""Background pre-warming of the caches for the bundled ticker universes.
+
+After the IDX close the prewarmer refreshes every symbol of the configured
+universes (shared symbols are downloaded once), rebuilds the panel, advances
+the incremental indicator state and runs every scan mode for every universe
+so their results land in the result cache. A daily panel stays fresh until
+the next session close (see ``data.intervals.last_close``), so until then,
+including the first ``/scan`` of the next morning, scans of these
+universes are served from the warm panel and result cache without
+downloading inside the HTTP request. A run scheduled before the close goes
+stale at that close; the prewarmer logs a warning when configured so.
+
+Run it as its own process with ``python scheduler.py`` (``--once`` for a
+single refresh), or set ``STOCKS_PREWARM=1`` to start it inside the Flask
+app. The schedule is configured with ``STOCKS_PREWARM_AT`` (default
+``16:30``) and ``STOCKS_PREWARM_TZ`` (default: the market time zone,
+``Asia/Jakarta``); runs only happen on weekdays. Under gunicorn every
+worker starts its own prewarmer; a lock file in the cache directory lets
+only one of them refresh at a time, and the others skip that run.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+try:
+    import fcntl  # not available on Windows
+except ImportError:
+    fcntl = None
+
+from data import get_cache_backend, last_fetch_report, load_panel, load_tickers_from_json
+from data.intervals import MARKET_TZ, SESSION_CLOSE
+from result_cache import SCAN_INTERVAL, SCAN_PERIOD, run_mode_cached
+from scanners import MODES
+
+logger = logging.getLogger(__name__)
+
+UNIVERSES = ("idx30.json", "idx80.json", "kompas100.json", "ihsg.json")
+
+
+class Prewarmer:
+    """Refreshes caches for a set of ticker lists on a daily schedule."""
+
+    def __init__(self, universes=UNIVERSES, at: str = None, tz: str = None):
+        self.universes = list(universes)
+        at = at or os.environ.get("STOCKS_PREWARM_AT", "16:30")
+        hour, minute = at.split(":")
+        self.at = (int(hour), int(minute))
+        self.tz = ZoneInfo(tz or os.environ.get("STOCKS_PREWARM_TZ", MARKET_TZ))
+        if self._runs_after_close() is False:
+            logger.warning(
+                "Pre-warm at %s runs before the %s session close; its panels go stale at the close", at, SESSION_CLOSE
+            )
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._status = {
+            "state": "idle",
+            "last_started": None,
+            "last_finished": None,
+            "duration": None,
+            "symbols": 0,
+            "universes": {},
+            "error": None,
+            "next_run": None,
+            "fetch": None,
+        }
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def _runs_after_close(self, now=None):
+        """True if the session closes before a scheduled run on the same day.
+
+        Panels built by an earlier run go stale at that close. Returns None
+        on days without a session.
+        """
+        run = self.next_run(now)
+        hour, minute = SESSION_CLOSE.split(":")
+        close = run.astimezone(ZoneInfo(MARKET_TZ)).replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+        if close.weekday() >= 5:
+            return None
+        return close <= run
+
+    def next_run(self, now=None):
+        """Next scheduled run after ``now``: the configured time on a weekday."""
+        now = now or datetime.now(self.tz)
+        candidate = now.replace(hour=self.at[0], minute=self.at[1], second=0, microsecond=0)
+        if candidate <= now:
+            candidate += timedelta(days=1)
+        while candidate.weekday() >= 5:
+            candidate += timedelta(days=1)
+        return candidate
+
+    def run_once(self):
+        """Refresh all universes now; returns the resulting status."""
+        with self._lock:
+            # A refresh already in progress is not started a second time
+            if self._status["state"] == "running":
+                return dict(self._status)
+            lock = _acquire_run_lock()
+            if lock is False:
+                # Another process (e.g. a sibling gunicorn worker) is refreshing
+                self._status.update(state="skipped", last_finished=_now_iso(), error=None)
+                return dict(self._status)
+            self._status.update(state="running", last_started=_now_iso(), error=None)
+
+        try:
+            return self._refresh()
+        finally:
+            if lock is not None:
+                lock.close()
+
+    def _refresh(self):
+        started = time.monotonic()
+        universes = {}
+        error = None
+        report = None
+        try:
+            lists = {}
+            for name in self.universes:
+                lists[name] = load_tickers_from_json(_resolve(name))
+            # Symbols shared by several lists are refreshed once
+            symbols = list(dict.fromkeys(s for tickers in lists.values() for s in tickers))
+            load_panel(symbols, SCAN_PERIOD, SCAN_INTERVAL, refresh=True)
+            report = last_fetch_report()
+
+            for name, tickers in lists.items():
+                if not tickers:
+                    continue
+                counts = {}
+                for mode in MODES:
+                    result, _ = run_mode_cached(mode, tickers, label=name)
+                    counts[mode] = len(result)
+                universes[name] = {"symbols": len(tickers), "matches": counts}
+        except Exception as e:
+            logger.exception("Pre-warming failed")
+            error = repr(e)
+            symbols = []
+
+        with self._lock:
+            self._status.update(
+                state="error" if error else "ok",
+                last_finished=_now_iso(),
+                duration=round(time.monotonic() - started, 3),
+                symbols=len(symbols),
+                universes=universes,
+                error=error,
+                fetch=report.to_dict() if report is not None else None,
+            )
+            return dict(self._status)
+
+    def start(self):
+        """Run the schedule on a daemon thread (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="prewarmer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            next_run = self.next_run()
+            with self._lock:
+                self._status["next_run"] = next_run.isoformat()
+            delay = (next_run - datetime.now(self.tz)).total_seconds()
+            if self._stop.wait(max(0.0, delay)):
+                return
+            self.run_once()
+
+
+def _acquire_run_lock():
+    """Take the cross-process pre-warm lock without waiting.
+
+    Returns the open lock file (closing it releases the lock), None where
+    file locks are unavailable, or False if another process holds it.
+    """
+    if fcntl is None:
+        return None
+    root = get_cache_backend().root
+    os.makedirs(root, exist_ok=True)
+    f = open(os.path.join(root, "prewarm.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    return f
+
+
+def _resolve(name):
+    if os.path.isabs(name):
+        return name
+    return os.path.join(os.path.dirname(__file__), name)
+
+
+def _now_iso():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+_prewarmer = None
+
+
+def get_prewarmer():
+    global _prewarmer
+    if _prewarmer is None:
+        _prewarmer = Prewarmer()
+    return _prewarmer
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    prewarmer = get_prewarmer()
+    if "--once" in sys.argv[1:]:
+        status = prewarmer.run_once()
+        print(f"Pre-warm {status['state']}: {status['symbols']} symbols in {status['duration']}s")
+        sys.exit(0 if status["state"] == "ok" else 1)
+    logger.info("Next pre-warm at %s", prewarmer.next_run().isoformat())
+    prewarmer.run_forever()
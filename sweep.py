@@ -0,0 +1,202 @@
+"""Parameter sweeps over the scan thresholds.
+
+``sweep`` backtests every combination of a parameter grid for a rule
+factory (by default ``rules.llv_sma_value_rule``, the LLV/SMA/value filter
+behind modes 2 and 3) and ranks the combinations by their forward returns.
+
+The universe is loaded once and all combinations share one evaluator, so
+each distinct indicator is computed once: every SMA period in the grid comes
+from a single cumulative sum per input series (``kernels.sma_many``) and
+each LLV window is computed once whatever the other parameters are. The
+combinations are then evaluated on a thread pool; the per-combination work
+is whole-matrix NumPy, which runs outside the GIL.
+
+    python sweep.py --file ihsg.json --grid sma_period=20,50,200 --grid near_high=1.02,1.05
+"""
+import argparse
+import inspect
+import itertools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import engine
+import kernels
+from backtest import BACKTEST_PERIOD, HORIZONS, forward_returns, summarize
+from data import load_tickers_from_json
+from metrics import instrumented
+from results import Field, ResultBatch, print_batch
+from rules import COLUMNS, Call, llv_sma_value_rule
+
+DEFAULT_GRID = {
+    "llv_window": [3, 5, 10],
+    "sma_period": [20, 50, 100, 200],
+    "near_low": [0.97, 0.99],
+    "near_high": [1.02, 1.05],
+    "min_value": [1e9],
+}
+
+# Combinations with fewer signals than this are ranked last
+MIN_SIGNALS = 30
+
+
+def combinations(grid):
+    """Every combination of ``grid`` (name -> values) as a dict, in grid order."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _seed_smas(ev, rules):
+    # All sma() nodes over the same input share one cumulative sum
+    groups = {}
+    for rule in rules:
+        for node in rule.plan():
+            if isinstance(node, Call) and node.name == "sma":
+                groups.setdefault(node.args[0].key, (node.args[0], {}))[1][node.key] = node
+    for source, nodes in groups.values():
+        frame = ev.frame(source)
+        windows = {key: int(node.params[0]) for key, node in nodes.items()}
+        smas = kernels.sma_many(frame.to_numpy(dtype=float), windows.values())
+        for key, node in nodes.items():
+            ev.seed(node, pd.DataFrame(smas[windows[key]], index=frame.index, columns=frame.columns))
+
+
+@instrumented("sweep")
+def sweep(
+    tickers,
+    grid=None,
+    factory=llv_sma_value_rule,
+    horizons=HORIZONS,
+    period: str = BACKTEST_PERIOD,
+    rank_by: str = None,
+    min_signals: int = MIN_SIGNALS,
+    workers: int = None,
+):
+    """Backtest every combination of ``grid`` and rank them.
+
+    ``grid`` maps parameters of ``factory`` to the values to try; the others
+    keep their defaults. Returns a ResultBatch with one row per combination:
+    its parameters, the number of signals over the history, the matches on
+    the last bar and, per horizon, the hit rate and mean forward return.
+    Rows are sorted by ``rank_by`` (default: the mean return at the first
+    horizon), best first, with combinations under ``min_signals`` last.
+    """
+    grid = {name: list(values) for name, values in (grid or DEFAULT_GRID).items()}
+    accepted = inspect.signature(factory).parameters
+    unknown = [name for name in grid if name not in accepted]
+    if unknown:
+        raise ValueError(f"Unknown parameter(s) for {factory.__name__}: {', '.join(unknown)}")
+    horizons = sorted({int(h) for h in horizons if int(h) > 0})
+    rank_by = rank_by or f"mean_{horizons[0]}"
+
+    combos = combinations(grid)
+    rules = [factory(**params) for params in combos]
+    fields = {"Close"}
+    timeframes = set()
+    for rule in rules:
+        fields.update(rule.fields)
+        timeframes.update(rule.timeframes)
+    fields = tuple(field for field in COLUMNS.values() if field in fields)
+    wide = engine.load_wide(tickers, period=period, interval="1d", fields=fields, timeframes=sorted(timeframes))
+
+    out_fields = [Field(name, "float", name, "g") for name in grid]
+    out_fields += [Field("signals", "float", "Signals", ",.0f"), Field("latest", "float", "Latest", ",.0f")]
+    for h in horizons:
+        out_fields += [Field(f"hit_{h}", "float", f"Hit {h}", ".1%"), Field(f"mean_{h}", "float", f"Mean {h}", ".2%")]
+    if rank_by not in [field.name for field in out_fields]:
+        raise ValueError(f"Cannot rank by {rank_by!r}")
+    meta = {"title": f"Parameter sweep ranked by {rank_by}", "empty": "No data to sweep."}
+    if not wide.symbols:
+        return ResultBatch(out_fields, **meta)
+
+    # Shared indicators first, so the workers only read them
+    ev = engine.evaluator(wide)
+    _seed_smas(ev, rules)
+    for rule in rules:
+        for node in rule.plan():
+            ev.frame(node)
+    returns = {h: forward_returns(wide["Close"].to_numpy(), h) for h in horizons}
+
+    def run(index):
+        match, _ = engine.rule_signals(rules[index], wide, ev)
+        row = dict(combos[index])
+        row["latest"] = int(match[-1].sum())
+        for h in horizons:
+            _, hit_rate, mean, _ = summarize(returns[h], match)
+            row[f"hit_{h}"] = hit_rate
+            row[f"mean_{h}"] = mean
+        row["signals"] = int(match.sum())
+        return row
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        rows = list(pool.map(run, range(len(rules))))
+
+    def rank(row):
+        value = row[rank_by]
+        return (row["signals"] < min_signals, value != value, -value if value == value else 0)
+
+    rows.sort(key=rank)
+    return ResultBatch.from_records(out_fields, rows, **meta)
+
+
+def _grid(specs):
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if not values:
+            raise SystemExit(f"Expected name=v1,v2,... in --grid, got {spec!r}")
+        grid[name.strip()] = [float(v) if "." in v or "e" in v.lower() else int(v) for v in values.split(",")]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep the LLV/SMA/value scan parameters over the cached history.")
+    parser.add_argument("--file", default="idx80.json", help="JSON file with tickers (default: %(default)s)")
+    parser.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        help="parameter values, e.g. sma_period=20,50,200 (repeatable; default grid if omitted)",
+    )
+    parser.add_argument("--horizons", default=",".join(map(str, HORIZONS)), help="forward horizons in bars")
+    parser.add_argument("--period", default=BACKTEST_PERIOD, help="history to load (default: %(default)s)")
+    parser.add_argument("--rank-by", help="column to rank by (default: mean return at the first horizon)")
+    parser.add_argument("--min-signals", type=int, default=MIN_SIGNALS, help="rank sparser combinations last")
+    parser.add_argument("--workers", type=int, help="threads evaluating the grid (default: CPU count)")
+    parser.add_argument("--top", type=int, default=20, help="rows to print (default: %(default)s, -1 for all)")
+    args = parser.parse_args(argv)
+
+    path = args.file
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(__file__), path)
+    tickers = load_tickers_from_json(path)
+    if not tickers:
+        return 1
+
+    grid = _grid(args.grid) or None
+    try:
+        table = sweep(
+            tickers,
+            grid=grid,
+            horizons=[int(h) for h in args.horizons.split(",") if h.strip()],
+            period=args.period,
+            rank_by=args.rank_by,
+            min_signals=args.min_signals,
+            workers=args.workers,
+        )
+    except ValueError as e:
+        print(f"\n{e}")
+        return 1
+    print(f"\nEvaluated {len(table)} combination(s).")
+    if args.top >= 0 and len(table) > args.top:
+        title = f"{table.title} (top {args.top})"
+        table = ResultBatch.from_records(table.fields, table.records()[:args.top], title=title)
+    print_batch(table)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
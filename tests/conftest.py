@@ -0,0 +1,90 @@
+"""Shared fixtures: an offline market in place of ``yf.download`` and a throwaway cache."""
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import engine
+import result_cache
+from data import history
+from data.cache import ColumnarCache
+from data.intervals import period_start
+
+
+class StubMarket:
+    """Deterministic stand-in for ``yf.download`` that records every call.
+
+    Every symbol has one daily bar per calendar day up to ``last_day``, so a
+    cache written from it is up to date today whatever the weekday.
+    Symbols in ``unavailable`` return no data.
+    """
+
+    def __init__(self, last_day=None, days=800):
+        self.last_day = pd.Timestamp(last_day if last_day is not None else pd.Timestamp.now().normalize())
+        self.days = days
+        self.calls = []
+        self.unavailable = set()
+
+    def bars(self, symbol):
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        # Anchor the series at a fixed day so moving last_day only adds bars
+        index = pd.date_range("2020-01-01", self.last_day, freq="D", name="Date")
+        close = 1000 * np.exp(np.cumsum(rng.normal(0.0005, 0.02, len(index))))
+        hist = pd.DataFrame(
+            {
+                "Open": close,
+                "High": close * 1.01,
+                "Low": close * 0.98,
+                "Close": close,
+                "Adj Close": close,
+                "Volume": np.full(len(index), 1_000_000, dtype=np.int64),
+            },
+            index=index,
+        )
+        return hist.iloc[-self.days:]
+
+    def __call__(self, tickers, period=None, start=None, end=None, interval="1d", **kwargs):
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        self.calls.append({"symbols": symbols, "period": period, "start": start, "end": end, "interval": interval})
+        frames = {}
+        for symbol in symbols:
+            if symbol in self.unavailable:
+                continue
+            hist = self.bars(symbol)
+            if start is not None:
+                hist = hist[hist.index >= pd.Timestamp(start)]
+            elif period not in (None, "max"):
+                hist = hist[hist.index >= period_start(period, self.last_day)]
+            if end is not None:
+                hist = hist[hist.index < pd.Timestamp(end)]
+            if not hist.empty:
+                frames[symbol] = hist
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1)
+
+    def symbols_fetched(self):
+        return [symbol for call in self.calls for symbol in call["symbols"]]
+
+
+@pytest.fixture
+def market(tmp_path, monkeypatch):
+    """A ``StubMarket`` wired into ``data`` with empty history and result caches."""
+    stub = StubMarket()
+    monkeypatch.setattr(history, "_backend", ColumnarCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(result_cache, "_cache", result_cache.ResultCache())
+    monkeypatch.setenv("STOCKS_SCAN_PROCESSES", "1")
+    monkeypatch.setitem(history._fetch_options, "rate", 0)
+    monkeypatch.setitem(history._fetch_options, "backoff", 0.0)
+    data.set_downloader(stub)
+    data.clear_memory_cache()
+    data.close_panels()
+    history._top_ups.clear()
+    engine.clear_mode4_states()
+    yield stub
+    data.set_downloader(None)
+    data.clear_memory_cache()
+    data.close_panels()
+    engine.clear_mode4_states()
@@ -0,0 +1,166 @@
+"""Columnar cache round trips, compared with what the CSV backend stores."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.cache import ColumnarCache, CsvCache, migrate_cache
+
+
+def _history(days=60, end="2026-10-16", seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=end, periods=days, name="Date")
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+    hist = pd.DataFrame(
+        {
+            "Open": close,
+            "High": close * 1.01,
+            "Low": close * 0.98,
+            "Close": close,
+            "Adj Close": close,
+            "Volume": rng.integers(1e5, 1e7, days),
+        },
+        index=index,
+    )
+    hist.iloc[5, :4] = np.nan  # a bar with missing prices
+    return hist
+
+
+@pytest.fixture
+def backends(tmp_path):
+    return ColumnarCache(str(tmp_path / "columnar")), CsvCache(str(tmp_path / "csv"))
+
+
+def _assert_same(columnar, csv):
+    col, ref = columnar.load("AAAA.JK", "1d"), csv.load("AAAA.JK", "1d")
+    assert col is not None and ref is not None
+    pd.testing.assert_frame_equal(col, ref, check_freq=False)
+
+
+def test_write(backends):
+    columnar, csv = backends
+    for backend in backends:
+        backend.save("AAAA.JK", "1d", _history())
+    _assert_same(columnar, csv)
+    assert not os.path.exists(os.path.join(columnar.path("AAAA.JK", "1d"), "meta.json.tmp"))
+
+
+def test_append_rows(backends):
+    columnar, csv = backends
+    hist = _history()
+    for backend in backends:
+        backend.save("AAAA.JK", "1d", hist.iloc[:50])
+    index_file = os.path.join(columnar.path("AAAA.JK", "1d"), "index.i8")
+    inode = os.stat(index_file).st_ino
+
+    for backend in backends:
+        backend.append("AAAA.JK", "1d", hist, hist.iloc[50:])
+    _assert_same(columnar, csv)
+    # Appended in place rather than rewritten
+    assert os.stat(index_file).st_ino == inode
+    assert os.path.getsize(index_file) == 8 * len(hist)
+
+
+def test_append_replaces_refetched_bars(backends):
+    columnar, csv = backends
+    hist = _history()
+    for backend in backends:
+        backend.save("AAAA.JK", "1d", hist.iloc[:50])
+
+    # The last stored bar was partial; its final version comes with the new rows
+    final = hist.copy()
+    final.iloc[49, final.columns.get_loc("Close")] += 1
+    for backend in backends:
+        backend.append("AAAA.JK", "1d", final, final.iloc[49:])
+    _assert_same(columnar, csv)
+    assert columnar.load("AAAA.JK", "1d")["Close"].iloc[49] == final["Close"].iloc[49]
+
+
+def test_rewrite_shorter_history(backends):
+    columnar, csv = backends
+    for backend in backends:
+        backend.save("AAAA.JK", "1d", _history(60))
+    # e.g. a trimmed intraday cache: fewer rows than before
+    shorter = _history(60).iloc[20:]
+    for backend in backends:
+        backend.save("AAAA.JK", "1d", shorter)
+    _assert_same(columnar, csv)
+    assert len(columnar.load("AAAA.JK", "1d")) == 40
+    assert os.path.getsize(os.path.join(columnar.path("AAAA.JK", "1d"), "index.i8")) == 8 * 40
+
+
+def test_append_reaching_back_rewrites(backends):
+    columnar, csv = backends
+    hist = _history()
+    for backend in backends:
+        backend.save("AAAA.JK", "1d", hist.iloc[30:])
+    for backend in backends:
+        backend.append("AAAA.JK", "1d", hist, hist.iloc[:30])
+    _assert_same(columnar, csv)
+
+
+def test_meta_is_replaced_atomically(backends):
+    columnar, _ = backends
+    hist = _history(61)
+    columnar.save("AAAA.JK", "1d", hist.iloc[:60])
+    path = columnar.path("AAAA.JK", "1d")
+    signature = columnar.signature("AAAA.JK", "1d")
+
+    # A writer that died before renaming its meta.json leaves the entry intact
+    with open(os.path.join(path, "meta.json.tmp"), "w", encoding="utf-8") as f:
+        f.write('{"rows": 10')
+    pd.testing.assert_frame_equal(columnar.load("AAAA.JK", "1d"), hist.iloc[:60], check_freq=False)
+    assert columnar.signature("AAAA.JK", "1d") == signature
+
+    columnar.append("AAAA.JK", "1d", hist, hist.iloc[60:])
+    assert columnar.signature("AAAA.JK", "1d") != signature
+    pd.testing.assert_frame_equal(columnar.load("AAAA.JK", "1d"), hist, check_freq=False)
+
+
+def test_columns_shorter_than_meta_are_rejected(backends):
+    columnar, _ = backends
+    columnar.save("AAAA.JK", "1d", _history())
+    column = os.path.join(columnar.path("AAAA.JK", "1d"), "c3.f8")
+    with open(column, "r+b") as f:
+        f.truncate(8 * 59)
+    assert columnar.load("AAAA.JK", "1d") is None
+
+
+def test_intraday_time_zone_round_trips(backends):
+    columnar, _ = backends
+    index = pd.date_range("2026-10-16 09:00", periods=20, freq="15min", tz="Asia/Jakarta", name="Datetime")
+    hist = pd.DataFrame({"Close": np.arange(20.0), "Volume": np.arange(20)}, index=index)
+    columnar.save("AAAA.JK", "15m", hist)
+    pd.testing.assert_frame_equal(columnar.load("AAAA.JK", "15m"), hist, check_freq=False)
+
+
+def test_migrate_csv_cache(tmp_path):
+    root = str(tmp_path / "cache")
+    csv = CsvCache(root)
+    hist = _history(80)
+    csv.save("AAAA.JK", "1d", hist)
+    # Per-period entries of older versions are merged, the freshest bar wins
+    older, newer = hist.iloc[:60].copy(), hist.iloc[40:].copy()
+    older.iloc[-1, older.columns.get_loc("Close")] = -1.0
+    older.to_csv(os.path.join(root, "BBBB.JK_5y_1d.csv"))
+    newer.to_csv(os.path.join(root, "BBBB.JK_1y_1d.csv"))
+    expected = CsvCache(str(tmp_path / "reference"))
+    expected.save("BBBB.JK", "1d", hist)
+
+    assert migrate_cache(root, remove=True) == 2
+    columnar = ColumnarCache(root)
+    pd.testing.assert_frame_equal(columnar.load("AAAA.JK", "1d"), expected.load("BBBB.JK", "1d"), check_freq=False)
+    pd.testing.assert_frame_equal(columnar.load("BBBB.JK", "1d"), expected.load("BBBB.JK", "1d"), check_freq=False)
+    assert sorted(name for name in os.listdir(root)) == ["AAAA.JK_1d", "BBBB.JK_1d"]
+    # Nothing left to do the second time
+    assert migrate_cache(root) == 0
+
+
+def test_columnar_backend_picks_up_csv_entries(tmp_path):
+    root = str(tmp_path / "cache")
+    CsvCache(root).save("AAAA.JK", "1d", _history())
+    columnar = ColumnarCache(root)
+    loaded = columnar.load("AAAA.JK", "1d")
+    pd.testing.assert_frame_equal(loaded, CsvCache(root).load("AAAA.JK", "1d"), check_freq=False)
+    assert os.path.exists(os.path.join(columnar.path("AAAA.JK", "1d"), "meta.json"))
@@ -0,0 +1,103 @@
+"""History downloads, range queries and the in-process history cache, against the offline market."""
+import pandas as pd
+
+import data
+from indicators import add_ma20_ma50_for_close
+
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+def test_cold_download_is_not_the_shared_frame(market):
+    hist = data.download_history("BBCA.JK", "1y")
+    add_ma20_ma50_for_close(hist)
+    hist["X"] = 1.0
+
+    again = data.download_history("BBCA.JK", "1y")
+    assert list(again.columns) == COLUMNS
+    again["Y"] = 1.0
+    assert list(data.download_history("BBCA.JK", "1y").columns) == COLUMNS
+
+
+def test_top_up_is_not_the_shared_frame(market):
+    today = market.last_day
+    market.last_day = today - pd.Timedelta(days=3)
+    data.download_history("BBCA.JK", "max")
+    market.last_day = today
+
+    hist = data.download_history("BBCA.JK", "max")
+    assert hist.index[-1] == today
+    add_ma20_ma50_for_close(hist)
+
+    again = data.download_history("BBCA.JK", "max")
+    assert list(again.columns) == COLUMNS
+    assert again.index[-1] == today
+    # The second read came from the cache, not another download
+    assert len(market.calls) == 2
+
+
+def test_download_histories_matches_market(market):
+    found = data.download_histories(["AAAA.JK", "BBBB.JK"], "1y")
+    assert list(found) == ["AAAA.JK", "BBBB.JK"]
+    for symbol, hist in found.items():
+        expected = market.bars(symbol)
+        expected = expected[expected.index >= hist.index[0]]
+        pd.testing.assert_frame_equal(hist[COLUMNS], expected[COLUMNS], check_freq=False)
+
+
+def _expected(market, symbol, start=None, end=None):
+    bars = market.bars(symbol)[COLUMNS]
+    return bars[(bars.index >= (start or bars.index[0])) & (bars.index <= (end or bars.index[-1]))]
+
+
+def test_get_range_downloads_only_the_head(market):
+    first = data.download_history("AAAA.JK", "1y").index[0]
+    start = first - pd.Timedelta(days=100)
+
+    hist = data.get_range("AAAA.JK", start)
+    head = market.calls[-1]
+    assert len(market.calls) == 2
+    assert (head["start"], head["end"], head["period"]) == (start, first, None)
+    pd.testing.assert_frame_equal(hist[COLUMNS], _expected(market, "AAAA.JK", start), check_freq=False)
+
+    # Anything inside the cached range is served without a download
+    inner = data.get_range("AAAA.JK", start + pd.Timedelta(days=10), start + pd.Timedelta(days=40))
+    assert len(market.calls) == 2
+    assert (inner.index[0], inner.index[-1]) == (start + pd.Timedelta(days=10), start + pd.Timedelta(days=40))
+
+    # The period keeps starting where it did the first time
+    assert data.download_history("AAAA.JK", "1y").index[0] == first
+    assert len(market.calls) == 2
+
+
+def test_get_range_tops_up_the_tail(market):
+    today = market.last_day
+    start = today - pd.Timedelta(days=50)
+    market.last_day = today - pd.Timedelta(days=5)
+    data.get_range("AAAA.JK", start)
+    assert market.calls[-1]["start"] == start
+    market.last_day = today
+
+    # Ending before the last cached bar: nothing to fetch
+    hist = data.get_range("AAAA.JK", start, today - pd.Timedelta(days=10))
+    assert len(market.calls) == 1 and hist.index[-1] == today - pd.Timedelta(days=10)
+
+    hist = data.get_range("AAAA.JK", start)
+    # From the day after the last cached bar
+    assert len(market.calls) == 2
+    assert market.calls[-1]["start"] == today - pd.Timedelta(days=4)
+    pd.testing.assert_frame_equal(hist[COLUMNS], _expected(market, "AAAA.JK", start), check_freq=False)
+
+
+def test_get_range_from_the_first_bar(market):
+    data.download_history("AAAA.JK", "1y")
+    hist = data.get_range("AAAA.JK", None)
+    assert market.calls[-1]["period"] == "max"
+    pd.testing.assert_frame_equal(hist[COLUMNS], _expected(market, "AAAA.JK"), check_freq=False)
+
+    # The whole history is cached now, whatever is asked for
+    calls = len(market.calls)
+    assert data.get_range("AAAA.JK", None).index[0] == hist.index[0]
+    assert data.download_history("AAAA.JK", "5y").index[0] == hist.index[0]
+    assert len(market.calls) == calls
+    market.unavailable.add("GONE.JK")
+    assert data.get_range("GONE.JK", "2026-01-01") is None
@@ -0,0 +1,165 @@
+"""FetchPool against stub downloaders: retries, timeouts, splitting and pacing."""
+import threading
+import time
+
+import pandas as pd
+
+from data.fetch import FetchPool, FetchReport, FetchTask, TokenBucket
+from data.history import _split_batch
+
+
+def _frame():
+    return pd.DataFrame({"Close": [1.0]}, index=pd.DatetimeIndex(["2026-10-16"], name="Date"))
+
+
+class Downloader:
+    """Returns symbol -> frame; ``fail`` maps a symbol to the number of calls that raise."""
+
+    def __init__(self, fail=None, broken=(), slow=(), empty=()):
+        self.fail = dict(fail or {})
+        self.broken = set(broken)
+        self.slow = set(slow)
+        self.empty = set(empty)
+        self.calls = []
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, symbols, **kwargs):
+        symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        with self._lock:
+            self.calls.append((tuple(symbols), time.monotonic()))
+            failing = [s for s in symbols if self.fail.get(s, 0) > 0]
+            for symbol in failing:
+                self.fail[symbol] -= 1
+        if set(symbols) & self.slow:
+            self.released.wait(5)
+        if failing or set(symbols) & self.broken:
+            raise RuntimeError(f"download failed for {symbols}")
+        return {symbol: _frame() for symbol in symbols if symbol not in self.empty}
+
+
+def _pool(downloader, **options):
+    options = {"rate": 0, "backoff": 0.05, "timeout": 5.0, **options}
+    return FetchPool(downloader, lambda result, symbols: result, **options)
+
+
+def _run(pool, *tasks):
+    try:
+        return pool.run(list(tasks))
+    finally:
+        pool.downloader.released.set()
+
+
+def test_retries_with_backoff():
+    downloader = Downloader(fail={"AAAA.JK": 2})
+    frames, report = _run(_pool(downloader, retries=3), FetchTask(["AAAA.JK"], {"period": "1y"}))
+
+    assert list(frames) == ["AAAA.JK"] and report.ok
+    assert (report.calls, report.retries) == (3, 2)
+    # Waits of at least 0.05 s and then 0.1 s between the attempts
+    times = [t for _, t in downloader.calls]
+    assert times[1] - times[0] >= 0.05
+    assert times[2] - times[1] >= 0.1
+
+
+def test_gives_up_after_the_last_attempt():
+    downloader = Downloader(broken=["AAAA.JK"])
+    frames, report = _run(_pool(downloader, retries=2, backoff=0.01), FetchTask(["AAAA.JK"], {}))
+
+    assert frames == {} and not report.ok
+    assert len(downloader.calls) == 2
+    [failure] = report.failures
+    assert (failure.symbol, failure.reason, failure.attempts) == ("AAAA.JK", "error", 2)
+    assert "download failed" in failure.error
+
+
+def test_times_out_slow_calls():
+    downloader = Downloader(slow=["SLOW.JK"])
+    tasks = [FetchTask(["SLOW.JK"], {}), FetchTask(["FAST.JK"], {})]
+    started = time.monotonic()
+    frames, report = _run(_pool(downloader, retries=2, backoff=0.01, timeout=0.1), *tasks)
+
+    assert time.monotonic() - started < 2
+    assert list(frames) == ["FAST.JK"]
+    [failure] = report.failures
+    assert (failure.symbol, failure.reason, failure.attempts) == ("SLOW.JK", "timeout", 2)
+
+
+def test_failed_batch_is_split_into_single_symbols():
+    downloader = Downloader(broken=["BAD.JK"])
+    task = FetchTask(["AAAA.JK", "BAD.JK", "CCCC.JK"], {"period": "1y"})
+    frames, report = _run(_pool(downloader, retries=3, backoff=0.01), task)
+
+    assert sorted(frames) == ["AAAA.JK", "CCCC.JK"]
+    assert [f.symbol for f in report.failures] == ["BAD.JK"]
+    batches = [symbols for symbols, _ in downloader.calls]
+    assert batches[0] == ("AAAA.JK", "BAD.JK", "CCCC.JK")
+    assert sorted(batches[1:4]) == [("AAAA.JK",), ("BAD.JK",), ("CCCC.JK",)]
+    # The split counts as the batch's first retry; BAD.JK then has one more
+    assert batches[4:] == [("BAD.JK",)]
+    assert (report.calls, report.retries) == (5, 4)
+    assert report.failures[0].attempts == 3
+
+
+def test_empty_results():
+    downloader = Downloader(empty=["NONE.JK"])
+    tasks = [FetchTask(["NONE.JK"], {}), FetchTask(["NONE.JK"], {"start": "2026-10-16"}, required=False)]
+    frames, report = _run(_pool(downloader), *tasks)
+
+    assert frames == {}
+    # Only the required task reports the missing data; neither is retried
+    assert [(f.symbol, f.reason) for f in report.failures] == [("NONE.JK", "empty")]
+    assert (report.calls, report.retries) == (2, 0)
+
+
+def test_token_bucket_paces_calls():
+    bucket = TokenBucket(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # Two calls from the burst, the other four at 20 per second
+    assert time.monotonic() - started >= 4 / 20 * 0.9
+
+
+def test_pool_respects_the_rate():
+    downloader = Downloader()
+    tasks = [FetchTask([f"S{i}.JK"], {}) for i in range(5)]
+    frames, report = _run(_pool(downloader, rate=25, burst=1, max_workers=5), *tasks)
+
+    assert len(frames) == 5 and report.calls == 5
+    times = sorted(t for _, t in downloader.calls)
+    assert times[-1] - times[0] >= 4 / 25 * 0.9
+
+
+def test_report_contents():
+    downloader = Downloader(fail={"AAAA.JK": 1}, broken=["BAD.JK"])
+    tasks = [FetchTask(["AAAA.JK"], {}), FetchTask(["BAD.JK"], {}), FetchTask(["CCCC.JK"], {})]
+    _, report = _run(_pool(downloader, retries=2, backoff=0.01), *tasks)
+
+    summary = report.to_dict()
+    assert summary["fetched"] == 2 and summary["calls"] == 5 and summary["retries"] == 2
+    assert summary["failures"] == [
+        {
+            "symbol": "BAD.JK",
+            "reason": "error",
+            "attempts": 2,
+            "error": repr(RuntimeError("download failed for ['BAD.JK']")),
+        }
+    ]
+    assert summary["duration"] >= 0
+
+    earlier = FetchReport()
+    earlier.fetched, earlier.calls, earlier.retries = ["XXXX.JK"], 1, 0
+    report.extend(earlier)
+    assert report.fetched[0] == "XXXX.JK" and report.calls == 6 and len(report.fetched) == 3
+
+
+def test_runs_offline_against_yfinance_shaped_frames(market):
+    # The splitter the data layer uses, on a stub with yf.download's layout
+    pool = FetchPool(market, _split_batch, rate=0, backoff=0.01)
+    market.unavailable.add("GONE.JK")
+    frames, report = pool.run([FetchTask(["AAAA.JK", "GONE.JK"], {"period": "1mo", "group_by": "ticker"})])
+
+    assert list(frames) == ["AAAA.JK"]
+    assert list(frames["AAAA.JK"].columns) == ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+    assert [(f.symbol, f.reason) for f in report.failures] == [("GONE.JK", "empty")]
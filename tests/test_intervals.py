@@ -0,0 +1,177 @@
+"""Intraday retention, resampling and calendar bars, at fixed times in exchange time."""
+import time
+
+import numpy as np
+import pandas as pd
+
+import data
+from data import history
+from data.cache import save_state
+from data.intervals import bucket_start, resample, trim
+
+WIB = "Asia/Jakarta"
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+def _bars(days, freq="15min", open_="09:00", close="16:00", tz=WIB):
+    """Intraday bars during the session of each of ``days`` (dates)."""
+    stamps = []
+    for day in days:
+        start = pd.Timestamp(f"{day} {open_}", tz=tz)
+        stamps.extend(pd.date_range(start, pd.Timestamp(f"{day} {close}", tz=tz), freq=freq, inclusive="left"))
+    index = pd.DatetimeIndex(stamps, name="Datetime")
+    price = 1000 + np.arange(len(index), dtype=float)
+    return pd.DataFrame(
+        {
+            "Open": price,
+            "High": price + 5,
+            "Low": price - 5,
+            "Close": price + 1,
+            "Adj Close": price + 1,
+            "Volume": np.arange(1, len(index) + 1, dtype=np.int64),
+        },
+        index=index,
+    )
+
+
+def test_trim_keeps_the_retention_window():
+    hist = _bars(pd.bdate_range("2026-07-01", "2026-10-16").date)
+    now = pd.Timestamp("2026-10-16 10:00", tz=WIB)
+    kept = trim(hist, "15m", now=now)
+
+    # 60 days back from now, rounded down to midnight
+    cutoff = pd.Timestamp("2026-08-17 00:00", tz=WIB)
+    assert kept.index[0] >= cutoff and kept.index[0].date() == cutoff.date()
+    pd.testing.assert_frame_equal(kept, hist[hist.index >= cutoff])
+
+
+def test_trim_cutoff_moves_once_a_day():
+    hist = _bars(pd.bdate_range("2026-07-01", "2026-10-16").date)
+    morning = trim(hist, "15m", now=pd.Timestamp("2026-10-16 00:01", tz=WIB))
+    evening = trim(hist, "15m", now=pd.Timestamp("2026-10-16 23:59", tz=WIB))
+    pd.testing.assert_frame_equal(morning, evening)
+    # Already trimmed: handed back as is
+    assert trim(morning, "15m", now=pd.Timestamp("2026-10-16 23:59", tz=WIB)) is morning
+
+
+def test_daily_bars_are_not_trimmed():
+    index = pd.date_range("2016-01-04", "2026-10-16", freq="D", name="Date")
+    hist = pd.DataFrame({"Close": np.arange(len(index), dtype=float)}, index=index)
+    assert trim(hist, "1d", now=pd.Timestamp("2026-10-16")) is hist
+
+
+def test_intraday_buckets_start_at_the_session_open():
+    # A session opening at 09:30 gives hourly bars at 09:30, 10:30, ...
+    hist = _bars(["2026-10-15", "2026-10-16"], freq="5min", open_="09:30", close="12:00")
+    hourly = resample(hist, "1h")
+
+    day = [pd.Timestamp(f"2026-10-15 {t}", tz=WIB) for t in ("09:30", "10:30", "11:30")]
+    assert list(hourly.index[:3]) == day
+    assert list(hourly.index[3:]) == [stamp + pd.Timedelta(days=1) for stamp in day]
+    assert hourly.index.name == "Datetime"
+
+    first = hist.iloc[:12]
+    assert hourly.iloc[0].to_dict() == {
+        "Open": first["Open"].iloc[0],
+        "High": first["High"].max(),
+        "Low": first["Low"].min(),
+        "Close": first["Close"].iloc[-1],
+        "Adj Close": first["Adj Close"].iloc[-1],
+        "Volume": first["Volume"].sum(),
+    }
+    # The last bucket of a day is short, and never takes bars of the next one
+    assert hourly.loc[day[2], "Volume"] == hist.iloc[24:30]["Volume"].sum()
+
+
+def test_last_bucket_is_partial():
+    hist = _bars(["2026-10-16"], freq="5min", open_="09:00", close="10:20")
+    quarters = resample(hist, "15m")
+    assert list(quarters.index.strftime("%H:%M")) == ["09:00", "09:15", "09:30", "09:45", "10:00", "10:15"]
+    assert quarters["Close"].iloc[-1] == hist["Close"].iloc[-1]
+    assert quarters["Volume"].iloc[-1] == hist["Volume"].iloc[-1]
+
+
+def test_coarser_interval_is_resampled_from_the_cache(market):
+    # A cached 5m history, fetched in full and topped up just now, serves
+    # 15m bars without a download
+    days = pd.bdate_range(end=pd.Timestamp.now(tz=WIB).normalize().tz_localize(None), periods=5).date
+    five = _bars(days, freq="5min")
+    backend = history.get_cache_backend()
+    backend.save("AAAA.JK", "5m", five)
+    save_state(backend, "AAAA.JK", "5m", "range", {"start": None, "periods": {}})
+    history._top_ups[("AAAA.JK", "5m")] = time.time()
+
+    found = data.download_histories(["AAAA.JK"], "60d", "15m")
+    pd.testing.assert_frame_equal(found["AAAA.JK"][COLUMNS], resample(five, "15m")[COLUMNS], check_freq=False)
+    assert market.calls == []
+
+
+def test_bucket_labels():
+    dates = pd.DatetimeIndex(
+        ["2026-10-11", "2026-10-12 09:30", "2026-10-16 15:59", "2026-10-17", None, "2026-01-01"]
+    ).to_numpy()
+    weeks = pd.DatetimeIndex(bucket_start(dates, "1wk"))
+    months = pd.DatetimeIndex(bucket_start(dates, "1mo"))
+    days = pd.DatetimeIndex(bucket_start(dates, "1d"))
+
+    # Weeks start on Monday, also across a year end
+    assert list(weeks.strftime("%Y-%m-%d")[[0, 1, 2, 3, 5]]) == [
+        "2026-10-05", "2026-10-12", "2026-10-12", "2026-10-12", "2025-12-29"
+    ]
+    assert list(months.strftime("%Y-%m-%d")[[0, 1, 2, 3, 5]]) == [
+        "2026-10-01", "2026-10-01", "2026-10-01", "2026-10-01", "2026-01-01"
+    ]
+    assert days[1] == pd.Timestamp("2026-10-12") and days[2] == pd.Timestamp("2026-10-16")
+    assert weeks[4] is pd.NaT and months[4] is pd.NaT
+
+
+def _daily(start, end, tz=None):
+    index = pd.bdate_range(start, end, name="Date", tz=tz)
+    price = np.arange(1.0, len(index) + 1)
+    columns = {"Open": price, "High": price + 1, "Low": price - 1, "Close": price, "Volume": price}
+    return pd.DataFrame(columns, index=index)
+
+
+def test_weekly_and_monthly_bars_are_labelled_with_their_first_day():
+    # No bar on Monday 2026-10-05 or on Thursday 2026-10-01
+    daily = _daily("2026-09-21", "2026-10-16").drop(pd.to_datetime(["2026-10-05", "2026-10-01"]))
+    weekly = resample(daily, "1wk")
+    assert list(weekly.index.strftime("%Y-%m-%d")) == ["2026-09-21", "2026-09-28", "2026-10-05", "2026-10-12"]
+    week = daily.loc["2026-10-06":"2026-10-09"]
+    assert weekly.loc["2026-10-05"].to_dict() == {
+        "Open": week["Open"].iloc[0],
+        "High": week["High"].max(),
+        "Low": week["Low"].min(),
+        "Close": week["Close"].iloc[-1],
+        "Volume": week["Volume"].sum(),
+    }
+
+    monthly = resample(daily, "1mo")
+    assert list(monthly.index.strftime("%Y-%m-%d")) == ["2026-09-01", "2026-10-01"]
+    assert monthly["Open"].iloc[1] == daily.loc["2026-10-02", "Open"]
+
+
+def test_calendar_bars_keep_the_time_zone():
+    daily = _daily("2026-09-01", "2026-10-16", tz=WIB)
+    weekly = resample(daily, "1wk")
+    assert str(weekly.index.tz) == WIB
+    assert weekly.index[-1] == pd.Timestamp("2026-10-12", tz=WIB)
+
+
+def test_weekly_bars_are_derived_from_the_daily_cache(market):
+    tickers = ["AAAA.JK", "BBBB.JK"]
+    weekly = data.download_histories(tickers, "1y", "1wk")
+    assert {call["interval"] for call in market.calls} == {"1d"}
+    for symbol in tickers:
+        daily = data.download_histories([symbol], "1y")[symbol]
+        pd.testing.assert_frame_equal(weekly[symbol], resample(daily, "1wk"), check_freq=False)
+
+    # New daily bars update the open week and add new ones; still no weekly download
+    market.last_day += pd.Timedelta(days=9)
+    weekly = data.download_histories(tickers, "1y", "1wk")
+    monthly = data.download_histories(tickers, "1y", "1mo")
+    assert {call["interval"] for call in market.calls} == {"1d"}
+    for symbol in tickers:
+        daily = data.download_histories([symbol], "1y")[symbol]
+        pd.testing.assert_frame_equal(weekly[symbol], resample(daily, "1wk"), check_freq=False)
+        pd.testing.assert_frame_equal(monthly[symbol], resample(daily, "1mo"), check_freq=False)
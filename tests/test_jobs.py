@@ -0,0 +1,152 @@
+"""Chunked scans and the scan job manager."""
+import threading
+import time
+from datetime import date
+
+import pytest
+
+import data
+import jobs
+from results import ResultBatch, concat
+from scanners import mode_layout, run_mode
+
+TICKERS = [f"S{i:03d}.JK" for i in range(120)]
+
+
+def _count_builds(monkeypatch):
+    builds = []
+    build_panel = data.build_panel
+
+    def counting(path, histories, unavailable=()):
+        builds.append(sorted(histories))
+        return build_panel(path, histories, unavailable)
+
+    monkeypatch.setattr(data, "build_panel", counting)
+    return builds
+
+
+def test_cold_scan_builds_the_panel_once(market, monkeypatch):
+    builds = _count_builds(monkeypatch)
+    steps = list(jobs.iter_scan("4", TICKERS, chunk_size=50))
+
+    assert len(builds) == 1 and builds[0] == sorted(TICKERS)
+    # Three fetch steps, then one step per evaluated chunk
+    assert [processed for processed, _, _ in steps] == [50, 100, 120, 120, 120, 120]
+    assert not any(cached for _, _, cached in steps)
+    assert sorted(market.symbols_fetched()) == sorted(TICKERS)
+
+    found = concat([batch for _, batch, _ in steps]).records()
+    assert found == run_mode("4", TICKERS).records()
+
+
+def test_warm_scan_skips_the_fetch_steps(market, monkeypatch):
+    data.load_panel(TICKERS, "1y")
+    builds = _count_builds(monkeypatch)
+    calls = len(market.calls)
+
+    steps = list(jobs.iter_scan("1", TICKERS, chunk_size=50))
+    assert [processed for processed, _, _ in steps] == [120, 120, 120]
+    assert not builds and len(market.calls) == calls
+
+    # Stored once the last chunk is done, then served as one cached step
+    again = list(jobs.iter_scan("1", TICKERS, chunk_size=50))
+    assert len(again) == 1 and again[0][0] == 120 and again[0][2]
+    assert again[0][1].records() == concat([batch for _, batch, _ in steps]).records()
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Stubs out the scan itself; set ``release`` to let running scans finish."""
+    calls = []
+    release = threading.Event()
+
+    def run_mode(mode, tickers, label="", rule=None, interval="1d"):
+        calls.append((mode, tuple(tickers), interval))
+        release.wait(5)
+        if "FAIL.JK" in tickers:
+            raise RuntimeError("scan failed")
+        rows = [(symbol, 1.0, date(2026, 10, 16)) for symbol in tickers]
+        return ResultBatch.from_rows(mode_layout("1")["fields"], rows)
+
+    monkeypatch.setattr(jobs, "run_mode", run_mode)
+    monkeypatch.setattr(jobs, "peek_result", lambda *args, **kwargs: None)
+    monkeypatch.setattr(jobs, "store_result", lambda *args, **kwargs: None)
+    monkeypatch.setattr(jobs, "is_panel_fresh", lambda *args, **kwargs: True)
+    yield calls, release
+    release.set()
+
+
+def _wait(job):
+    deadline = time.monotonic() + 5
+    while job.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not job.active
+
+
+def test_identical_submissions_share_a_job(scans):
+    calls, release = scans
+    manager = jobs.JobManager(max_workers=2)
+    job = manager.submit("1", ["AAAA.JK", "BBBB.JK"])
+    assert manager.submit("1", ["AAAA.JK", "BBBB.JK"]) is job
+    # Another mode, rule, interval or universe is a different scan
+    others = [
+        manager.submit("2", ["AAAA.JK", "BBBB.JK"]),
+        manager.submit("1", ["AAAA.JK"]),
+        manager.submit(None, ["AAAA.JK", "BBBB.JK"], rule="close > sma(20)"),
+        manager.submit("1", ["AAAA.JK", "BBBB.JK"], interval="1wk"),
+    ]
+    assert len({id(job)} | {id(other) for other in others}) == 5
+
+    release.set()
+    for submitted in [job] + others:
+        _wait(submitted)
+    assert job.state == "done", job.error
+    assert [row["symbol"] for row in job.results] == ["AAAA.JK", "BBBB.JK"]
+    assert calls.count(("1", ("AAAA.JK", "BBBB.JK"), "1d")) == 1
+
+    # Once finished, the same scan runs again
+    again = manager.submit("1", ["AAAA.JK", "BBBB.JK"])
+    assert again is not job
+    _wait(again)
+    assert calls.count(("1", ("AAAA.JK", "BBBB.JK"), "1d")) == 2
+
+
+def test_failed_scan_reports_the_error(scans):
+    _, release = scans
+    release.set()
+    manager = jobs.JobManager()
+    job = manager.submit("1", ["AAAA.JK", "FAIL.JK"])
+    _wait(job)
+
+    assert job.state == "error" and job.finished is not None
+    assert "scan failed" in job.error
+    assert job.to_dict()["error"] == job.error
+    assert manager.submit("1", ["AAAA.JK", "FAIL.JK"]) is not job
+
+
+def test_prune_drops_expired_and_oldest_finished_jobs(scans):
+    _, release = scans
+    manager = jobs.JobManager(max_jobs=3, ttl=60)
+    running = manager.submit("1", ["RUN.JK"])
+    finished = []
+    for symbol in ("A.JK", "B.JK"):
+        job = jobs.ScanJob("1", [symbol])
+        job.state, job.finished = "done", time.time()
+        manager._jobs[job.id] = job
+        finished.append(job)
+    finished[0].finished -= 120  # expired
+
+    with manager._lock:
+        manager._prune()
+    assert manager.get(finished[0].id) is None
+    assert manager.get(finished[1].id) is finished[1]
+
+    # At max_jobs the oldest finished job makes room; running jobs stay
+    manager._jobs[finished[0].id] = finished[0]
+    finished[0].finished = time.time()
+    manager.submit("1", ["NEW.JK"])
+    assert manager.get(running.id) is running
+    assert manager.get(finished[1].id) is None
+    assert len(manager._jobs) == 3
+    release.set()
+    _wait(running)
@@ -0,0 +1,166 @@
+"""Parity of the array kernels with the pandas indicators.
+
+Every kernel must match ``indicators`` bit for bit (``np.array_equal`` with
+``equal_nan=True``) on both backends: the NumPy row kernels and, when numba
+is installed, the compiled column loops.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+import kernels
+
+try:
+    import numba
+except ImportError:  # optional dependency
+    numba = None
+
+WINDOWS = (1, 2, 5, 14, 20, 50)
+
+
+_compiled = []
+
+
+def _backend_impls(name):
+    if name == "numpy":
+        return kernels._rolling_mean_rows, kernels._rolling_std_rows, kernels._ema_rows
+    if numba is None:
+        pytest.skip("numba is not installed")
+    if not _compiled:
+        loops = (kernels._rolling_mean_loop, kernels._rolling_std_loop, kernels._ema_loop)
+        _compiled.extend(numba.njit(loop) for loop in loops)
+    return tuple(_compiled)
+
+
+@pytest.fixture(params=["numpy", "numba"])
+def backend(request, monkeypatch):
+    mean, std, ema = _backend_impls(request.param)
+    monkeypatch.setattr(kernels, "_rolling_mean_impl", mean)
+    monkeypatch.setattr(kernels, "_rolling_std_impl", std)
+    monkeypatch.setattr(kernels, "_ema_impl", ema)
+    return request.param
+
+
+def _walk(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, rows)))
+
+
+def _series_cases():
+    walk = _walk(300)
+    gaps = walk.copy()
+    gaps[[10, 11, 12, 40, 120, 121, 299]] = np.nan
+    leading = walk.copy()
+    leading[:37] = np.nan
+    flat = np.full(120, 1500.0)
+    tied = np.round(walk / 50) * 50
+    steps = np.repeat([100.0, 105.0, 100.0, 95.0], 30)
+    return {
+        "walk": walk,
+        "gaps": gaps,
+        "leading_nan": leading,
+        "flat": flat,
+        "tied": tied,
+        "steps": steps,
+        "short": walk[:7],
+        "all_nan": np.full(30, np.nan),
+    }
+
+
+CASES = _series_cases()
+
+
+@pytest.fixture(params=sorted(CASES))
+def series(request):
+    return CASES[request.param]
+
+
+def _panel():
+    # dates x symbols with ragged starts and gaps, like a right-aligned panel
+    columns = [CASES["walk"], CASES["gaps"], CASES["leading_nan"], CASES["tied"], _walk(300, seed=1)]
+    return np.column_stack(columns)
+
+
+def assert_same(actual, expected):
+    expected = np.asarray(expected, dtype=np.float64)
+    assert actual.shape == expected.shape
+    assert np.array_equal(actual, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize("window", WINDOWS + (400,))
+def test_sma(backend, series, window):
+    assert_same(kernels.sma(series, window), indicators.sma(pd.Series(series), window))
+
+
+@pytest.mark.parametrize("window", WINDOWS + (400,))
+def test_rolling_std(backend, series, window):
+    expected = pd.Series(series).rolling(window).std()
+    assert_same(kernels.rolling_std(series, window), expected)
+    assert_same(kernels.bollinger_width(series, window), indicators.bollinger_width(pd.Series(series), window))
+
+
+@pytest.mark.parametrize("window", WINDOWS + (400,))
+def test_llv(series, window):
+    expected = pd.Series(series).rolling(window).min()
+    actual = kernels.rolling_min(series, window)
+    assert_same(actual, expected)
+    # llv_prev is the same window shifted by one bar
+    shifted = np.concatenate([[np.nan], actual[:-1]])
+    assert_same(shifted, indicators.llv_prev(pd.Series(series), window))
+    assert_same(kernels.rolling_max(series, window), pd.Series(series).rolling(window).max())
+
+
+@pytest.mark.parametrize("span", (2, 9, 12, 26, 400))
+def test_ema(backend, series, span):
+    expected = pd.Series(series).ewm(span=span, adjust=False).mean()
+    assert_same(kernels.ema(series, span), expected)
+
+
+def test_macd(backend, series):
+    for actual, expected in zip(kernels.macd(series), indicators.macd(pd.Series(series))):
+        assert_same(actual, expected)
+
+
+@pytest.mark.parametrize("period", (2, 14, 400))
+def test_rsi(backend, series, period):
+    assert_same(kernels.rsi(series, period), indicators.rsi(pd.Series(series), period))
+
+
+def test_sma_many_exact_on_integer_prices():
+    # Sums of integer prices are exact, so the cumulative-sum SMAs match
+    # pandas bit for bit; gaps and leading NaNs included
+    prices = np.round(_panel())
+    windows = WINDOWS + (400,)
+    out = kernels.sma_many(prices, windows)
+    for window in windows:
+        assert_same(out[window], pd.DataFrame(prices).rolling(window).mean())
+    flat = kernels.sma_many(prices[:, 1], windows)
+    for window in windows:
+        assert_same(flat[window], pd.Series(prices[:, 1]).rolling(window).mean())
+
+
+def test_sma_many_matches_sma(backend):
+    # On arbitrary floats the uncompensated running sum only agrees up to
+    # rounding, but which bars are defined (not NaN) must match exactly
+    values = _panel()
+    out = kernels.sma_many(values, WINDOWS)
+    for window in WINDOWS:
+        expected = kernels.sma(values, window)
+        assert np.array_equal(np.isnan(out[window]), np.isnan(expected))
+        assert np.allclose(out[window], expected, rtol=1e-12, atol=0, equal_nan=True)
+
+
+def test_panel_matches_columns(backend):
+    # 2-D input is the 1-D kernel applied to each column
+    values = _panel()
+    frame = pd.DataFrame(values)
+    assert_same(kernels.sma(values, 20), frame.rolling(20).mean())
+    assert_same(kernels.rolling_std(values, 20), frame.rolling(20).std())
+    assert_same(kernels.rolling_min(values, 5), frame.rolling(5).min())
+    assert_same(kernels.ema(values, 12), frame.ewm(span=12, adjust=False).mean())
+    for actual, expected in zip(kernels.macd(values), indicators.macd(frame)):
+        assert_same(actual, expected)
+    assert_same(kernels.rsi(values, 14), indicators.rsi(frame, 14))
@@ -0,0 +1,145 @@
+"""Incremental Mode 4 state against the full pandas computation."""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+from data import load_panel
+from indicators import Mode4State, add_mode4_indicators
+
+TICKERS = [f"M{i:02d}.JK" for i in range(40)]
+
+
+def _history(rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end="2026-10-16", periods=rows, name="Date")
+    close = 1000 * np.exp(np.cumsum(rng.normal(0.001, 0.02, rows)))
+    volume = rng.integers(1e5, 1e7, rows).astype(float)
+    hist = pd.DataFrame({"Close": close, "Volume": volume}, index=index)
+    hist.iloc[[30, 31, 250], 0] = np.nan  # gaps in the prices
+    return hist
+
+
+def _assert_matches_full(state, hist):
+    full = add_mode4_indicators(hist.copy()).dropna()
+    assert state.valid_rows == len(full)
+    last = full.iloc[-1]
+    for name in ("Close", "Volume") + Mode4State.FEATURES:
+        assert state.latest[name] == last[name], name
+    assert state.latest["Date"] == full.index[-1].value
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_state_matches_full_computation(seed):
+    hist = _history(seed=seed)
+    state = Mode4State()
+    state.advance(hist)
+    _assert_matches_full(state, hist)
+
+
+def test_append():
+    hist = _history()
+    state = Mode4State()
+    state.advance(hist.iloc[:300])
+    assert state.matches(hist)
+    assert state.advance(hist) == 100
+    _assert_matches_full(state, hist)
+
+
+def test_json_round_trip_then_append():
+    hist = _history()
+    state = Mode4State()
+    state.advance(hist.iloc[:300])
+    restored = Mode4State.from_dict(json.loads(json.dumps(state.to_dict())))
+    assert restored.matches(hist)
+    restored.advance(hist)
+    _assert_matches_full(restored, hist)
+
+
+def test_rewritten_history_does_not_match():
+    hist = _history()
+    state = Mode4State()
+    state.advance(hist.iloc[:300])
+
+    revised = hist.copy()
+    revised.iloc[299, 0] += 1  # the last bar seen was partial
+    assert not state.matches(revised)
+    assert not state.matches(hist.iloc[1:])  # history starts later
+    assert not state.matches(hist.iloc[:200])  # shorter than what was seen
+
+
+@pytest.fixture
+def count_rebuilds(monkeypatch):
+    # Fresh states are constructed; restored ones come from from_dict
+    built = []
+
+    class Counted(Mode4State):
+        def __init__(self):
+            built.append(1)
+            super().__init__()
+
+    monkeypatch.setattr(engine, "Mode4State", Counted)
+    return built
+
+
+def test_state_is_persisted_and_reloaded(market, count_rebuilds):
+    hist = _history()
+    engine._mode4_state("AAAA.JK", "1y", "1d", hist.iloc[:300])
+    assert len(count_rebuilds) == 1
+
+    # A new process: only the persisted JSON is left
+    engine.clear_mode4_states()
+    state = engine._mode4_state("AAAA.JK", "1y", "1d", hist)
+    assert len(count_rebuilds) == 1
+    _assert_matches_full(state, hist)
+
+
+def test_rewritten_history_resets_the_state(market, count_rebuilds):
+    hist = _history()
+    engine._mode4_state("AAAA.JK", "1y", "1d", hist)
+
+    revised = hist.copy()
+    revised.iloc[100, 0] *= 1.5
+    revised = revised.iloc[20:]
+    engine.clear_mode4_states()
+    state = engine._mode4_state("AAAA.JK", "1y", "1d", revised)
+    assert len(count_rebuilds) == 2
+    _assert_matches_full(state, revised)
+
+
+def _full_pandas(tickers):
+    # mode4_combo_incremental's result, computed with add_mode4_indicators
+    panel = load_panel(tickers, "1y")
+    rows = []
+    for symbol in tickers:
+        full = add_mode4_indicators(panel.history(symbol).copy()).dropna()
+        if len(full) < 20:
+            continue
+        last = full.iloc[-1]
+        value = last["Close"] * last["Volume"]
+        if last["Close"] > last["SMA50"] > last["SMA150"] > last["SMA200"] and value >= 1e9:
+            sma = [float(last[f"SMA{period}"]) for period in (20, 50, 150, 200)]
+            rows.append((symbol, float(last["Close"]), *sma, float(value), float(last["RSI14"]), full.index[-1].date()))
+    return rows
+
+
+def test_scanner_matches_full_computation(market):
+    expected = _full_pandas(TICKERS)
+    assert expected
+    assert engine.mode4_combo_incremental(TICKERS, period="1y") == expected
+    # The rule evaluator finds the same symbols
+    wide = engine.load_wide(TICKERS, period="1y", fields=("Close", "Volume"))
+    assert [row[0] for row in engine.mode4_combo(wide)] == [row[0] for row in expected]
+
+    # Three more bars, fed through the states held in memory
+    market.last_day += pd.Timedelta(days=3)
+    load_panel(TICKERS, "1y", refresh=True)
+    assert engine.mode4_combo_incremental(TICKERS, period="1y") == _full_pandas(TICKERS)
+
+    # ... and through the persisted ones
+    market.last_day += pd.Timedelta(days=2)
+    load_panel(TICKERS, "1y", refresh=True)
+    engine.clear_mode4_states()
+    assert engine.mode4_combo_incremental(TICKERS, period="1y") == _full_pandas(TICKERS)
@@ -0,0 +1,87 @@
+"""Panel freshness around the daily session close."""
+import json
+
+import pandas as pd
+import pytest
+
+import data
+from data import panel as panel_module
+from data.panel import build_panel, open_panel
+
+WIB = "Asia/Jakarta"
+
+
+def _panel(tmp_path, built_at, unavailable=()):
+    index = pd.date_range("2026-09-01", "2026-10-14", freq="D", name="Date")
+    hist = pd.DataFrame({"Close": range(len(index))}, index=index, dtype=float)
+    path = str(tmp_path / "panel_1y_1d.json")
+    build_panel(path, {"AAAA.JK": hist}, unavailable)
+    with open(path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta["built_at"] = pd.Timestamp(built_at).isoformat()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return open_panel(path)
+
+
+def _at(text, tz=WIB):
+    return pd.Timestamp(text, tz=tz)
+
+
+@pytest.mark.parametrize(
+    "built, now, fresh",
+    [
+        # 2026-10-14 is a Wednesday; the session closes at 16:00 WIB
+        ("2026-10-14 10:00", "2026-10-14 15:59", True),
+        ("2026-10-14 10:00", "2026-10-14 16:00", False),
+        ("2026-10-14 10:00", "2026-10-15 09:00", False),
+        ("2026-10-14 16:30", "2026-10-15 09:00", True),
+        ("2026-10-14 16:30", "2026-10-15 16:01", False),
+        # Friday's prewarm stays fresh over the weekend until Monday's close
+        ("2026-10-16 16:30", "2026-10-18 12:00", True),
+        ("2026-10-16 16:30", "2026-10-19 15:00", True),
+        ("2026-10-16 16:30", "2026-10-19 16:00", False),
+    ],
+)
+def test_daily_panel_is_fresh_until_the_next_close(tmp_path, built, now, fresh):
+    assert _panel(tmp_path, _at(built)).is_fresh(["AAAA.JK"], now=_at(now)) is fresh
+
+
+def test_build_time_zone_does_not_matter(tmp_path):
+    # Built at 16:30 WIB by a server running on UTC
+    panel = _panel(tmp_path, _at("2026-10-14 09:30", tz="UTC"))
+    assert panel.is_fresh(["AAAA.JK"], now=_at("2026-10-15 10:00"))
+    assert not panel.is_fresh(["AAAA.JK"], now=_at("2026-10-15 16:00"))
+
+
+def test_intraday_panel_is_fresh_for_one_bar(tmp_path):
+    panel = _panel(tmp_path, _at("2026-10-14 10:00"))
+    bar = pd.Timedelta(minutes=15)
+    assert panel.is_fresh(["AAAA.JK"], bar, now=_at("2026-10-14 10:14"))
+    assert not panel.is_fresh(["AAAA.JK"], bar, now=_at("2026-10-14 10:15"))
+
+
+def test_fresh_panel_must_cover_the_symbols(tmp_path):
+    panel = _panel(tmp_path, _at("2026-10-14 16:30"), unavailable=["GONE.JK"])
+    now = _at("2026-10-15 09:00")
+    assert panel.is_fresh(["AAAA.JK", "GONE.JK"], now=now)
+    assert not panel.is_fresh(["AAAA.JK", "BBBB.JK"], now=now)
+
+
+def test_close_refetches_partial_bars(market, monkeypatch):
+    tickers = ["AAAA.JK", "BBBB.JK"]
+    first = data.load_panel(tickers, "1y")
+    last_day = market.last_day
+
+    # The session closes after the build, and the last bars turn out different
+    monkeypatch.setattr(panel_module, "last_close", lambda now=None: pd.Timestamp.now(tz=WIB) + pd.Timedelta(seconds=1))
+    bars = market.bars
+    monkeypatch.setattr(market, "bars", lambda symbol: bars(symbol).assign(Close=lambda h: h["Close"] + 1))
+    calls = len(market.calls)
+    assert not data.is_panel_fresh(tickers, "1y")
+
+    panel = data.load_panel(tickers, "1y")
+    assert panel is not first
+    assert [call["start"] for call in market.calls[calls:]] == [last_day]
+    for symbol in tickers:
+        assert panel.history(symbol)["Close"].iloc[-1] == bars(symbol)["Close"].iloc[-1] + 1
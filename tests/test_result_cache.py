@@ -0,0 +1,68 @@
+"""Result cache keys and the pruning of stored result files."""
+import os
+import time
+
+import pandas as pd
+
+import data
+import result_cache
+from result_cache import ResultCache, scan_key
+from results import Field, ResultBatch
+
+TICKERS = [f"R{i:02d}.JK" for i in range(10)]
+
+
+def _result(n=1):
+    return ResultBatch.from_rows([Field("symbol", "str"), Field("close", "float")], [(f"S{i}", 1.0) for i in range(n)])
+
+
+def test_key_changes_with_a_new_bar(market):
+    key = scan_key("1", TICKERS)
+    assert scan_key("1", TICKERS) == key
+
+    market.last_day += pd.Timedelta(days=1)
+    data.load_panel(TICKERS, "1y", refresh=True)
+    assert scan_key("1", TICKERS) != key
+
+
+def test_key_depends_on_mode_universe_and_version(market, monkeypatch):
+    key = scan_key("1", TICKERS)
+    assert scan_key("2", TICKERS) != key
+    assert scan_key("1", TICKERS[:-1]) != key
+    assert scan_key("1", TICKERS, rule="close > sma(50)") == scan_key("1", TICKERS, rule="close>sma( 50 )")
+
+    monkeypatch.setattr(result_cache, "RESULT_VERSION", result_cache.RESULT_VERSION + 1)
+    assert scan_key("1", TICKERS) != key
+
+
+def test_round_trip_through_disk(tmp_path):
+    ResultCache(root=str(tmp_path)).put("k", _result(3))
+    # Another worker only has the file
+    assert ResultCache(root=str(tmp_path)).get("k").records() == _result(3).records()
+
+
+def _age(cache, key, seconds):
+    path = os.path.join(cache.root, key + ".json")
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_prune_drops_expired_files(tmp_path):
+    cache = ResultCache(root=str(tmp_path), max_age=3600)
+    cache.put("old", _result())
+    _age(cache, "old", 7200)
+    cache.put("new", _result())
+    assert sorted(os.listdir(tmp_path)) == ["new.json"]
+
+
+def test_prune_keeps_the_newest_files(tmp_path):
+    cache = ResultCache(root=str(tmp_path), max_files=3)
+    for i in range(5):
+        cache.put(f"k{i}", _result())
+        _age(cache, f"k{i}", 100 - i)
+    cache.put("k5", _result())
+    assert sorted(os.listdir(tmp_path)) == ["k3.json", "k4.json", "k5.json"]
+    # Leftover temp files of other writers are not counted or removed
+    (tmp_path / "k9.json.123.tmp").write_text("{}")
+    cache.put("k6", _result())
+    assert sorted(os.listdir(tmp_path)) == ["k4.json", "k5.json", "k6.json", "k9.json.123.tmp"]
@@ -0,0 +1,193 @@
+"""Rule parsing, canonical keys, shared indicators and the built-in rules."""
+import math
+from datetime import timedelta
+
+import pytest
+
+import engine
+import kernels
+from data import load_panel
+from indicators import add_ma20_ma50_for_close, add_mode4_indicators, add_sma_and_llv_prev
+from rules import RuleError, compile_rule, mode4_rule, parse
+
+TICKERS = [f"R{i:02d}.JK" for i in range(60)]
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ("", "Empty rule"),
+        ("close > 5 $", "Unexpected character '$'"),
+        ("close > (sma(50)", "Expected"),
+        ("price > 5", "Unknown column 'price'"),
+        ("close > wma(20)", "Unknown function 'wma'"),
+        ("close > sma(close, 20, 3)", "takes at most 2 arguments"),
+        ("close > sma()", "needs a window length"),
+        ("close > sma(2.5)", "must be a positive whole number"),
+        ("close > sma(0)", "must be a positive whole number"),
+        ("close > weekly(monthly(close))", "cannot contain another timeframe function"),
+        ("close + 1", "A rule must be a condition"),
+        ("cross_date(sma(20), sma(50)) > 5", "is a date"),
+    ],
+)
+def test_parse_errors(text, message):
+    with pytest.raises(RuleError, match=message.replace("(", r"\(").replace("$", r"\$")):
+        compile_rule(text)
+
+
+def test_rule_error_is_a_value_error():
+    # The API reports both as a bad request
+    with pytest.raises(ValueError):
+        parse("close >")
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("close > sma(50)", "  CLOSE>SMA( close , 50 ) "),
+        ("close > sma(50) and volume > 1e6", "(close > sma(50)) and (volume > 1000000)"),
+        ("llv(5) < close", "llv(low, 5) < close"),
+        ("prev(close) > 2.0", "prev(close, 1) > 2"),
+    ],
+)
+def test_spelling_does_not_change_the_key(a, b):
+    assert compile_rule(a).key == compile_rule(b).key
+
+
+def test_different_rules_have_different_keys():
+    assert compile_rule("close > sma(50)").key != compile_rule("close > sma(20)").key
+    assert compile_rule("close > sma(50)").key != compile_rule("close >= sma(50)").key
+
+
+def test_shared_subexpressions_are_computed_once(market, monkeypatch):
+    windows = []
+    sma = kernels.sma
+
+    def counting(values, window):
+        windows.append(window)
+        return sma(values, window)
+
+    monkeypatch.setattr(kernels, "sma", counting)
+    wide = engine.load_wide(TICKERS[:10], fields=("Close", "Volume"))
+    rule = compile_rule("close > sma(50) and sma(50) > sma(150) and close * volume > sma(50) * volume")
+    ev = engine.evaluator(wide)
+    engine.evaluate_rule(rule, wide, ev)
+    assert sorted(windows) == [50, 150]
+
+    # A second rule on the same Evaluator reuses what the first computed;
+    # rsi(14) averages the gains and the losses
+    engine.evaluate_rule(mode4_rule(), wide, ev)
+    assert sorted(windows) == [14, 14, 20, 50, 150, 200]
+    frame = ev.frame(parse("sma(50) > 0").left)
+    assert ev.frame(parse("SMA( close,50 ) > 0").left) is frame
+
+
+# The per-symbol scanners the built-in rules replaced, on the same panel
+
+
+def _golden_cross(hist, lookback_days):
+    hist = add_ma20_ma50_for_close(hist[["Close"]].copy())
+    valid = hist.loc[hist["MA20"].notna() & hist["MA50"].notna()]
+    if valid.empty:
+        return None
+    crosses = valid[(valid["MA20"] > valid["MA50"]).astype(int).diff() == 1]
+    if crosses.empty or crosses.index[-1] < valid.index[-1] - timedelta(days=lookback_days):
+        return None
+    return float(valid["Close"].iloc[-1]), crosses.index[-1].date()
+
+
+def _llv_sma_value(hist, llv_window, sma_period, near_low, near_high, min_value):
+    df = add_sma_and_llv_prev(hist[["Close", "Low", "Volume"]].copy(), sma_period, llv_window).dropna()
+    if df.empty:
+        return None
+    last = df.iloc[-1]
+    close, sma, value = float(last["Close"]), float(last["SMA"]), float(last["Close"] * last["Volume"])
+    if last["LLV_prev"] > sma and sma * near_low <= close <= sma * near_high and value >= min_value:
+        return close, sma, value, df.index[-1].date()
+    return None
+
+
+def _mode4(hist):
+    df = add_mode4_indicators(hist[["Close", "Volume"]].copy()).dropna()
+    if len(df) < 20:
+        return None
+    last = df.iloc[-1]
+    value = float(last["Close"] * last["Volume"])
+    if not (last["Close"] > last["SMA50"] > last["SMA150"] > last["SMA200"] and value >= 1e9):
+        return None
+    sma = [float(last[f"SMA{period}"]) for period in (20, 50, 150, 200)]
+    return float(last["Close"]), *sma, value, float(last["RSI14"]), df.index[-1].date()
+
+
+def _lower_low(hist):
+    df = hist[["Low", "Close"]].dropna()
+    if len(df) < 3:
+        return None
+    lows = df["Low"].iloc[-3:].tolist()
+    if lows[0] > lows[1] > lows[2]:
+        return float(df["Close"].iloc[-1]), *lows, df.index[-1].date()
+    return None
+
+
+def _baseline(scan, *args):
+    panel = load_panel(TICKERS, "1y")
+    rows = []
+    for symbol in TICKERS:
+        found = scan(panel.history(symbol), *args)
+        if found is not None:
+            rows.append((symbol, *found))
+    return rows
+
+
+def _assert_same(found, expected):
+    assert [row[0] for row in found] == [row[0] for row in expected]
+    for row, ref in zip(found, expected):
+        assert len(row) == len(ref)
+        for value, want in zip(row, ref):
+            if isinstance(want, float):
+                assert math.isclose(value, want, rel_tol=1e-9), (row, ref)
+            else:
+                assert value == want, (row, ref)
+
+
+@pytest.mark.parametrize("lookback_days", [5, 60])
+def test_golden_cross_rule_matches_the_baseline(market, lookback_days):
+    expected = _baseline(_golden_cross, lookback_days)
+    if lookback_days == 60:
+        assert expected
+    wide = engine.load_wide(TICKERS, fields=("Close",))
+    _assert_same(engine.golden_cross(wide, lookback_days), expected)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        (5, 50, 0.99, 1.02, 1e9),
+        (5, 200, 0.99, 1.02, 1e9),
+        (2, 20, 0.8, 1.3, 0),
+    ],
+)
+def test_llv_sma_value_rule_matches_the_baseline(market, params):
+    expected = _baseline(_llv_sma_value, *params)
+    if params[-1] == 0:
+        assert expected
+    wide = engine.load_wide(TICKERS)
+    _assert_same(engine.llv_sma_value(wide, *params), expected)
+
+
+def test_mode4_rule_matches_the_baseline(market):
+    expected = _baseline(_mode4)
+    assert expected
+    wide = engine.load_wide(TICKERS, fields=("Close", "Volume"))
+    # Values agree up to rounding (see Rule.window); symbols and dates exactly
+    found = engine.mode4_combo(wide)
+    assert [(row[0], row[-1]) for row in found] == [(row[0], row[-1]) for row in expected]
+    for row, ref in zip(found, expected):
+        assert all(math.isclose(a, b, rel_tol=1e-6) for a, b in zip(row[1:-1], ref[1:-1]))
+
+
+def test_lower_low_rule_matches_the_baseline(market):
+    expected = _baseline(_lower_low)
+    assert expected
+    wide = engine.load_wide(TICKERS, fields=("Low", "Close"))
+    _assert_same(engine.lower_low_3days(wide), expected)
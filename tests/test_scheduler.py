@@ -0,0 +1,64 @@
+"""Pre-warm runs against the offline market."""
+import json
+
+import pandas as pd
+
+import data
+import scheduler
+from result_cache import SCAN_PERIOD, peek_result
+from scanners import MODES
+
+
+def _universes(tmp_path):
+    lists = {"a.json": [f"A{i:02d}.JK" for i in range(20)], "b.json": [f"A{i:02d}.JK" for i in range(10, 30)]}
+    for name, tickers in lists.items():
+        (tmp_path / name).write_text(json.dumps(tickers))
+    return {str(tmp_path / name): tickers for name, tickers in lists.items()}
+
+
+def test_prewarm_leaves_warm_panels_and_results(market, tmp_path):
+    universes = _universes(tmp_path)
+    status = scheduler.Prewarmer(universes=list(universes), at="16:30").run_once()
+    assert status["state"] == "ok" and status["symbols"] == 30
+
+    # Shared symbols are downloaded once
+    fetched = market.symbols_fetched()
+    assert len(fetched) == len(set(fetched)) == 30
+
+    calls = len(market.calls)
+    for tickers in universes.values():
+        assert data.is_panel_fresh(tickers, SCAN_PERIOD)
+        for mode in MODES:
+            assert peek_result(mode, tickers) is not None
+    assert len(market.calls) == calls
+
+
+def test_prewarmed_panel_is_fresh_until_the_next_close(market, tmp_path):
+    universes = _universes(tmp_path)
+    scheduler.Prewarmer(universes=list(universes), at="16:30").run_once()
+    panel = data.load_panel(next(iter(universes.values())), SCAN_PERIOD)
+
+    built = pd.Timestamp(panel.built_at).tz_convert("Asia/Jakarta")
+    close = built.normalize() + pd.Timedelta(hours=16)
+    if close <= built:
+        close += pd.Timedelta(days=1)
+    while close.weekday() >= 5:
+        close += pd.Timedelta(days=1)
+    assert panel.is_fresh(panel.symbols, now=close - pd.Timedelta(minutes=1))
+    assert not panel.is_fresh(panel.symbols, now=close)
+
+
+def test_run_before_the_close_is_flagged():
+    wednesday = pd.Timestamp("2026-10-14 09:00", tz="Asia/Jakarta")
+    assert scheduler.Prewarmer(at="16:30")._runs_after_close(wednesday)
+    assert not scheduler.Prewarmer(at="15:00")._runs_after_close(wednesday)
+
+
+def test_run_is_skipped_while_another_process_refreshes(market, tmp_path):
+    held = scheduler._acquire_run_lock()
+    try:
+        status = scheduler.Prewarmer(universes=list(_universes(tmp_path))).run_once()
+    finally:
+        held.close()
+    assert status["state"] == "skipped"
+    assert not market.calls